@@ -0,0 +1,256 @@
+# gold_admin_telega.py
+"""
+Сводная статистика по всем планам: сколько пользователей и планов,
+сколько грамм запланировано, распределение месячных бюджетов.
+
+Файлы plans_user_*.json обходятся потоково (os.scandir), читаются
+несколькими потоками с ограниченным числом файлов в работе, агрегаты
+считаются инкрементально — в памяти только счётчики, а не планы.
+Результат кэшируется на STATS_TTL_SEC.
+
+    python gold_admin_telega.py stats [--data-dir DIR] [--workers 8] [--json]
+
+В боте: /stats (только ADMIN_IDS), /stats refresh — пересчитать сразу.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import gold_core_telega
+
+logger = logging.getLogger(__name__)
+
+STATS_TTL_SEC = float(os.getenv("STATS_TTL_SEC", "300"))
+DEFAULT_WORKERS = 8
+# верхние границы корзин бюджета (в валюте плана), последняя — всё остальное
+BUDGET_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+_PLANS_FILE_RE = re.compile(r"^plans_user_(-?\d+)\.json$")
+
+
+@dataclass
+class CurrencyStats:
+    plans: int = 0
+    budget_total: float = 0.0
+    budget_min: float = float("inf")
+    budget_max: float = 0.0
+    buckets: List[int] = field(default_factory=lambda: [0] * (len(BUDGET_BUCKETS) + 1))
+
+    def add(self, budget: float) -> None:
+        self.plans += 1
+        self.budget_total += budget
+        self.budget_min = min(self.budget_min, budget)
+        self.budget_max = max(self.budget_max, budget)
+        self.buckets[bisect_right(BUDGET_BUCKETS, budget)] += 1
+
+    def merge(self, other: "CurrencyStats") -> None:
+        self.plans += other.plans
+        self.budget_total += other.budget_total
+        self.budget_min = min(self.budget_min, other.budget_min)
+        self.budget_max = max(self.budget_max, other.budget_max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+
+@dataclass
+class PlanStats:
+    users: int = 0
+    plans: int = 0
+    empty_users: int = 0
+    broken_files: int = 0
+    plan_months: int = 0
+    grams_by_instrument: Dict[str, float] = field(default_factory=dict)
+    by_currency: Dict[str, CurrencyStats] = field(default_factory=dict)
+    computed_at: float = 0.0
+    scan_seconds: float = 0.0
+
+    def merge(self, other: "PlanStats") -> None:
+        self.users += other.users
+        self.plans += other.plans
+        self.empty_users += other.empty_users
+        self.broken_files += other.broken_files
+        self.plan_months += other.plan_months
+        for inst, grams in other.grams_by_instrument.items():
+            self.grams_by_instrument[inst] = self.grams_by_instrument.get(inst, 0.0) + grams
+        for cur, cs in other.by_currency.items():
+            self.by_currency.setdefault(cur, CurrencyStats()).merge(cs)
+
+    def to_json(self) -> dict:
+        return {
+            "users": self.users,
+            "plans": self.plans,
+            "empty_users": self.empty_users,
+            "broken_files": self.broken_files,
+            "plan_months": self.plan_months,
+            "grams_by_instrument": self.grams_by_instrument,
+            "by_currency": {
+                cur: {
+                    "plans": cs.plans,
+                    "budget_total": cs.budget_total,
+                    "budget_avg": cs.budget_total / cs.plans if cs.plans else 0.0,
+                    "budget_min": cs.budget_min if cs.plans else 0.0,
+                    "budget_max": cs.budget_max,
+                    "buckets": dict(zip(_bucket_labels(), cs.buckets)),
+                }
+                for cur, cs in sorted(self.by_currency.items())
+            },
+            "computed_at": self.computed_at,
+            "scan_seconds": self.scan_seconds,
+        }
+
+
+def _bucket_labels() -> List[str]:
+    bounds = (0,) + BUDGET_BUCKETS
+    return [f"{lo}-{hi}" for lo, hi in zip(bounds, BUDGET_BUCKETS)] + [f"{BUDGET_BUCKETS[-1]}+"]
+
+
+# ========= ОБХОД ФАЙЛОВ =========
+
+def iter_plan_files(data_dir: Path) -> Iterator[Path]:
+    """Файлы планов по одному, без построения полного списка каталога."""
+    try:
+        with os.scandir(data_dir) as it:
+            for entry in it:
+                if entry.is_file() and _PLANS_FILE_RE.match(entry.name):
+                    yield Path(entry.path)
+    except FileNotFoundError:
+        return
+
+
+def iter_user_ids(data_dir: Path) -> Iterator[int]:
+    """id пользователей с файлом планов, в порядке каталога."""
+    for path in iter_plan_files(data_dir):
+        yield int(_PLANS_FILE_RE.match(path.name).group(1))
+
+
+def summarize_file(path: Path) -> PlanStats:
+    """Агрегаты одного пользователя; читаем сырой JSON, ChildPlan не строим."""
+    stats = PlanStats(users=1)
+    try:
+        schema, raw = gold_core_telega.split_plans_file(gold_core_telega.json_loads(path.read_bytes()))
+    except (OSError, ValueError, KeyError, AttributeError):
+        stats.users = 0
+        stats.broken_files = 1
+        return stats
+    if not raw:
+        stats.empty_users = 1
+    for obj in raw.values():
+        try:
+            budget = float(obj["monthly_budget_eur"])
+            if schema == 1:
+                rows = obj["plan_rows"]
+                grams = sum(float(r["grams_for_budget"]) for r in rows)
+            else:
+                rows = obj["rows"]["grams"]
+                grams = float(sum(rows))
+        except (KeyError, TypeError, ValueError):
+            continue
+        currency = obj.get("currency", "EUR")
+        instrument = obj.get("instrument", "XAU")
+        stats.plans += 1
+        stats.plan_months += len(rows)
+        stats.grams_by_instrument[instrument] = stats.grams_by_instrument.get(instrument, 0.0) + grams
+        stats.by_currency.setdefault(currency, CurrencyStats()).add(budget)
+    return stats
+
+
+def compute_stats(data_dir: Optional[Path] = None, workers: int = DEFAULT_WORKERS) -> PlanStats:
+    """
+    Параллельный проход по каталогу. В работе не больше workers * 4 файлов:
+    память не растёт с числом пользователей.
+    """
+    data_dir = data_dir or gold_core_telega.DATA_DIR
+    t0 = time.perf_counter()
+    total = PlanStats()
+    max_in_flight = max(1, workers) * 4
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="stats") as pool:
+        in_flight: deque = deque()
+        for path in iter_plan_files(data_dir):
+            in_flight.append(pool.submit(summarize_file, path))
+            if len(in_flight) >= max_in_flight:
+                total.merge(in_flight.popleft().result())
+        while in_flight:
+            total.merge(in_flight.popleft().result())
+    total.computed_at = time.time()
+    total.scan_seconds = time.perf_counter() - t0
+    return total
+
+
+# ========= КЭШ =========
+
+class StatsCache:
+    def __init__(self, ttl_sec: float = STATS_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._value: Optional[Tuple[Path, PlanStats]] = None
+        self._lock = threading.Lock()
+
+    def get(self, data_dir: Optional[Path] = None, refresh: bool = False) -> PlanStats:
+        data_dir = data_dir or gold_core_telega.DATA_DIR
+        # один пересчёт за раз: параллельные /stats ждут его, а не сканируют заново
+        with self._lock:
+            cached = self._value
+            if (
+                not refresh
+                and cached is not None
+                and cached[0] == data_dir
+                and time.time() - cached[1].computed_at < self.ttl_sec
+            ):
+                return cached[1]
+            stats = compute_stats(data_dir)
+            self._value = (data_dir, stats)
+            logger.info("Plan stats: %d users, %d plans in %.2fs", stats.users, stats.plans, stats.scan_seconds)
+            return stats
+
+
+_cache = StatsCache()
+
+
+def get_stats(refresh: bool = False) -> PlanStats:
+    return _cache.get(refresh=refresh)
+
+
+def render_stats(stats: PlanStats) -> str:
+    age = max(0.0, time.time() - stats.computed_at)
+    lines = [
+        f"users: {stats.users} (without plans: {stats.empty_users}, unreadable files: {stats.broken_files})",
+        f"plans: {stats.plans}, plan months: {stats.plan_months}",
+        "grams planned: " + (
+            ", ".join(f"{inst} {g:.1f} g" for inst, g in sorted(stats.grams_by_instrument.items())) or "-"
+        ),
+    ]
+    labels = _bucket_labels()
+    for cur, cs in sorted(stats.by_currency.items()):
+        avg = cs.budget_total / cs.plans if cs.plans else 0.0
+        lines.append(
+            f"{cur}: {cs.plans} plans, budget total {cs.budget_total:.0f}/month, "
+            f"avg {avg:.0f}, min {cs.budget_min:.0f}, max {cs.budget_max:.0f}"
+        )
+        lines.append("  " + ", ".join(f"{lbl}: {n}" for lbl, n in zip(labels, cs.buckets) if n))
+    lines.append(f"scanned in {stats.scan_seconds * 1000:.0f} ms, {age:.0f} s ago")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Aggregated statistics over all stored plans")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    st = sub.add_parser("stats")
+    st.add_argument("--data-dir", type=Path, default=None)
+    st.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    st.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    result = compute_stats(args.data_dir, args.workers)
+    if args.json:
+        print(json.dumps(result.to_json(), ensure_ascii=False, indent=2))
+    else:
+        print(render_stats(result))
@@ -0,0 +1,400 @@
+# gold_alerts_telega.py
+"""
+Ценовые алерты: "сообщи, когда грамм золота станет дешевле 60 EUR".
+
+* Пороги лежат в отсортированных индексах по (инструмент, валюта):
+  отдельно "ниже" и "выше". При новой книге цен сработавшие находятся
+  бисекцией — O(log n + k), без перебора всех подписок.
+* Новая книга приходит через add_refresh_listener в gold_market_telega;
+  раз в ALERT_CHECK_SEC цикл ещё и сам обновляет книги инструментов,
+  на которые есть алерты (иначе цены обновляются только от действий
+  пользователей).
+* Алерт одноразовый: сработал и доставлен — удалён. Уведомления уходят
+  одним сообщением на пользователя через BatchSender (token bucket); пока
+  идёт отправка, алерт не срабатывает повторно, а не доставленный
+  возвращается в индекс и сработает при следующей проверке.
+* Хранение: DATA_DIR/alerts/user_<id>.json, правка под блокировкой
+  пользователя из PlanStore. Индекс перестраивается, когда меняется
+  каталог (алерт мог добавить другой воркер); проверяет только лидер.
+
+    /alert below 60 [EUR] [XAU]   /alert above 80   /alert list   /alert off 2|all
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+from bisect import bisect_left, bisect_right
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import gold_core_telega
+import gold_i18n_telega as i18n
+from gold_market_telega import (
+    INSTRUMENTS,
+    PriceBook,
+    add_refresh_listener,
+    ensure_price_book,
+    remove_refresh_listener,
+)
+from gold_metrics_telega import counter, gauge
+from gold_scheduler_telega import BatchSender, SendReport, get_user_prefs, write_json_atomic
+from gold_shared_telega import get_plan_store
+
+logger = logging.getLogger(__name__)
+
+ALERT_CHECK_SEC = int(os.getenv("ALERT_CHECK_SEC", "300"))
+MAX_ALERTS_PER_USER = int(os.getenv("MAX_ALERTS_PER_USER", "10"))
+DIRECTIONS = ("below", "above")
+
+ALERTS_TRIGGERED = counter("gold_alerts_triggered_total", "Price alerts triggered", ["instrument", "direction"])
+
+AlertKey = Tuple[int, int]  # (user_id, номер алерта у пользователя)
+
+
+@dataclass
+class Alert:
+    user_id: int
+    alert_id: int
+    instrument: str
+    currency: str
+    direction: str
+    threshold: float
+
+    @property
+    def key(self) -> AlertKey:
+        return (self.user_id, self.alert_id)
+
+    def hit(self, price: float) -> bool:
+        return price <= self.threshold if self.direction == "below" else price >= self.threshold
+
+    @staticmethod
+    def from_json(user_id: int, obj: dict) -> "Alert":
+        return Alert(
+            user_id=user_id,
+            alert_id=int(obj["alert_id"]),
+            instrument=obj["instrument"],
+            currency=obj["currency"],
+            direction=obj["direction"],
+            threshold=float(obj["threshold"]),
+        )
+
+    def to_json(self) -> dict:
+        obj = asdict(self)
+        del obj["user_id"]
+        return obj
+
+
+# ========= ИНДЕКС =========
+
+class SortedThresholds:
+    """Пороги по возрастанию и параллельный список ключей алертов."""
+
+    def __init__(self):
+        self.values: List[float] = []
+        self.keys: List[AlertKey] = []
+
+    def add(self, value: float, key: AlertKey) -> None:
+        i = bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.keys.insert(i, key)
+
+    def remove(self, value: float, key: AlertKey) -> None:
+        i = bisect_left(self.values, value)
+        while i < len(self.values) and self.values[i] == value:
+            if self.keys[i] == key:
+                del self.values[i]
+                del self.keys[i]
+                return
+            i += 1
+
+    def at_or_above(self, price: float) -> List[AlertKey]:
+        return self.keys[bisect_left(self.values, price):]
+
+    def at_or_below(self, price: float) -> List[AlertKey]:
+        return self.keys[:bisect_right(self.values, price)]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class AlertIndex:
+    def __init__(self):
+        self.alerts: Dict[AlertKey, Alert] = {}
+        self._below: Dict[Tuple[str, str], SortedThresholds] = {}
+        self._above: Dict[Tuple[str, str], SortedThresholds] = {}
+
+    def _side(self, alert: Alert) -> SortedThresholds:
+        sides = self._below if alert.direction == "below" else self._above
+        return sides.setdefault((alert.instrument, alert.currency), SortedThresholds())
+
+    def add(self, alert: Alert) -> None:
+        self.remove(alert.key)
+        self.alerts[alert.key] = alert
+        self._side(alert).add(alert.threshold, alert.key)
+
+    def remove(self, key: AlertKey) -> Optional[Alert]:
+        alert = self.alerts.pop(key, None)
+        if alert is not None:
+            self._side(alert).remove(alert.threshold, key)
+        return alert
+
+    def currencies(self, instrument: str) -> List[str]:
+        return sorted({cur for inst, cur in [*self._below, *self._above] if inst == instrument})
+
+    def instruments(self) -> List[str]:
+        return sorted({alert.instrument for alert in self.alerts.values()})
+
+    def match(self, instrument: str, currency: str, price: float) -> List[Alert]:
+        """"Ниже" срабатывает, если порог >= цены; "выше" — если порог <= цены."""
+        keys: List[AlertKey] = []
+        below = self._below.get((instrument, currency))
+        if below is not None:
+            keys.extend(below.at_or_above(price))
+        above = self._above.get((instrument, currency))
+        if above is not None:
+            keys.extend(above.at_or_below(price))
+        return [self.alerts[k] for k in keys]
+
+    def __len__(self) -> int:
+        return len(self.alerts)
+
+
+# ========= ХРАНЕНИЕ =========
+
+def alerts_dir() -> Path:
+    d = gold_core_telega.ensure_data_dir() / "alerts"
+    d.mkdir(exist_ok=True)
+    return d
+
+
+def _user_file(user_id: int) -> Path:
+    return alerts_dir() / f"user_{user_id}.json"
+
+
+def load_user_alerts(user_id: int) -> List[Alert]:
+    try:
+        raw = json.loads(_user_file(user_id).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return []
+    return [Alert.from_json(user_id, obj) for obj in raw]
+
+
+def _save_user_alerts(user_id: int, alerts: List[Alert]) -> None:
+    path = _user_file(user_id)
+    if not alerts:
+        path.unlink(missing_ok=True)
+        return
+    write_json_atomic(path, [a.to_json() for a in alerts])
+
+
+def add_alert(user_id: int, instrument: str, currency: str, direction: str, threshold: float) -> Alert:
+    """ValueError, если у пользователя уже MAX_ALERTS_PER_USER алертов."""
+    with get_plan_store().lock(user_id):
+        alerts = load_user_alerts(user_id)
+        if len(alerts) >= MAX_ALERTS_PER_USER:
+            raise ValueError(f"at most {MAX_ALERTS_PER_USER} alerts per user")
+        alert = Alert(
+            user_id=user_id,
+            alert_id=max((a.alert_id for a in alerts), default=0) + 1,
+            instrument=instrument,
+            currency=currency,
+            direction=direction,
+            threshold=threshold,
+        )
+        _save_user_alerts(user_id, alerts + [alert])
+        return alert
+
+
+def remove_alerts(user_id: int, alert_ids: Optional[List[int]] = None) -> int:
+    """Удалить указанные (или все) алерты; возвращает сколько удалено."""
+    with get_plan_store().lock(user_id):
+        alerts = load_user_alerts(user_id)
+        keep = [] if alert_ids is None else [a for a in alerts if a.alert_id not in alert_ids]
+        if len(keep) != len(alerts):
+            _save_user_alerts(user_id, keep)
+        return len(alerts) - len(keep)
+
+
+def load_index(directory: Optional[Path] = None) -> AlertIndex:
+    index = AlertIndex()
+    with os.scandir(directory or alerts_dir()) as it:
+        for entry in it:
+            name = entry.name
+            if not (name.startswith("user_") and name.endswith(".json")):
+                continue
+            try:
+                user_id = int(name[5:-5])
+            except ValueError:
+                continue
+            for alert in load_user_alerts(user_id):
+                if not math.isfinite(alert.threshold):
+                    logger.warning("Alert %s of user %s has threshold %r, skipped", alert.alert_id, user_id, alert.threshold)
+                    continue
+                index.add(alert)
+    return index
+
+
+# ========= ПРОВЕРКА =========
+
+def render_triggered(alerts: List[Alert], prices: Dict[Tuple[str, str], float], lang: str) -> str:
+    lines = [i18n.t(lang, "alert.triggered_title")]
+    for a in alerts:
+        lines.append(
+            i18n.t(
+                lang, "alert.triggered_line", instrument=i18n.t(lang, f"instrument.{a.instrument}"),
+                price=prices[(a.instrument, a.currency)], cur=a.currency,
+                direction=i18n.t(lang, f"alert.{a.direction}"), threshold=a.threshold,
+            )
+        )
+    lines.append(i18n.t(lang, "alert.triggered_footer"))
+    return "\n".join(lines)
+
+
+class AlertManager:
+    def __init__(self, bot, sender: Optional[BatchSender] = None):
+        self.bot = bot
+        self.sender = sender or BatchSender(bot)
+        self.index = AlertIndex()
+        # сработавшие, уведомление о которых ещё отправляется
+        self._in_flight: Set[AlertKey] = set()
+        self._dir_stamp: Optional[int] = None
+        self._lock = asyncio.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def reload_if_changed(self) -> None:
+        """Перестроить индекс, если в каталоге что-то записали или удалили."""
+        stamp = os.stat(alerts_dir()).st_mtime_ns
+        if stamp != self._dir_stamp:
+            self.index = load_index()
+            self._dir_stamp = stamp
+
+    def _take_triggered(self, book: PriceBook) -> Tuple[List[Alert], Dict[Tuple[str, str], float]]:
+        self.reload_if_changed()
+        triggered: List[Alert] = []
+        prices: Dict[Tuple[str, str], float] = {}
+        for cur in self.index.currencies(book.instrument):
+            price = book.gram_price(cur)
+            if price is None:
+                continue
+            prices[(book.instrument, cur)] = price
+            triggered.extend(
+                a for a in self.index.match(book.instrument, cur, price) if a.key not in self._in_flight
+            )
+        for a in triggered:
+            self._in_flight.add(a.key)
+            self.index.remove(a.key)
+        return triggered, prices
+
+    def _settle(self, triggered: List[Alert], report: SendReport) -> None:
+        """Доставленные (и заблокировавшим бота) — удалить из файлов, остальные вернуть в индекс."""
+        done = set(report.delivered) | set(report.blocked)
+        by_user: Dict[int, List[int]] = {}
+        for a in triggered:
+            if a.user_id in done:
+                by_user.setdefault(a.user_id, []).append(a.alert_id)
+        for user_id, ids in by_user.items():
+            remove_alerts(user_id, ids)
+        failed_keys = {a.key for a in triggered if a.user_id not in done}
+        for user_id in {a.user_id for a in triggered if a.user_id not in done}:
+            # пока шла отправка, пользователь мог снять алерт сам — возвращаем только оставшиеся
+            for alert in load_user_alerts(user_id):
+                if alert.key in failed_keys:
+                    self.index.add(alert)
+        for a in triggered:
+            self._in_flight.discard(a.key)
+            if a.user_id in done:
+                self.index.remove(a.key)
+        # свои удаления уже в индексе — не перечитывать каталог из-за них
+        if by_user:
+            self._dir_stamp = os.stat(alerts_dir()).st_mtime_ns
+
+    async def check(self, book: PriceBook) -> SendReport:
+        # под блокировкой сработавшие помечаются как отправляемые — второй раз не сработают
+        async with self._lock:
+            triggered, prices = await asyncio.to_thread(self._take_triggered, book)
+        if not triggered:
+            return SendReport()
+        by_user: Dict[int, List[Alert]] = {}
+        for a in triggered:
+            by_user.setdefault(a.user_id, []).append(a)
+            ALERTS_TRIGGERED.inc(instrument=a.instrument, direction=a.direction)
+        prefs = get_user_prefs()
+        messages = [
+            (uid, render_triggered(alerts, prices, prefs.get(uid).get("lang", i18n.DEFAULT_LANG)))
+            for uid, alerts in by_user.items()
+        ]
+        report = SendReport()
+        try:
+            report = await self.sender.send_batch(messages)
+        finally:
+            async with self._lock:
+                await asyncio.to_thread(self._settle, triggered, report)
+        logger.info("%s alerts: %d triggered, %d users notified", book.instrument, len(triggered), report.sent)
+        return report
+
+    def on_refresh(self, book: PriceBook) -> None:
+        """Слушатель обновлений цен: вызывается в потоке, который обновил книгу."""
+        if self._loop is not None and not self._loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self.check(book), self._loop)
+
+    async def loop(self, interval: float = ALERT_CHECK_SEC) -> None:
+        self._loop = asyncio.get_running_loop()
+        add_refresh_listener(self.on_refresh)
+        try:
+            while True:
+                try:
+                    await asyncio.to_thread(self.reload_if_changed)
+                    for code in self.index.instruments():
+                        # устаревшая книга обновится и слушатель проверит её сразу;
+                        # повторная проверка тут ловит алерты, добавленные после
+                        book = await asyncio.to_thread(ensure_price_book, code)
+                        await self.check(book)
+                except Exception:
+                    logger.exception("Alert check failed")
+                await asyncio.sleep(interval)
+        finally:
+            remove_refresh_listener(self.on_refresh)
+
+
+_manager: Optional[AlertManager] = None
+
+
+def start_alerts(bot) -> AlertManager:
+    global _manager
+    _manager = AlertManager(bot)
+    return _manager
+
+
+def _active_alerts() -> Dict[Tuple[str, ...], float]:
+    if _manager is None:
+        return {}
+    res: Dict[Tuple[str, ...], float] = {}
+    for alert in list(_manager.index.alerts.values()):
+        res[(alert.instrument,)] = res.get((alert.instrument,), 0) + 1
+    return res
+
+
+gauge("gold_alerts_active", "Active price alerts (leader only)", ["instrument"], _active_alerts)
+
+
+def parse_alert_args(args: List[str]) -> Optional[Tuple[str, float, str, str]]:
+    """below|above <цена> [валюта] [инструмент] -> (direction, threshold, currency, instrument)."""
+    if len(args) < 2 or args[0].lower() not in DIRECTIONS:
+        return None
+    try:
+        threshold = float(args[1].replace(",", "."))
+    except ValueError:
+        return None
+    # nan ломает порядок в SortedThresholds, inf не сработает никогда
+    if not math.isfinite(threshold) or threshold <= 0:
+        return None
+    currency, instrument = "EUR", "XAU"
+    for arg in args[2:]:
+        code = arg.upper()
+        if code in INSTRUMENTS:
+            instrument = code
+        else:
+            currency = code
+    return args[0].lower(), threshold, currency, instrument
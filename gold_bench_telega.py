@@ -0,0 +1,196 @@
+# gold_bench_telega.py
+"""
+Микробенчмарки расчётного ядра на синтетическом дневном ряду (по умолчанию 50 лет).
+
+    python gold_bench_telega.py                  # прогон и таблица
+    python gold_bench_telega.py --save           # + запись bench_results/<commit>.json
+    python gold_bench_telega.py --compare bench_results/abc1234.json
+"""
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+import gold_core_telega
+from gold_core_telega import (
+    filter_period,
+    pick_monthly_dates,
+    register_child,
+    load_all_plans,
+    save_all_plans,
+    average_monthly_return_with_target,
+    forecast_price,
+    load_price_history,
+    parse_stooq_csv,
+    parse_stooq_series,
+    PriceSeries,
+    Purchase,
+    GRAMS_PER_OUNCE,
+)
+from gold_fixtures_telega import FixtureServer, fixture_series, stooq_csv, synthetic_series
+
+RESULTS_DIR = Path("bench_results")
+
+
+# ========= ЗАМЕРЫ =========
+
+def measure(fn: Callable[[], object], repeat: int = 5, number: int = 1) -> Dict[str, float]:
+    """Минимум и медиана по repeat прогонам, миллисекунды на один вызов."""
+    fn()  # прогрев
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t0) / number * 1000)
+    return {"min_ms": min(samples), "median_ms": statistics.median(samples)}
+
+
+def heavy_plan(birth, points, child_id: str, purchases: int = 300):
+    plan = register_child(child_id, "Bench", birth, None, 255.0, points)
+    step = max(1, len(points) // purchases)
+    for p in points[::step][:purchases]:
+        plan.ledger.add(Purchase(p.date, 1.5, 1.5 * p.close / GRAMS_PER_OUNCE))
+    return plan
+
+
+def run_benchmarks(years: int = 50, repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    points = synthetic_series(years=years)
+    birth = points[0].date
+    end = points[-1].date
+    monthly = pick_monthly_dates(points)
+
+    plan = register_child("1", "Bench", birth, None, 255.0, points)
+    plans = {str(i): plan for i in range(5)}
+    rows = plan.plan_rows
+    n_months = len(rows)
+
+    results: Dict[str, Dict[str, float]] = {}
+    results["filter_period"] = measure(lambda: filter_period(points, birth, end), repeat)
+    results["pick_monthly_dates"] = measure(lambda: pick_monthly_dates(points), repeat)
+    results["register_child"] = measure(
+        lambda: register_child("1", "Bench", birth, None, 255.0, points), repeat
+    )
+
+    def forecast_loop():
+        # как в таблице рассрочки: по месяцу на шаг
+        avg_ret = average_monthly_return_with_target(rows, n_months)
+        for i in range(1, n_months + 1):
+            forecast_price(rows[-1].price_per_gram_eur, avg_ret, i)
+
+    results["forecast_price_loop"] = measure(forecast_loop, repeat)
+
+    # 100k алертов вокруг цены 60 (ниже — под ней, выше — над ней), цена
+    # колеблется на ±1: срабатывает малая доля, как при обычном обновлении
+    from gold_alerts_telega import Alert, AlertIndex
+
+    rnd = random.Random(7)
+    alerts = [
+        Alert(i, 1, "XAU", "EUR", "below", rnd.uniform(30.0, 60.0)) if i % 2 else
+        Alert(i, 1, "XAU", "EUR", "above", rnd.uniform(60.0, 90.0))
+        for i in range(100_000)
+    ]
+    index = AlertIndex()
+    for a in alerts:
+        index.add(a)
+    prices = [rnd.uniform(59.0, 61.0) for _ in range(100)]
+    results["alert_match_index"] = measure(
+        lambda: [index.match("XAU", "EUR", p) for p in prices], repeat
+    )
+    results["alert_match_scan"] = measure(
+        lambda: [[a for a in alerts if a.hit(p)] for p in prices], repeat
+    )
+
+    # разбор ответа Stooq: побайтовый путь сразу в колонки против csv + strptime
+    csv_text = stooq_csv(fixture_series("xaueur", years))
+    csv_bytes = csv_text.encode("utf-8")
+    results["stooq_parse_fast"] = measure(lambda: parse_stooq_series(csv_bytes), repeat)
+    results["stooq_parse_strict"] = measure(
+        lambda: PriceSeries.from_points(parse_stooq_csv(csv_text)), repeat
+    )
+
+    # загрузка и разбор ряда целиком через локальный сервер: без сети, каждый раз те же байты;
+    # страница Investing — вся история, а не месяц, как на сайте: меряется разбор HTML
+    with FixtureServer(years=years, investing_window=None) as fixtures:
+        results["price_history_stooq"] = measure(lambda: load_price_history("xaueur"), repeat)
+        fixtures.fail.add("stooq")
+        results["price_history_investing"] = measure(lambda: load_price_history("xaueur"), repeat)
+
+    old_dir = gold_core_telega.DATA_DIR
+    old_schema = gold_core_telega.PLANS_SCHEMA
+    with tempfile.TemporaryDirectory() as tmp:
+        gold_core_telega.DATA_DIR = Path(tmp)
+        try:
+            results["save_all_plans"] = measure(lambda: save_all_plans(plans, 1), repeat)
+            results["load_all_plans"] = measure(lambda: load_all_plans(1), repeat)
+            # тяжёлый пользователь: 10 детей, у каждого 300 покупок; схема 1 против 2
+            heavy = {str(i): heavy_plan(birth, points, str(i)) for i in range(10)}
+            for schema in (1, 2):
+                gold_core_telega.PLANS_SCHEMA = schema
+                results[f"save_heavy_v{schema}"] = measure(lambda: save_all_plans(heavy, 2), repeat)
+                results[f"load_heavy_v{schema}"] = measure(lambda: load_all_plans(2), repeat)
+        finally:
+            gold_core_telega.DATA_DIR = old_dir
+            gold_core_telega.PLANS_SCHEMA = old_schema
+
+    results["_meta"] = {"points": len(points), "months": len(monthly), "years": years}
+    return results
+
+
+# ========= СОХРАНЕНИЕ И СРАВНЕНИЕ =========
+
+def current_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def save_results(results: Dict, commit: str) -> Path:
+    RESULTS_DIR.mkdir(exist_ok=True)
+    path = RESULTS_DIR / f"{commit}.json"
+    path.write_text(json.dumps({"commit": commit, "results": results}, indent=2), encoding="utf-8")
+    return path
+
+
+def print_table(results: Dict, baseline: Dict = None) -> None:
+    print(f"{'benchmark':<24}{'min ms':>12}{'median ms':>12}" + (f"{'vs base':>10}" if baseline else ""))
+    for name, r in results.items():
+        if name.startswith("_"):
+            continue
+        line = f"{name:<24}{r['min_ms']:>12.3f}{r['median_ms']:>12.3f}"
+        if baseline and name in baseline:
+            ratio = r["min_ms"] / baseline[name]["min_ms"] if baseline[name]["min_ms"] else float("nan")
+            line += f"{ratio:>9.2f}x"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Core micro-benchmarks")
+    parser.add_argument("--years", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", action="store_true", help="записать результат по текущему коммиту")
+    parser.add_argument("--compare", type=Path, help="файл результатов для сравнения")
+    args = parser.parse_args()
+
+    results = run_benchmarks(years=args.years, repeat=args.repeat)
+    baseline = None
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))["results"]
+    meta = results["_meta"]
+    print(f"Series: {meta['points']} daily points, {meta['months']} months ({meta['years']} years)")
+    print_table(results, baseline)
+    if args.save:
+        print(f"Saved to {save_results(results, current_commit())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# gold_charts_telega.py
+"""
+Графики по ребёнку в PNG для пункта меню «📈 Графики».
+
+* plan  — накопленные граммы по плану и купленные по журналу покупок;
+* price — цена грамма за период плана и прогноз на FORECAST_HORIZON месяцев
+  с коридором ±1σ месячных изменений цены.
+
+Рисует matplotlib (опционально: pip install matplotlib) через Figure +
+FigureCanvasAgg — без pyplot и без окна, — в пуле вычислений
+(gold_compute_telega), цикл событий отрисовку не ждёт. Готовые PNG лежат
+в LRU по (пользователь, ребёнок, вид, язык, версия плана, версия книги цен).
+Отправка — через gold_uploads_telega: одинаковые байты повторно уходят
+по file_id, без загрузки.
+
+Настройки: CHART_CACHE_MB — предел памяти под PNG.
+"""
+import calendar
+import io
+import math
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from gold_compute_telega import get_compute
+from gold_core_telega import GRAMS_PER_OUNCE, ChildPlan, forecast_price
+import gold_i18n_telega as i18n
+from gold_market_telega import PriceSourceError, get_price_book
+from gold_metrics_telega import cache_hit
+from gold_views_telega import ChildView
+
+CHART_CACHE_MB = float(os.getenv("CHART_CACHE_MB", "32"))
+KINDS = ("plan", "price")
+FORECAST_HORIZON = 24
+MAX_PRICE_POINTS = 1500  # дневной ряд за 20 лет прореживаем: на 800 px больше не видно
+
+ChartKey = Tuple[int, str, str, str, int, Optional[int]]
+
+
+class ChartsUnavailable(Exception):
+    """matplotlib не установлен."""
+
+
+@lru_cache(maxsize=None)
+def charts_available() -> bool:
+    try:
+        import matplotlib  # noqa: F401  # опционально: pip install matplotlib
+    except ImportError:
+        return False
+    return True
+
+
+# ========= ОТРИСОВКА (в воркере) =========
+
+def _new_figure():
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 4.5), dpi=100)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def _png(fig) -> bytes:
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def _dates(ordinals: Sequence[int]) -> List[date]:
+    return [date.fromordinal(o) for o in ordinals]
+
+
+def render_plan_chart(
+    plan_x: Sequence[int],
+    plan_y: Sequence[float],
+    fact_x: Sequence[int],
+    fact_y: Sequence[float],
+    labels: Dict[str, str],
+) -> bytes:
+    """Накопленные граммы: план ступеньками по месяцам, покупки — точками."""
+    fig, ax = _new_figure()
+    ax.step(_dates(plan_x), plan_y, where="post", label=labels["planned"], color="#c9a227")
+    if fact_x:
+        ax.step(_dates(fact_x), fact_y, where="post", label=labels["bought"], color="#2e7d32", marker="o", ms=3)
+    ax.set_title(labels["title"])
+    ax.set_ylabel(labels["grams"])
+    ax.grid(alpha=0.3)
+    ax.legend(loc="upper left")
+    return _png(fig)
+
+
+def render_price_chart(
+    hist_x: Sequence[int],
+    hist_y: Sequence[float],
+    fc_x: Sequence[int],
+    fc_mid: Sequence[float],
+    fc_lo: Sequence[float],
+    fc_hi: Sequence[float],
+    labels: Dict[str, str],
+) -> bytes:
+    """История цены грамма и прогноз с коридором."""
+    fig, ax = _new_figure()
+    ax.plot(_dates(hist_x), hist_y, label=labels["price"], color="#c9a227", lw=1)
+    if fc_x:
+        xs = _dates(fc_x)
+        ax.fill_between(xs, fc_lo, fc_hi, color="#1565c0", alpha=0.15, label=labels["band"])
+        ax.plot(xs, fc_mid, color="#1565c0", ls="--", label=labels["forecast"])
+    ax.set_title(labels["title"])
+    ax.set_ylabel(labels["unit"])
+    ax.grid(alpha=0.3)
+    ax.legend(loc="upper left")
+    return _png(fig)
+
+
+# ========= ДАННЫЕ ДЛЯ ГРАФИКОВ =========
+
+def plan_chart_args(plan: ChildPlan, view: ChildView, lang: str) -> tuple:
+    plan_x = [r.date.toordinal() for r in plan.plan_rows]
+    ledger = plan.ledger
+    labels = {
+        "title": i18n.t(lang, "chart.plan_title", name=plan.name),
+        "grams": i18n.t(lang, "chart.grams"),
+        "planned": i18n.t(lang, "chart.planned"),
+        "bought": i18n.t(lang, "chart.bought"),
+    }
+    return plan_x, view.plan_prefix[1:], list(ledger.ordinals), ledger.cum_grams[1:], labels
+
+
+def monthly_sigma(prices: Sequence[float]) -> float:
+    """Стандартное отклонение месячных лог-изменений цены по строкам плана."""
+    rets = [math.log(b / a) for a, b in zip(prices, prices[1:]) if a > 0 and b > 0]
+    if len(rets) < 2:
+        return 0.0
+    mean = sum(rets) / len(rets)
+    return math.sqrt(sum((r - mean) ** 2 for r in rets) / (len(rets) - 1))
+
+
+def _add_months(d: date, months: int) -> date:
+    y, m = divmod(d.month - 1 + months, 12)
+    year, month = d.year + y, m + 1
+    return date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+
+def price_chart_args(plan: ChildPlan, view: ChildView, lang: str) -> tuple:
+    rows = plan.plan_rows
+    hist_x: List[int] = [r.date.toordinal() for r in rows]
+    hist_y: List[float] = [r.price_per_gram_eur for r in rows]
+    # дневной ряд из книги цен подробнее месячных строк плана, если он есть
+    book = get_price_book(plan.instrument)
+    if book is not None:
+        try:
+            series = book.series(plan.currency)
+        except PriceSourceError:
+            series = None
+        if series is not None and len(series):
+            lo = bisect_left(series.ordinals, rows[0].date.toordinal())
+            step = max(1, (len(series) - lo) // MAX_PRICE_POINTS)
+            hist_x = list(series.ordinals[lo::step])
+            hist_y = [c / GRAMS_PER_OUNCE for c in series.closes[lo::step]]
+
+    fc_x: List[int] = []
+    fc_mid: List[float] = []
+    fc_lo: List[float] = []
+    fc_hi: List[float] = []
+    if len(rows) >= 2:
+        sigma = monthly_sigma([r.price_per_gram_eur for r in rows])
+        start = rows[-1].date
+        for m in range(FORECAST_HORIZON + 1):
+            mid = forecast_price(view.last_price, view.avg_ret, m, view.eur_rate)
+            spread = math.exp(sigma * math.sqrt(m))
+            fc_x.append(_add_months(start, m).toordinal())
+            fc_mid.append(mid)
+            fc_lo.append(mid / spread)
+            fc_hi.append(mid * spread)
+
+    labels = {
+        "title": i18n.t(lang, "chart.price_title", instrument=i18n.t(lang, f"instrument.{plan.instrument}")),
+        "unit": i18n.t(lang, "chart.unit", cur=plan.currency),
+        "price": i18n.t(lang, "chart.price"),
+        "forecast": i18n.t(lang, "chart.forecast"),
+        "band": i18n.t(lang, "chart.band"),
+    }
+    return hist_x, hist_y, fc_x, fc_mid, fc_lo, fc_hi, labels
+
+
+_RENDERERS = {
+    "plan": (plan_chart_args, render_plan_chart),
+    "price": (price_chart_args, render_price_chart),
+}
+
+
+# ========= КЭШ КАРТИНОК =========
+
+class ChartCache:
+    """LRU PNG по ключу версий; предел — суммарный размер картинок."""
+
+    def __init__(self, max_bytes: int = int(CHART_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[ChartKey, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: ChartKey) -> Optional[bytes]:
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+        cache_hit("chart", png is not None)
+        return png
+
+    def put(self, key: ChartKey, png: bytes) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = png
+            self.size += len(png)
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_cache = ChartCache()
+
+
+def get_chart_cache() -> ChartCache:
+    return _cache
+
+
+async def get_chart(user_id: int, plan: ChildPlan, view: ChildView, kind: str, lang: str) -> bytes:
+    """
+    PNG из кэша или новая отрисовка в пуле вычислений.
+    Ошибки пула (ComputeError) пробрасываются; без matplotlib — ChartsUnavailable.
+    """
+    if not charts_available():
+        raise ChartsUnavailable("matplotlib is not installed")
+    book = get_price_book(plan.instrument)
+    key = (user_id, plan.child_id, kind, lang, plan.version, book.version if book is not None else None)
+    png = _cache.get(key)
+    if png is None:
+        prepare, render = _RENDERERS[kind]
+        png = await get_compute().run(render, *prepare(plan, view, lang))
+        _cache.put(key, png)
+    return png
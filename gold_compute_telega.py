@@ -0,0 +1,355 @@
+# gold_compute_telega.py
+"""
+Вынос тяжёлых расчётов из цикла asyncio в пул процессов.
+
+* ComputeExecutor.run(fn, *args) — выполняет функцию в ProcessPoolExecutor
+  с ограничением числа задач в работе (ComputeBusyError) и таймаутом на
+  задачу (ComputeTimeoutError).
+* Ряды цен публикуются в multiprocessing.shared_memory (SeriesHandle);
+  воркер подключается к сегменту один раз и держит его вместе с сеткой
+  месяцев (MonthlyGrid), поэтому ряд не сериализуется в каждую задачу и
+  не разворачивается в точки. Новая книга цен — новый сегмент: воркеры
+  греются им сразу при публикации, а старый сегмент того же ряда
+  отключают, как только увидят новый.
+* Мелкие задачи (size не больше COMPUTE_INLINE_MAX) считаются прямо в
+  цикле событий: пересылка в воркер и обратно дороже самого расчёта.
+  План на столько месяцев тоже строится на месте, по сетке месяцев,
+  которую процесс бота держит для каждого опубликованного ряда.
+
+Настройки: COMPUTE_WORKERS (0 — считать в потоке, без процессов),
+COMPUTE_MAX_PENDING, COMPUTE_TIMEOUT_SEC, COMPUTE_INLINE_MAX.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, List, Optional, Tuple
+
+from gold_core_telega import ChildPlan, MonthlyGrid, PriceSeries, plan_target_date, register_child
+from gold_metrics_telega import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+DEFAULT_MAX_PENDING = 32
+DEFAULT_TIMEOUT_SEC = 10.0
+# рассрочка на 240 месяцев — около 0.1 мс, дешевле пересылки в воркер
+DEFAULT_INLINE_MAX = 240
+
+COMPUTE_SECONDS = histogram("gold_compute_seconds", "Offloaded computation time", ["task"])
+COMPUTE_REJECTED = counter("gold_compute_rejected_total", "Offloaded computations not completed", ["reason"])
+
+
+class ComputeError(Exception):
+    pass
+
+
+class ComputeBusyError(ComputeError):
+    """Очередь заполнена — просим пользователя повторить позже."""
+
+
+class ComputeTimeoutError(ComputeError):
+    pass
+
+
+# ========= РЯДЫ В ОБЩЕЙ ПАМЯТИ =========
+
+@dataclass(frozen=True)
+class SeriesHandle:
+    """
+    Ссылка на ряд в shared memory: count дат (int64), затем count цен (float64).
+    key — "инструмент/валюта"; у более новой публикации того же ряда generation больше.
+    """
+    name: str
+    count: int
+    key: str = ""
+    generation: int = 0
+
+
+def _create_segment(series: PriceSeries, key: str, generation: int) -> Tuple[SharedMemory, SeriesHandle]:
+    n = len(series)
+    shm = SharedMemory(create=True, size=max(16 * n, 1))
+    shm.buf[: 8 * n] = array("q", series.ordinals).tobytes()
+    shm.buf[8 * n: 16 * n] = array("d", series.closes).tobytes()
+    return shm, SeriesHandle(shm.name, n, key, generation)
+
+
+# подключённые сегменты в текущем процессе: имя -> (сегмент, ряд, ссылка)
+_attached: Dict[str, Tuple[SharedMemory, PriceSeries, SeriesHandle]] = {}
+# сетки месяцев по подключённым рядам: имя сегмента -> сетка
+_grids: Dict[str, MonthlyGrid] = {}
+_attached_lock = threading.Lock()
+
+
+def _detach(name: str) -> None:
+    _grids.pop(name, None)
+    shm, series, _ = _attached.pop(name)
+    series.ordinals.release()
+    series.closes.release()
+    try:
+        shm.close()
+    except BufferError:
+        # на ряд ещё кто-то ссылается — отображение закроет сборщик мусора
+        logger.warning("Shared series %s is still referenced, leaving it mapped", name)
+
+
+def _detach_older(handle: SeriesHandle) -> None:
+    """Отключить сегменты того же ряда, которые старше самой новой известной публикации."""
+    same = [h for _, _, h in _attached.values() if h.key == handle.key]
+    newest = max(h.generation for h in same)
+    for h in same:
+        if h.generation < newest and h.name != handle.name:
+            _detach(h.name)
+
+
+def attach_series(handle: SeriesHandle) -> PriceSeries:
+    """Ряд по ссылке; в каждом процессе подключаемся к сегменту один раз."""
+    with _attached_lock:
+        hit = _attached.get(handle.name)
+        if hit is None:
+            shm = SharedMemory(name=handle.name)
+            n = handle.count
+            series = PriceSeries(
+                ordinals=shm.buf[: 8 * n].cast("q"),
+                closes=shm.buf[8 * n: 16 * n].cast("d"),
+            )
+            hit = _attached[handle.name] = (shm, series, handle)
+        if handle.key:
+            _detach_older(handle)
+        return hit[1]
+
+
+def attach_grid(handle: SeriesHandle) -> MonthlyGrid:
+    """Сетка месяцев по ряду из общей памяти; строится один раз на сегмент."""
+    series = attach_series(handle)
+    with _attached_lock:
+        grid = _grids.get(handle.name)
+        if grid is None:
+            grid = _grids[handle.name] = MonthlyGrid(series)
+        return grid
+
+
+def _warm(handles: List[SeriesHandle]) -> None:
+    for h in handles:
+        try:
+            attach_grid(h)
+        except FileNotFoundError:
+            pass
+
+
+def _worker_init(handles: List[SeriesHandle]) -> None:
+    # модули расчётов уже импортированы вместе с этим; подключаем текущие ряды
+    _warm(handles)
+
+
+# ========= ЗАДАЧИ ДЛЯ ВОРКЕРОВ =========
+
+def register_child_shared(handle: SeriesHandle, **kwargs) -> ChildPlan:
+    """register_child по сетке ряда из общей памяти вместо списка точек из задачи."""
+    return register_child(price_points=attach_grid(handle), **kwargs)
+
+
+# ========= ИСПОЛНИТЕЛЬ =========
+
+class ComputeExecutor:
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        timeout_sec: float = DEFAULT_TIMEOUT_SEC,
+        inline_max: int = DEFAULT_INLINE_MAX,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout_sec = timeout_sec
+        self.inline_max = inline_max
+        self.pending = 0
+        self._generation = 0
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+        # (инструмент, валюта) -> (ряд-источник, сегмент, ссылка)
+        self._published: Dict[Tuple[str, str], Tuple[PriceSeries, SharedMemory, SeriesHandle]] = {}
+        # сетки месяцев опубликованных рядов для планов, которые считаем на месте
+        self._grids: Dict[Tuple[str, str], MonthlyGrid] = {}
+        # заменённые сегменты живут, пока на них могут ссылаться задачи в работе
+        self._retired: List[Tuple[float, SharedMemory]] = []
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            if self.workers <= 0:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compute")
+            else:
+                # spawn: воркер не наследует потоки и состояние цикла событий родителя
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=get_context("spawn"),
+                    initializer=_worker_init,
+                    initargs=(self._handles(),),
+                )
+        return self._pool
+
+    def _handles(self) -> List[SeriesHandle]:
+        return [h for _, _, h in self._published.values()]
+
+    def _warm_workers(self, handles: List[SeriesHandle]) -> None:
+        # по задаче на воркер: пул раздаёт их свободным, так что обычно достаётся каждому
+        pool = self._pool
+        if pool is None or not handles:
+            return
+        try:
+            for _ in range(max(1, self.workers)):
+                pool.submit(_warm, handles)
+        except (BrokenExecutor, RuntimeError):
+            pass
+
+    def start(self) -> None:
+        """Поднимает воркеры заранее, чтобы первый пользователь не ждал spawn."""
+        pool = self._get_pool()
+        with self._lock:
+            handles = self._handles()
+        for _ in range(max(1, self.workers)):
+            pool.submit(_warm, handles)
+
+    def publish(self, instrument: str, currency: str, series: PriceSeries) -> SeriesHandle:
+        key = (instrument, currency)
+        with self._lock:
+            current = self._published.get(key)
+            if current is not None and current[0] is series:
+                return current[2]
+            self._generation += 1
+            shm, handle = _create_segment(series, f"{instrument}/{currency}", self._generation)
+            self._published[key] = (series, shm, handle)
+            self._grids.pop(key, None)
+            if current is not None:
+                self._retired.append((time.monotonic(), current[1]))
+            self._drop_retired()
+        self._warm_workers([handle])
+        logger.info("Published %s/%s series to shared memory (%d points)", instrument, currency, handle.count)
+        return handle
+
+    def _drop_retired(self) -> None:
+        grace = self.timeout_sec * 2
+        keep = []
+        for retired_at, shm in self._retired:
+            if time.monotonic() - retired_at < grace:
+                keep.append((retired_at, shm))
+                continue
+            shm.close()
+            shm.unlink()
+        self._retired = keep
+
+    async def run(self, fn: Callable, *args, size: Optional[int] = None, timeout: Optional[float] = None, **kwargs):
+        """
+        fn(*args, **kwargs) в пуле. size — объём задачи (например, месяцев):
+        если он не больше inline_max, считаем сразу, без пула.
+        """
+        if size is not None and size <= self.inline_max:
+            t0 = time.perf_counter()
+            result = fn(*args, **kwargs)
+            COMPUTE_SECONDS.observe(time.perf_counter() - t0, task=getattr(fn, "__name__", "task"))
+            return result
+
+        with self._lock:
+            if self.pending >= self.max_pending:
+                COMPUTE_REJECTED.inc(reason="busy")
+                raise ComputeBusyError(f"{self.pending} computations in progress")
+            self.pending += 1
+
+        loop = asyncio.get_running_loop()
+        name = getattr(fn, "__name__", "task")
+        t0 = time.perf_counter()
+        try:
+            future = self._get_pool().submit(fn, *args, **kwargs)
+        except BrokenExecutor as e:
+            with self._lock:
+                self.pending -= 1
+            self._reset_pool()
+            raise ComputeError(f"compute pool is broken: {e}") from e
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            raise
+
+        def _done(_):
+            # слот освобождается, только когда воркер действительно закончил
+            with self._lock:
+                self.pending -= 1
+            COMPUTE_SECONDS.observe(time.perf_counter() - t0, task=name)
+
+        future.add_done_callback(_done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future, loop=loop), timeout or self.timeout_sec)
+        except asyncio.TimeoutError:
+            COMPUTE_REJECTED.inc(reason="timeout")
+            raise ComputeTimeoutError(f"{name} took longer than {timeout or self.timeout_sec:.0f}s") from None
+        except BrokenExecutor as e:
+            self._reset_pool()
+            COMPUTE_REJECTED.inc(reason="broken")
+            raise ComputeError(f"compute worker died: {e}") from e
+
+    def _reset_pool(self) -> None:
+        """Воркер упал (OOM, segfault) — пул больше не принимает задач, поднимаем новый."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            logger.error("Compute pool is broken, restarting workers")
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def register_child(self, series: PriceSeries, **kwargs) -> ChildPlan:
+        """Аргументы как у gold_core_telega.register_child, только ряд вместо точек."""
+        key = (kwargs["instrument"], kwargs["currency"])
+        handle = self.publish(*key, series)
+        birth = kwargs["birth_date"]
+        target = plan_target_date(birth, kwargs["target_age_years"])
+        months = (target.year - birth.year) * 12 + target.month - birth.month + 1
+        if months > self.inline_max:
+            return await self.run(register_child_shared, handle, **kwargs)
+        grid = self._grids.get(key)
+        if grid is None or grid.series is not series:
+            grid = self._grids[key] = MonthlyGrid(series)
+        return await self.run(register_child, price_points=grid, size=months, **kwargs)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        with self._lock:
+            segments = [shm for _, shm, _ in self._published.values()] + [shm for _, shm in self._retired]
+            self._published.clear()
+            self._grids.clear()
+            self._retired.clear()
+        for shm in segments:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+_compute: Optional[ComputeExecutor] = None
+
+
+def get_compute() -> ComputeExecutor:
+    global _compute
+    if _compute is None:
+        _compute = ComputeExecutor(
+            workers=int(os.getenv("COMPUTE_WORKERS", DEFAULT_WORKERS)),
+            max_pending=int(os.getenv("COMPUTE_MAX_PENDING", DEFAULT_MAX_PENDING)),
+            timeout_sec=float(os.getenv("COMPUTE_TIMEOUT_SEC", DEFAULT_TIMEOUT_SEC)),
+            inline_max=int(os.getenv("COMPUTE_INLINE_MAX", DEFAULT_INLINE_MAX)),
+        )
+        atexit.register(_compute.shutdown)
+    return _compute
+
+
+gauge(
+    "gold_compute_pending", "Offloaded computations in progress",
+    callback=lambda: {(): _compute.pending if _compute is not None else 0},
+)
@@ -1,21 +1,33 @@
+import calendar
 import csv
 import io
 import json
+import logging
 import math
-from dataclasses import dataclass, asdict
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, asdict, field
 from datetime import date, datetime
+from functools import lru_cache
+from html.parser import HTMLParser
 from pathlib import Path
-from typing import List, Optional, Dict, Tuple
+from typing import List, Optional, Dict, Tuple, Union
 
-import requests
-from bs4 import BeautifulSoup  # pip install beautifulsoup4
+# requests и bs4 импортируются внутри функций загрузки: расчётам и
+# работе с планами они не нужны, а импорт заметно удлиняет старт.
 
-STOOQ_CSV_URL = "https://stooq.com/q/d/l/?s=xaueur&i=d"
-INVESTING_URL = "https://www.investing.com/currencies/xau-eur-historical-data"
-GRAMS_PER_OUNCE = 31.1034768
+from gold_metrics_telega import PLAN_IO_SECONDS
+
+# адреса источников; для офлайн-прогонов — локальный сервер gold_fixtures_telega
+STOOQ_BASE_URL = os.getenv("GOLD_STOOQ_BASE_URL", "https://stooq.com").rstrip("/")
+INVESTING_BASE_URL = os.getenv("GOLD_INVESTING_BASE_URL", "https://www.investing.com").rstrip("/")
+GRAMS_PER_OUNCE = 31.1034768  # тройская унция, одинакова для всех драгметаллов
 
 DATA_DIR = Path(".gold_plans_telega")
-DATA_DIR.mkdir(exist_ok=True)
+
+logger = logging.getLogger(__name__)
 
 
 # ========= МОДЕЛИ =========
@@ -23,22 +35,111 @@ DATA_DIR.mkdir(exist_ok=True)
 @dataclass
 class PricePoint:
     date: date
-    close: float  # EUR per ounce
+    close: float  # цена за унцию в валюте ряда (EUR для xaueur)
+
+@dataclass
+class PriceSeries:
+    """
+    Колоночное представление ряда цен: даты как ordinal, цены закрытия.
+    Используется валютным слоем, чтобы не держать по объекту на каждый день.
+    """
+    ordinals: array  # array("l"), date.toordinal()
+    closes: array    # array("d")
+
+    def __len__(self) -> int:
+        return len(self.ordinals)
+
+    @staticmethod
+    def from_points(points: List[PricePoint]) -> "PriceSeries":
+        return PriceSeries(
+            ordinals=array("l", (p.date.toordinal() for p in points)),
+            closes=array("d", (p.close for p in points)),
+        )
+
+    @staticmethod
+    def of(data: "Union[PriceSeries, List[PricePoint]]") -> "PriceSeries":
+        """Ряд как есть или из списка точек (источники отдают и то, и другое)."""
+        return data if isinstance(data, PriceSeries) else PriceSeries.from_points(data)
+
+    def to_points(self) -> List[PricePoint]:
+        fromordinal = date.fromordinal
+        return [PricePoint(date=fromordinal(o), close=c) for o, c in zip(self.ordinals, self.closes)]
+
+    def last_date(self) -> Optional[date]:
+        return date.fromordinal(self.ordinals[-1]) if self.ordinals else None
 
 @dataclass
 class PlanRow:
     date: date
-    price_per_gram_eur: float
+    price_per_gram_eur: float  # в валюте плана (исторически всегда EUR)
     grams_for_budget: float
 
+@dataclass
+class Purchase:
+    date: date
+    grams: float
+    amount: float  # сколько заплачено, в валюте плана
+
+
+class PurchaseLedger:
+    """
+    Фактические покупки по дате и накопленные суммы по ним:
+    cum_grams[i] — сколько куплено в первых i покупках. Сколько куплено
+    к дате — бисекция по датам; новая покупка в конец — O(1), покупка
+    задним числом сдвигает только хвост сумм.
+    """
+
+    def __init__(self, purchases: Optional[List[Purchase]] = None):
+        self.purchases: List[Purchase] = []
+        self.ordinals: List[int] = []
+        self.cum_grams: List[float] = [0.0]
+        self.cum_amount: List[float] = [0.0]
+        for p in sorted(purchases or [], key=lambda p: p.date):
+            self.add(p)
+
+    def add(self, purchase: Purchase) -> None:
+        o = purchase.date.toordinal()
+        i = bisect_right(self.ordinals, o)
+        self.ordinals.insert(i, o)
+        self.purchases.insert(i, purchase)
+        self.cum_grams.insert(i + 1, self.cum_grams[i] + purchase.grams)
+        self.cum_amount.insert(i + 1, self.cum_amount[i] + purchase.amount)
+        for j in range(i + 2, len(self.cum_grams)):
+            self.cum_grams[j] += purchase.grams
+            self.cum_amount[j] += purchase.amount
+
+    def __len__(self) -> int:
+        return len(self.purchases)
+
+    @property
+    def total_grams(self) -> float:
+        return self.cum_grams[-1]
+
+    @property
+    def total_amount(self) -> float:
+        return self.cum_amount[-1]
+
+    def grams_by(self, d: date) -> float:
+        """Куплено к дате d включительно."""
+        return self.cum_grams[bisect_right(self.ordinals, d.toordinal())]
+
+    def amount_by(self, d: date) -> float:
+        return self.cum_amount[bisect_right(self.ordinals, d.toordinal())]
+
+
 @dataclass
 class ChildPlan:
     child_id: str
     name: str
     birth_date: date
     target_age_years: Optional[int]
-    monthly_budget_eur: float
+    monthly_budget_eur: float  # бюджет в валюте плана
     plan_rows: List[PlanRow]
+    currency: str = "EUR"
+    instrument: str = "XAU"
+    # растёт при каждой перезаписи плана (PlanStore.put_child), ключ кэша расчётов
+    version: int = 0
+    ledger: PurchaseLedger = field(default_factory=PurchaseLedger, repr=False, compare=False)
 
     def to_json(self) -> dict:
         return {
@@ -47,6 +148,9 @@ class ChildPlan:
             "birth_date": self.birth_date.isoformat(),
             "target_age_years": self.target_age_years,
             "monthly_budget_eur": self.monthly_budget_eur,
+            "currency": self.currency,
+            "instrument": self.instrument,
+            "version": self.version,
             "plan_rows": [
                 {
                     "date": r.date.isoformat(),
@@ -55,6 +159,10 @@ class ChildPlan:
                 }
                 for r in self.plan_rows
             ],
+            "purchases": [
+                {"date": p.date.isoformat(), "grams": p.grams, "amount": p.amount}
+                for p in self.ledger.purchases
+            ],
         }
 
     @staticmethod
@@ -73,29 +181,130 @@ class ChildPlan:
                 )
                 for r in obj["plan_rows"]
             ],
+            currency=obj.get("currency", "EUR"),
+            instrument=obj.get("instrument", "XAU"),
+            version=int(obj.get("version", 0)),
+            ledger=PurchaseLedger([
+                Purchase(
+                    date=datetime.strptime(p["date"], "%Y-%m-%d").date(),
+                    grams=float(p["grams"]),
+                    amount=float(p["amount"]),
+                )
+                for p in obj.get("purchases", [])
+            ]),
+        )
+
+
+    def to_compact(self) -> dict:
+        """Схема 2: даты — ordinal, строки и покупки — параллельные массивы."""
+        rows = self.plan_rows
+        purchases = self.ledger.purchases
+        return {
+            "child_id": self.child_id,
+            "name": self.name,
+            "birth_date": self.birth_date.toordinal(),
+            "target_age_years": self.target_age_years,
+            "monthly_budget_eur": self.monthly_budget_eur,
+            "currency": self.currency,
+            "instrument": self.instrument,
+            "version": self.version,
+            "rows": {
+                "date": [r.date.toordinal() for r in rows],
+                "price": [r.price_per_gram_eur for r in rows],
+                "grams": [r.grams_for_budget for r in rows],
+            },
+            "purchases": {
+                "date": list(self.ledger.ordinals),
+                "grams": [p.grams for p in purchases],
+                "amount": [p.amount for p in purchases],
+            },
+        }
+
+    def is_finite(self) -> bool:
+        """Все числа плана конечны: orjson пишет NaN и inf как null."""
+        isfinite = math.isfinite
+        return (
+            isfinite(self.monthly_budget_eur)
+            and all(isfinite(r.price_per_gram_eur) and isfinite(r.grams_for_budget) for r in self.plan_rows)
+            and all(isfinite(p.grams) and isfinite(p.amount) for p in self.ledger.purchases)
         )
 
+    @staticmethod
+    def from_compact(obj: dict) -> "ChildPlan":
+        fromordinal = date.fromordinal
+        rows = obj["rows"]
+        bought = obj.get("purchases") or {"date": [], "grams": [], "amount": []}
+        return ChildPlan(
+            child_id=obj["child_id"],
+            name=obj["name"],
+            birth_date=fromordinal(obj["birth_date"]),
+            target_age_years=obj.get("target_age_years"),
+            monthly_budget_eur=float(obj["monthly_budget_eur"]),
+            plan_rows=[
+                PlanRow(fromordinal(o), float(p), float(g))
+                for o, p, g in zip(rows["date"], rows["price"], rows["grams"], strict=True)
+            ],
+            currency=obj.get("currency", "EUR"),
+            instrument=obj.get("instrument", "XAU"),
+            version=int(obj.get("version", 0)),
+            ledger=PurchaseLedger([
+                Purchase(fromordinal(o), float(g), float(a))
+                for o, g, a in zip(bought["date"], bought["grams"], bought["amount"], strict=True)
+            ]),
+        )
 
 # ========= ЗАГРУЗКА ЦЕН =========
 
 class PriceSourceError(Exception):
     pass
 
+def ensure_data_dir() -> Path:
+    """Создаёт DATA_DIR при первой записи, а не при импорте модуля."""
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    return DATA_DIR
+
+
 def get_user_plans_file(user_id: int) -> Path:
     """Возвращает путь к файлу планов конкретного пользователя."""
     return DATA_DIR / f"plans_user_{user_id}.json"
 
+def stooq_csv_url(symbol: str) -> str:
+    return f"{STOOQ_BASE_URL}/q/d/l/?s={symbol}&i=d"
+
+
+def investing_url(symbol: str) -> str:
+    """Страница исторических данных Investing для пары в стиле Stooq (xaueur)."""
+    return f"{INVESTING_BASE_URL}/currencies/{symbol[:3].lower()}-{symbol[3:].lower()}-historical-data"
+
+
 def download_stooq_xaueur() -> List[PricePoint]:
+    return download_stooq_series("xaueur")
+
+
+def download_stooq_series(symbol: str) -> List[PricePoint]:
+    """Дневной ряд Stooq по тикеру (xauusd, eurusd, usdrub, ...)."""
+    return download_stooq_columns(symbol).to_points()
+
+
+def download_stooq_columns(symbol: str) -> PriceSeries:
+    """То же колонками: разбор сразу в массивы, без PricePoint на каждый день."""
+    import requests
+
     try:
-        resp = requests.get(STOOQ_CSV_URL, timeout=10)
+        resp = requests.get(stooq_csv_url(symbol), timeout=10)
         resp.raise_for_status()
     except Exception as e:
-        raise PriceSourceError(f"Stooq error: {e}")
+        raise PriceSourceError(f"Stooq error ({symbol}): {e}")
+
+    series = parse_stooq_series(resp.content)
+    if not len(series):
+        raise PriceSourceError(f"Stooq returned empty dataset ({symbol}).")
+    return series
 
-    resp.encoding = "utf-8"
-    text = resp.text
-    f = io.StringIO(text)
-    reader = csv.DictReader(f)
+
+def parse_stooq_csv(text: str) -> List[PricePoint]:
+    """Строгий разбор: csv + strptime, битые строки пропускаются, порядок любой."""
+    reader = csv.DictReader(io.StringIO(text))
     rows: List[PricePoint] = []
     for row in reader:
         try:
@@ -105,42 +314,104 @@ def download_stooq_xaueur() -> List[PricePoint]:
             continue
         rows.append(PricePoint(date=d, close=close))
     rows.sort(key=lambda r: r.date)
-    if not rows:
-        raise PriceSourceError("Stooq returned empty dataset.")
     return rows
 
 
+def parse_stooq_csv_fast(data: bytes) -> Optional[PriceSeries]:
+    """
+    Быстрый разбор CSV Stooq по байтам: дата YYYY-MM-DD по фиксированным
+    смещениям сразу в ordinal (начало месяца кэшируется по "YYYY-MM"),
+    цена закрытия — в array("d"). Всё, что не похоже на обычный ответ
+    (другой заголовок, битая строка, даты не по возрастанию), — None:
+    такой ответ разбирает строгий parse_stooq_csv.
+    """
+    lines = data.split(b"\n")
+    header = lines[0].rstrip(b"\r").split(b",")
+    if not header or header[0] != b"Date" or b"Close" not in header:
+        return None
+    ci = header.index(b"Close")
+    ordinals = array("l")
+    closes = array("d")
+    months: Dict[bytes, Tuple[int, int]] = {}
+    last = 0
+    for line in lines[1:]:
+        if line[-1:] == b"\r":
+            line = line[:-1]
+        if not line:
+            continue
+        if line[4:5] != b"-" or line[7:8] != b"-" or line[10:11] != b",":
+            return None
+        month = months.get(line[:7])
+        if month is None:
+            if not (line[:4].isdigit() and line[5:7].isdigit()):
+                return None
+            y, m = int(line[:4]), int(line[5:7])
+            if not (1 <= y and 1 <= m <= 12):
+                return None
+            month = months[line[:7]] = (date(y, m, 1).toordinal() - 1, calendar.monthrange(y, m)[1])
+        day = line[8:10]
+        if not day.isdigit() or not 1 <= int(day) <= month[1]:
+            return None
+        fields = line.split(b",")
+        if len(fields) != len(header):
+            return None
+        try:
+            close = float(fields[ci])
+        except ValueError:
+            return None
+        o = month[0] + int(day)
+        if o <= last:
+            return None
+        last = o
+        ordinals.append(o)
+        closes.append(close)
+    return PriceSeries(ordinals, closes)
+
+
+def parse_stooq_series(data: bytes) -> PriceSeries:
+    """Быстрый путь, а при необычном ответе — строгий разбор."""
+    series = parse_stooq_csv_fast(data)
+    if series is None:
+        series = PriceSeries.from_points(parse_stooq_csv(data.decode("utf-8", errors="replace")))
+    return series
+
+
 def download_investing_xaueur() -> List[PricePoint]:
+    return download_investing_series(investing_url("xaueur"))
+
+
+def download_investing_series(url: str) -> List[PricePoint]:
     """
     Очень простой fallback: парсит HTML-таблицу Investing.com.
     Структура сайта может поменяться, поэтому этот источник
     только как резервный.
     """
+    import requests
+
     headers = {
         "User-Agent": "Mozilla/5.0 (compatible; GoldPlanner/1.0)"
     }
     try:
-        resp = requests.get(INVESTING_URL, headers=headers, timeout=10)
+        resp = requests.get(url, headers=headers, timeout=10)
         resp.raise_for_status()
     except Exception as e:
         raise PriceSourceError(f"Investing error: {e}")
 
-    soup = BeautifulSoup(resp.text, "html.parser")
-    table = soup.find("table")
-    if table is None:
+    cells = parse_first_table_cells(resp.text)
+    if cells is None:
+        # лёгкий парсер не нашёл таблицу — пробуем полный разбор
+        cells = _parse_first_table_cells_bs4(resp.text)
+    if cells is None:
         raise PriceSourceError("Investing: historical table not found.")
 
     rows: List[PricePoint] = []
-    for tr in table.find_all("tr"):
-        tds = tr.find_all("td")
+    for tds in cells:
         if len(tds) < 2:
             continue
         try:
             # формат даты на сайте может отличаться, здесь пример DD.MM.YYYY
-            d_text = tds[0].get_text(strip=True)
-            d = datetime.strptime(d_text, "%d.%m.%Y").date()
-            price_text = tds[1].get_text(strip=True).replace(",", "")
-            close = float(price_text)
+            d = datetime.strptime(tds[0], "%d.%m.%Y").date()
+            close = float(tds[1].replace(",", ""))
         except Exception:
             continue
         rows.append(PricePoint(date=d, close=close))
@@ -150,14 +421,95 @@ def download_investing_xaueur() -> List[PricePoint]:
     return rows
 
 
-def load_price_history() -> List[PricePoint]:
+class _FirstTableParser(HTMLParser):
     """
-    Пытается взять Stooq, при ошибке – Investing.
+    Потоковый разбор: собирает текст <td> по строкам первой <table>
+    и останавливается на её закрывающем теге, дерево не строится.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[List[str]] = []
+        self.found = False
+        self.done = False
+        self._depth = 0
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "table":
+            self.found = True
+            self._depth += 1
+        elif self._depth == 1 and tag == "tr":
+            self._row = []
+        elif self._depth == 1 and tag == "td" and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if self.done or not self._depth:
+            return
+        if tag == "table":
+            self._depth -= 1
+            if self._depth == 0:
+                self.done = True
+        elif self._depth == 1 and tag == "td" and self._cell is not None:
+            self._row.append("".join(self._cell).strip())
+            self._cell = None
+        elif self._depth == 1 and tag == "tr" and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def parse_first_table_cells(html: str) -> Optional[List[List[str]]]:
+    """
+    Ячейки <td> первой таблицы страницы (по строкам) или None, если таблицы нет.
+    Использует lxml, если он установлен, иначе потоковый html.parser.
     """
     try:
-        return download_stooq_xaueur()
+        import lxml.html  # опционально: pip install lxml
+    except ImportError:
+        parser = _FirstTableParser()
+        parser.feed(html)
+        parser.close()
+        return parser.rows if parser.found else None
+
+    try:
+        doc = lxml.html.fromstring(html)
+    except Exception:
+        return None
+    tables = doc.xpath("//table")
+    if not tables:
+        return None
+    return [
+        [td.text_content().strip() for td in tr.xpath("./td")]
+        for tr in tables[0].xpath("./tr|./thead/tr|./tbody/tr|./tfoot/tr")
+    ]
+
+
+def _parse_first_table_cells_bs4(html: str) -> Optional[List[List[str]]]:
+    from bs4 import BeautifulSoup  # pip install beautifulsoup4
+
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("table")
+    if table is None:
+        return None
+    return [[td.get_text(strip=True) for td in tr.find_all("td")] for tr in table.find_all("tr")]
+
+
+def load_price_history(stooq_symbol: str = "xaueur", investing_page: Optional[str] = None) -> List[PricePoint]:
+    """
+    Пытается взять Stooq, при ошибке – Investing (по умолчанию страница той же пары).
+    """
+    try:
+        return download_stooq_series(stooq_symbol)
     except PriceSourceError:
-        return download_investing_xaueur()
+        return download_investing_series(investing_page or investing_url(stooq_symbol))
 
 
 # ========= УТИЛИТЫ ВРЕМЕНИ И ФИЛЬТРАЦИИ =========
@@ -166,6 +518,10 @@ def filter_period(points: List[PricePoint], start_date: date, end_date: date) ->
     return [p for p in points if start_date <= p.date <= end_date]
 
 
+# дни месяца, в которые по плану идёт покупка, в порядке приоритета
+DAY_PRIORITY = [20, 19, 18, 17, 16]
+
+
 def pick_monthly_dates(points: List[PricePoint], day_priority=None) -> List[PricePoint]:
     """
     Берём одну дату в месяц в порядке приоритета дней, по умолчанию 20→19→18→17→16.
@@ -173,7 +529,7 @@ def pick_monthly_dates(points: List[PricePoint], day_priority=None) -> List[Pric
     может немного сдвигаться относительно выбранного числа.
     """
     if day_priority is None:
-        day_priority = [20, 19, 18, 17, 16]
+        day_priority = DAY_PRIORITY
 
     by_month: Dict[Tuple[int, int], List[PricePoint]] = {}
     for p in points:
@@ -214,21 +570,109 @@ def months_between_exact(d1: date, d2: date) -> int:
     return max(total, 0)
 
 
+class MonthlyGrid:
+    """
+    Даты покупок ряда цен, посчитанные один раз на весь ряд: по месяцу —
+    точка, которую выбрал бы pick_monthly_dates, и начало месяца в ряду.
+    Строки любого плана по ряду — бисекция по месяцам, а не проход по дням;
+    крайние месяцы периода выбираются заново только среди дней внутри периода.
+    """
+
+    def __init__(self, series: PriceSeries, day_priority=None):
+        rank = {d: i for i, d in enumerate(day_priority or DAY_PRIORITY)}
+        self.series = series
+        self.months = array("l")  # year * 12 + month - 1
+        self.starts = array("l")  # индекс первого дня месяца в ряду
+        self.picked = array("l")  # индекс выбранного дня
+        best_rank = len(rank)
+        for i, o in enumerate(series.ordinals):
+            d = date.fromordinal(o)
+            key = d.year * 12 + d.month - 1
+            if not self.months or self.months[-1] != key:
+                self.months.append(key)
+                self.starts.append(i)
+                self.picked.append(i)
+                best_rank = len(rank)
+            r = rank.get(d.day, len(rank))
+            # приоритетный день побеждает; без них — последний день месяца
+            if r < best_rank or (r == best_rank == len(rank)):
+                self.picked[-1] = i
+                best_rank = r
+        self._rank = rank
+
+    def _pick(self, lo: int, hi: int) -> Optional[int]:
+        """Как pick_monthly_dates для дней ряда [lo, hi) одного месяца."""
+        best, best_rank = None, len(self._rank)
+        for i in range(lo, hi):
+            r = self._rank.get(date.fromordinal(self.series.ordinals[i]).day, len(self._rank))
+            if best is None or r < best_rank or (r == best_rank == len(self._rank)):
+                best, best_rank = i, r
+        return best
+
+    def plan_rows(self, start: date, end: date, monthly_budget: float) -> List[PlanRow]:
+        """То же, что build_plan_rows(pick_monthly_dates(filter_period(...)))."""
+        if end < start:
+            return []
+        ordinals, closes = self.series.ordinals, self.series.closes
+        m0 = start.year * 12 + start.month - 1
+        m1 = end.year * 12 + end.month - 1
+        lo = bisect_left(self.months, m0)
+        hi = bisect_right(self.months, m1)
+        rows: List[PlanRow] = []
+        for j in range(lo, hi):
+            if self.months[j] in (m0, m1):
+                first = self.starts[j]
+                last = self.starts[j + 1] if j + 1 < len(self.starts) else len(ordinals)
+                first = max(first, bisect_left(ordinals, start.toordinal(), first, last))
+                last = min(last, bisect_right(ordinals, end.toordinal(), first, last))
+                i = self._pick(first, last)
+                if i is None:
+                    continue
+            else:
+                i = self.picked[j]
+            rows.append(_plan_row(date.fromordinal(ordinals[i]), closes[i], monthly_budget))
+        return rows
+
+
 # ========= РАСЧЁТ ПЛАНА =========
 
+def _plan_row(d: date, close: float, monthly_budget_eur: float) -> PlanRow:
+    price_per_gram = close / GRAMS_PER_OUNCE
+    return PlanRow(
+        date=d,
+        price_per_gram_eur=price_per_gram,
+        grams_for_budget=monthly_budget_eur / price_per_gram,
+    )
+
+
 def build_plan_rows(points: List[PricePoint], monthly_budget_eur: float) -> List[PlanRow]:
-    rows: List[PlanRow] = []
-    for p in points:
-        price_per_gram = p.close / GRAMS_PER_OUNCE
-        grams = monthly_budget_eur / price_per_gram
-        rows.append(
-            PlanRow(
-                date=p.date,
-                price_per_gram_eur=price_per_gram,
-                grams_for_budget=grams,
-            )
-        )
-    return rows
+    return [_plan_row(p.date, p.close, monthly_budget_eur) for p in points]
+
+
+def plan_target_date(birth_date: date, target_age_years: Optional[int], today: Optional[date] = None) -> date:
+    """До какой даты идёт план: день рождения в целевом возрасте или сегодня."""
+    if target_age_years is not None:
+        return date(birth_date.year + target_age_years, birth_date.month, birth_date.day)
+    return today or date.today()
+
+
+def plan_prefix_grams(plan_rows: List[PlanRow]) -> List[float]:
+    """Накопленные граммы плана: prefix[i] — сумма первых i месяцев."""
+    prefix = [0.0]
+    for r in plan_rows:
+        prefix.append(prefix[-1] + r.grams_for_budget)
+    return prefix
+
+
+def covered_months(prefix: List[float], have_grams: float) -> Tuple[int, bool]:
+    """
+    Сколько месяцев плана закрыто имеющимися граммами (по порядку, от первого)
+    и закрыт ли следующий месяц частично.
+    """
+    full = max(0, bisect_right(prefix, have_grams) - 1)
+    full = min(full, len(prefix) - 1)
+    partial = full < len(prefix) - 1 and have_grams > prefix[full]
+    return full, partial
 
 
 def calc_year_stats(plan_rows: List[PlanRow]) -> Dict[int, float]:
@@ -240,10 +684,14 @@ def calc_year_stats(plan_rows: List[PlanRow]) -> Dict[int, float]:
     return by_year
 
 
-def average_monthly_return_with_target(plan_rows: List[PlanRow], target_months: int) -> float:
+def average_monthly_return_with_target(
+    plan_rows: List[PlanRow], target_months: int, eur_rate: float = 1.0
+) -> float:
     """
     Консервативная оценка средней месячной доходности с учётом горизонта.
     target_months: количество месяцев до цели (например, 148 для 12 лет).
+    eur_rate: сколько EUR стоит единица валюты плана — пороги цены
+    откалиброваны в EUR/г.
     """
     # 0. Базовый случай, когда данных мало
     if len(plan_rows) < 2:
@@ -289,9 +737,10 @@ def average_monthly_return_with_target(plan_rows: List[PlanRow], target_months:
         hist_return = 0.004  # 0.4% как базовая оценка
 
     # 3. КОРРЕКЦИЯ НА ВЫСОКИЙ УРОВЕНЬ ЦЕНЫ (мягко режем, но не слишком)
-    if current_price > 90:
+    current_price_eur = current_price * eur_rate
+    if current_price_eur > 90:
         # примерно -0.03% за каждые 10 EUR сверх 90
-        price_penalty = max(0.0, (current_price - 90) / 10 * 0.0003)
+        price_penalty = max(0.0, (current_price_eur - 90) / 10 * 0.0003)
         hist_return = max(0.0025, hist_return - price_penalty)
 
     # 4. БЕРЁМ МИНИМУМ ИЗ ИСТОРИЧЕСКОГО И "ПРЕДЕЛЬНО ДОПУСТИМОГО"
@@ -320,11 +769,12 @@ def average_monthly_return_with_target(plan_rows: List[PlanRow], target_months:
         else current_price
     )
 
-    print(f"📊  Текущая цена: {current_price:.1f} EUR/г")
-    annual_ret = (1 + final_return) ** 12 - 1
-    print(f"📈  Рассчитанный рост: {final_return * 100:.3f}% (годовой: {annual_ret * 100:.1f}%)")
-    print(f"🎯  До цели осталось: {target_months} мес. ({years:.1f} лет)")
-    print(f"🔮  Прогнозная цена: {forecast_price_val:.0f} EUR/г")
+    if logger.isEnabledFor(logging.DEBUG):
+        annual_ret = (1 + final_return) ** 12 - 1
+        logger.debug(
+            "Текущая цена: %.1f/г; рост: %.3f%% (годовой: %.1f%%); до цели: %d мес. (%.1f лет); прогноз: %.0f/г",
+            current_price, final_return * 100, annual_ret * 100, target_months, years, forecast_price_val,
+        )
 
     return final_return
 def calculate_geometric_return(rows: List[PlanRow]) -> float:
@@ -340,11 +790,14 @@ def calculate_geometric_return(rows: List[PlanRow]) -> float:
         return (end_price / start_price) ** (1 / months_count) - 1
     except Exception:
         return 0.003
-def forecast_price(last_price_per_gram: float, avg_monthly_ret: float, months_ahead: int) -> float:
+def forecast_price(
+    last_price_per_gram: float, avg_monthly_ret: float, months_ahead: int, eur_rate: float = 1.0
+) -> float:
     """
     Прогноз цены с одним усреднённым месячным ростом.
     На коротких горизонтах даёт результаты, похожие на таблицу:
     P_t = P_0 * (1 + r)^t, с мягким штрафом за очень высокую текущую цену.
+    eur_rate — как в average_monthly_return_with_target.
     """
     if months_ahead <= 0:
         return last_price_per_gram
@@ -353,7 +806,7 @@ def forecast_price(last_price_per_gram: float, avg_monthly_ret: float, months_ah
     effective_ret = avg_monthly_ret
 
     # Небольшой штраф, если текущая цена уже высокая
-    if last_price_per_gram > 100.0:
+    if last_price_per_gram * eur_rate > 100.0:
         effective_ret *= 0.9  # -10% к среднему росту
 
     # Обычный экспоненциальный рост
@@ -367,32 +820,184 @@ def forecast_price(last_price_per_gram: float, avg_monthly_ret: float, months_ah
     return price
 
 
+def installment_schedule(
+    last_price_per_gram: float,
+    avg_monthly_ret: float,
+    debt_grams: float,
+    n_months: int,
+    base_grams_per_month: float = 0.0,
+    eur_rate: float = 1.0,
+) -> Tuple[List[Tuple[int, float, float, float]], float]:
+    """
+    Рассрочка долга на n_months по прогнозным ценам.
+    Возвращает строки (месяц, цена, граммы к покупке, стоимость) и общую стоимость.
+    """
+    part_grams = debt_grams / n_months
+    grams_this_month = part_grams + base_grams_per_month
+    rows: List[Tuple[int, float, float, float]] = []
+    total_cost = 0.0
+    for i in range(1, n_months + 1):
+        price_i = forecast_price(last_price_per_gram, avg_monthly_ret, i, eur_rate)
+        cost_i = grams_this_month * price_i
+        total_cost += cost_i
+        rows.append((i, price_i, grams_this_month, cost_i))
+    return rows, total_cost
+
+
+def simulate_buy_ahead(
+    plan_grams: List[float],
+    price_now: float,
+    avg_monthly_ret: float,
+    weight_now: float,
+    eur_rate: float = 1.0,
+) -> Tuple[int, float]:
+    """
+    Сколько месяцев плана покрывает покупка weight_now грамм сейчас и сколько
+    стоили бы те же граммы при покупке помесячно по прогнозным ценам.
+    """
+    months_fact = len(plan_grams)
+    grams_left = weight_now
+    months_covered = 0
+    for g in plan_grams:
+        if grams_left >= g:
+            grams_left -= g
+            months_covered += 1
+        else:
+            break
+
+    grams_to_simulate = weight_now
+    month_index = 1
+    cost_if_monthly = 0.0
+    while grams_to_simulate > 1e-6 and month_index <= months_fact * 5:
+        p_m = forecast_price(price_now, avg_monthly_ret, month_index, eur_rate)
+        plan_g = plan_grams[min(month_index - 1, months_fact - 1)]
+        g_buy = min(plan_g, grams_to_simulate)
+        cost_if_monthly += g_buy * p_m
+        grams_to_simulate -= g_buy
+        month_index += 1
+    return months_covered, cost_if_monthly
+
 
 # ========= СОХРАНЕНИЕ ПЛАНОВ (НЕСКОЛЬКО ДЕТЕЙ) =========
 
-def load_all_plans(user_id: int) -> Dict[str, ChildPlan]:
-    """Загружает планы конкретного пользователя."""
-    plans_file = get_user_plans_file(user_id)
-    if not plans_file.exists():
-        return {}
+# Схема файла планов. 1 — {child_id: план} с ISO-датами и строкой-словарём
+# на месяц (отступы, как раньше); 2 — {"schema": 2, "plans": {...}} из
+# ChildPlan.to_compact. Читаются обе, пишется PLANS_SCHEMA: 1 — чтобы при
+# откате на старую сборку файлы оставались читаемыми.
+PLANS_SCHEMA = int(os.getenv("GOLD_PLANS_SCHEMA", "2"))
+
+
+@lru_cache(maxsize=None)
+def _orjson():
     try:
-        raw = json.loads(plans_file.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
+        import orjson  # опционально: pip install orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def json_loads(data: bytes):
+    lib = _orjson()
+    if lib is not None:
+        try:
+            return lib.loads(data)
+        except lib.JSONDecodeError:
+            # NaN и Infinity (их пишет json) orjson не читает — разберёт json
+            pass
+    return json.loads(data)
+
+
+def json_dumps_compact(obj, finite: bool = True) -> bytes:
+    """finite=False — в obj могут быть NaN/inf: их сохраняет только json, orjson пишет null."""
+    lib = _orjson()
+    if lib is not None and finite:
+        return lib.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def split_plans_file(raw: dict) -> Tuple[int, dict]:
+    """(схема, {child_id: сырой план}) из разобранного файла планов."""
+    if isinstance(raw.get("schema"), int):
+        return raw["schema"], raw["plans"]
+    return 1, raw
+
+
+def encode_plans(plans: Dict[str, ChildPlan], schema: Optional[int] = None) -> bytes:
+    if (schema or PLANS_SCHEMA) == 1:
+        raw = {cid: plan.to_json() for cid, plan in plans.items()}
+        return json.dumps(raw, ensure_ascii=False, indent=2).encode("utf-8")
+    finite = all(plan.is_finite() for plan in plans.values())
+    if not finite:
+        logger.warning("Plans with NaN or infinite values, saving them with json")
+    return json_dumps_compact({
+        "schema": 2,
+        "plans": {cid: plan.to_compact() for cid, plan in plans.items()},
+    }, finite=finite)
+
+
+def decode_plans(data: bytes, skipped: Optional[List[str]] = None) -> Dict[str, ChildPlan]:
+    """Планы из байтов файла любой схемы; битые пропускаются с предупреждением, их id — в skipped."""
+    schema, raw = split_plans_file(json_loads(data))
+    from_obj = ChildPlan.from_json if schema == 1 else ChildPlan.from_compact
     res: Dict[str, ChildPlan] = {}
     for child_id, obj in raw.items():
         try:
-            res[child_id] = ChildPlan.from_json(obj)
-        except Exception:
-            continue
+            res[child_id] = from_obj(obj)
+        except Exception as e:
+            logger.warning("Unreadable plan %r skipped: %r", child_id, e)
+            if skipped is not None:
+                skipped.append(child_id)
     return res
 
 
+def _keep_unreadable(plans_file: Path, data: bytes) -> None:
+    """
+    Копия файла рядом (<имя>.bad-<время>): следующая запись планов пропущенное
+    уже не сохранит, а так сырые данные остаются для ручного разбора.
+    """
+    path = plans_file.with_name(f"{plans_file.name}.bad-{int(time.time())}")
+    try:
+        with open(path, "xb") as f:
+            f.write(data)
+    except FileExistsError:
+        return
+    logger.warning("Raw plans file kept as %s", path)
+
+
+def load_all_plans(user_id: int) -> Dict[str, ChildPlan]:
+    """Загружает планы конкретного пользователя."""
+    plans_file = get_user_plans_file(user_id)
+    t0 = time.perf_counter()
+    try:
+        try:
+            data = plans_file.read_bytes()
+        except OSError:
+            # файла ещё нет
+            return {}
+        skipped: List[str] = []
+        try:
+            plans = decode_plans(data, skipped)
+        except Exception as e:
+            logger.warning("Unreadable plans file %s: %r", plans_file, e)
+            _keep_unreadable(plans_file, data)
+            return {}
+        if skipped:
+            _keep_unreadable(plans_file, data)
+        return plans
+    finally:
+        PLAN_IO_SECONDS.observe(time.perf_counter() - t0, op="load")
+
+
 def save_all_plans(plans: Dict[str, ChildPlan], user_id: int) -> None:
     """Сохраняет планы конкретного пользователя."""
+    ensure_data_dir()
     plans_file = get_user_plans_file(user_id)
-    raw = {cid: plan.to_json() for cid, plan in plans.items()}
-    plans_file.write_text(json.dumps(raw, ensure_ascii=False, indent=2), encoding="utf-8")
+    with PLAN_IO_SECONDS.time(op="save"):
+        data = encode_plans(plans)
+        # через временный файл: читатель никогда не увидит половину JSON
+        tmp = plans_file.with_name(f"{plans_file.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, plans_file)
 
 def register_child(
     child_id: str,
@@ -400,21 +1005,23 @@ def register_child(
     birth_date: date,
     target_age_years: Optional[int],
     monthly_budget_eur: float,
-    price_points: List[PricePoint],
+    price_points: "Union[List[PricePoint], PriceSeries, MonthlyGrid]",
+    currency: str = "EUR",
+    instrument: str = "XAU",
 ) -> ChildPlan:
-    target_date: date
-    if target_age_years is not None:
-        target_date = date(birth_date.year + target_age_years, birth_date.month, birth_date.day)
+    """Ряд можно передать списком точек, колонками или готовой сеткой месяцев."""
+    target_date = plan_target_date(birth_date, target_age_years)
+
+    if isinstance(price_points, list):
+        period_points = filter_period(price_points, birth_date, target_date)
+        monthly_points = pick_monthly_dates(period_points)
+        if len(monthly_points) < 6:
+            # меньше 6 месяцев данных — предупреждение (на UI)
+            pass
+        plan_rows = build_plan_rows(monthly_points, monthly_budget_eur)
     else:
-        target_date = date.today()
-
-    period_points = filter_period(price_points, birth_date, target_date)
-    monthly_points = pick_monthly_dates(period_points)
-    if len(monthly_points) < 6:
-        # меньше 6 месяцев данных — предупреждение (на UI)
-        pass
-
-    plan_rows = build_plan_rows(monthly_points, monthly_budget_eur)
+        grid = price_points if isinstance(price_points, MonthlyGrid) else MonthlyGrid(price_points)
+        plan_rows = grid.plan_rows(birth_date, target_date, monthly_budget_eur)
 
     return ChildPlan(
         child_id=child_id,
@@ -423,12 +1030,20 @@ def register_child(
         target_age_years=target_age_years,
         monthly_budget_eur=monthly_budget_eur,
         plan_rows=plan_rows,
+        currency=currency,
+        instrument=instrument,
     )
 
 
+def plan_csv_bytes(plan: ChildPlan) -> bytes:
+    """CSV плана в памяти: для отправки в Telegram файл на диске не нужен."""
+    buf = io.StringIO(newline="")
+    writer = csv.writer(buf)
+    writer.writerow(["date", "price_per_gram_eur", "grams_for_budget"])
+    for r in plan.plan_rows:
+        writer.writerow([r.date.isoformat(), f"{r.price_per_gram_eur:.4f}", f"{r.grams_for_budget:.4f}"])
+    return buf.getvalue().encode("utf-8")
+
+
 def export_plan_to_csv(plan: ChildPlan, path: Path) -> None:
-    with path.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["date", "price_per_gram_eur", "grams_for_budget"])
-        for r in plan.plan_rows:
-            writer.writerow([r.date.isoformat(), f"{r.price_per_gram_eur:.4f}", f"{r.grams_for_budget:.4f}"])
+    path.write_bytes(plan_csv_bytes(plan))
@@ -0,0 +1,264 @@
+# gold_fixtures_telega.py
+"""
+Детерминированные цены для тестов, бенчмарков и нагрузочных прогонов без сети.
+
+* synthetic_series — геометрическое броуновское движение по рабочим дням:
+  длина, дрейф, волатильность и seed задаются, один seed — один ряд.
+* fixture_series — ряд для тикера в стиле Stooq: металлы и FX к USD со
+  своими параметрами (seed — от имени тикера), прямые ряды к EUR
+  (xaueur, ...) — кросс того же металла и eurusd, как у настоящих источников.
+* FixtureServer — локальный HTTP-сервер вместо stooq.com и investing.com:
+  /q/d/l/?s=<тикер>&i=d отдаёт CSV в формате Stooq (неизвестный тикер —
+  "No data", как на сайте), /currencies/<база>-<котировка>-historical-data —
+  HTML-таблицу в духе Investing — как и настоящая страница, только последние
+  INVESTING_WINDOW_ROWS строк (investing_window=None — всю историю). Можно выключить источник (fail) и добавить
+  задержку ответа. Как контекстный менеджер сервер подставляет свои адреса
+  в gold_core_telega (STOOQ_BASE_URL, INVESTING_BASE_URL), на выходе
+  возвращает прежние.
+
+Отдельным процессом:
+    python gold_fixtures_telega.py serve --port 8765 [--years 30] [--fail stooq]
+    GOLD_STOOQ_BASE_URL=http://127.0.0.1:8765 GOLD_INVESTING_BASE_URL=http://127.0.0.1:8765 python gold_run_telega.py
+"""
+import logging
+import math
+import random
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import gold_core_telega
+from gold_core_telega import PricePoint
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_END = date(2024, 12, 31)
+# страница истории Investing без параметров — около месяца торговых дней
+INVESTING_WINDOW_ROWS = 30
+
+# тикер -> (цена в начале, годовой дрейф, годовая волатильность)
+FIXTURE_SYMBOLS: Dict[str, Tuple[float, float, float]] = {
+    "xauusd": (400.0, 0.07, 0.15),
+    "xagusd": (5.0, 0.05, 0.28),
+    "xptusd": (400.0, 0.03, 0.22),
+    "xpdusd": (150.0, 0.06, 0.30),
+    "eurusd": (1.1, 0.0, 0.08),
+    "gbpusd": (1.6, -0.01, 0.08),
+    "usdchf": (1.3, -0.02, 0.09),
+    "usdrub": (28.0, 0.06, 0.12),
+}
+
+
+# ========= СИНТЕТИЧЕСКИЕ РЯДЫ =========
+
+def synthetic_series(
+    years: int = 50,
+    end: date = FIXTURE_END,
+    start_price: float = 400.0,
+    annual_drift: float = 0.06,
+    annual_vol: float = 0.15,
+    seed: int = 42,
+) -> List[PricePoint]:
+    """Геометрическое броуновское движение по рабочим дням (цена за унцию)."""
+    rnd = random.Random(seed)
+    day = date(end.year - years, end.month, end.day)
+    dt = 1 / 252
+    mu = (annual_drift - annual_vol ** 2 / 2) * dt
+    sigma = annual_vol * math.sqrt(dt)
+    price = start_price
+    points: List[PricePoint] = []
+    one = timedelta(days=1)
+    while day <= end:
+        if day.weekday() < 5:
+            price *= math.exp(mu + sigma * rnd.gauss(0.0, 1.0))
+            points.append(PricePoint(date=day, close=price))
+        day += one
+    return points
+
+
+@lru_cache(maxsize=64)
+def _fixture_series(symbol: str, years: int, end: date) -> Tuple[PricePoint, ...]:
+    params = FIXTURE_SYMBOLS.get(symbol)
+    if params is not None:
+        start_price, drift, vol = params
+        return tuple(synthetic_series(years, end, start_price, drift, vol, seed=zlib.crc32(symbol.encode())))
+    base = symbol[:3] + "usd"
+    if symbol.endswith("eur") and base in FIXTURE_SYMBOLS:
+        metal = _fixture_series(base, years, end)
+        eurusd = _fixture_series("eurusd", years, end)
+        # рабочие дни одни и те же — делим поэлементно
+        return tuple(PricePoint(m.date, m.close / e.close) for m, e in zip(metal, eurusd))
+    return ()
+
+
+def fixture_series(symbol: str, years: int = 30, end: date = FIXTURE_END) -> List[PricePoint]:
+    """Ряд тикера в стиле Stooq; пустой список — тикер неизвестен."""
+    return list(_fixture_series(symbol.lower(), years, end))
+
+
+def stooq_csv(points: Iterable[PricePoint]) -> str:
+    lines = ["Date,Open,High,Low,Close"]
+    prev = None
+    for p in points:
+        o = prev if prev is not None else p.close
+        lines.append(f"{p.date.isoformat()},{o:.4f},{max(o, p.close):.4f},{min(o, p.close):.4f},{p.close:.4f}")
+        prev = p.close
+    return "\n".join(lines) + "\n"
+
+
+def investing_html(
+    points: List[PricePoint], title: str = "Historical Data", window: Optional[int] = INVESTING_WINDOW_ROWS
+) -> str:
+    """
+    Страница с таблицей: новые даты сверху, DD.MM.YYYY, цена с разделителем
+    тысяч; только последние window строк (None — все).
+    """
+    if window is not None:
+        points = points[-window:]
+    rows = "".join(
+        f"<tr><td>{p.date.strftime('%d.%m.%Y')}</td><td>{p.close:,.2f}</td><td>{p.close:,.2f}</td></tr>\n"
+        for p in reversed(points)
+    )
+    return (
+        f"<html><head><title>{title}</title></head><body><h1>{title}</h1>\n"
+        "<table class=\"historical\"><thead><tr><th>Date</th><th>Price</th><th>Open</th></tr></thead>\n"
+        f"<tbody>\n{rows}</tbody></table></body></html>\n"
+    )
+
+
+# ========= ЛОКАЛЬНЫЙ СЕРВЕР =========
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+
+    def do_GET(self):
+        fx: FixtureServer = self.server.fixtures
+        url = urlsplit(self.path)
+        if url.path == "/q/d/l/":
+            source = "stooq"
+            symbol = (parse_qs(url.query).get("s") or [""])[0].lower()
+        elif url.path.startswith("/currencies/") and url.path.endswith("-historical-data"):
+            source = "investing"
+            symbol = url.path[len("/currencies/"):-len("-historical-data")].replace("-", "").lower()
+        else:
+            return self._send(404, "text/plain", "not found")
+
+        fx.requests[source] = fx.requests.get(source, 0) + 1
+        if fx.latency_ms:
+            time.sleep(fx.latency_ms / 1000)
+        if source in fx.fail:
+            return self._send(503, "text/plain", "unavailable")
+        points = fixture_series(symbol, fx.years, fx.end)
+        if source == "stooq":
+            self._send(200, "text/csv", stooq_csv(points) if points else "No data")
+        elif points:
+            self._send(200, "text/html", investing_html(points, f"{symbol.upper()} Historical Data", fx.investing_window))
+        else:
+            self._send(404, "text/html", "<html><body>not found</body></html>")
+
+    def _send(self, status: int, content_type: str, body: str) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("fixture %s", format % args)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    fixtures: "FixtureServer"
+
+
+class FixtureServer:
+    """Stooq и Investing на 127.0.0.1; адреса подставляются в gold_core_telega внутри with."""
+
+    def __init__(
+        self,
+        years: int = 30,
+        end: date = FIXTURE_END,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        fail: Iterable[str] = (),
+        latency_ms: float = 0.0,
+        investing_window: Optional[int] = INVESTING_WINDOW_ROWS,
+    ):
+        self.years = years
+        self.end = end
+        self.fail = set(fail)  # "stooq" / "investing"
+        self.latency_ms = latency_ms
+        self.investing_window = investing_window
+        self.requests: Dict[str, int] = {}
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.fixtures = self
+        self._thread: Optional[threading.Thread] = None
+        self._saved: Optional[Tuple[str, str]] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FixtureServer":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="price-fixtures", daemon=True)
+            self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """В текущем потоке (CLI)."""
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FixtureServer":
+        self.start()
+        self._saved = (gold_core_telega.STOOQ_BASE_URL, gold_core_telega.INVESTING_BASE_URL)
+        gold_core_telega.STOOQ_BASE_URL = gold_core_telega.INVESTING_BASE_URL = self.url
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._saved is not None:
+            gold_core_telega.STOOQ_BASE_URL, gold_core_telega.INVESTING_BASE_URL = self._saved
+            self._saved = None
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Stooq and Investing price sources")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sv = sub.add_parser("serve")
+    sv.add_argument("--host", default="127.0.0.1")
+    sv.add_argument("--port", type=int, default=8765)
+    sv.add_argument("--years", type=int, default=30)
+    sv.add_argument("--fail", action="append", default=[], choices=["stooq", "investing"])
+    sv.add_argument("--latency-ms", type=float, default=0.0)
+    sv.add_argument("--investing-window", type=int, default=INVESTING_WINDOW_ROWS,
+                    help="строк на странице Investing, 0 — вся история")
+    args = parser.parse_args()
+
+    server = FixtureServer(
+        args.years, host=args.host, port=args.port, fail=args.fail, latency_ms=args.latency_ms,
+        investing_window=args.investing_window or None,
+    )
+    print(f"GOLD_STOOQ_BASE_URL={server.url} GOLD_INVESTING_BASE_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
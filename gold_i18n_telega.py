@@ -0,0 +1,113 @@
+# gold_i18n_telega.py
+"""
+Каталог сообщений бота: locales/<код>.json, по файлу на язык.
+
+Файлы читаются один раз при первом обращении. Статичные тексты (меню,
+подсказки) отдаются как есть, без сборки строки; inline-клавиатуры
+("keyboard.<имя>": строки из пар [подпись, callback_data]) собираются
+один раз на язык и дальше переиспользуются — InlineKeyboardMarkup в PTB
+неизменяемый, так что общий объект можно отдавать всем пользователям.
+
+Новый язык — новый файл в locales/ с ключом "_name" (подпись на кнопке
+выбора языка). Отсутствующие ключи берутся из каталога DEFAULT_LANG.
+"""
+import json
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = Path(__file__).resolve().with_name("locales")
+DEFAULT_LANG = "ru"
+
+_catalogs: Optional[Dict[str, dict]] = None
+
+
+def load_catalogs(directory: Path = LOCALES_DIR) -> Dict[str, dict]:
+    catalogs: Dict[str, dict] = {}
+    for path in sorted(directory.glob("*.json")):
+        with path.open("r", encoding="utf-8") as f:
+            catalogs[path.stem] = json.load(f)
+    if DEFAULT_LANG not in catalogs:
+        raise RuntimeError(f"{directory}: no catalog for default language '{DEFAULT_LANG}'")
+    # язык по умолчанию первым: в таком порядке идут кнопки выбора
+    order = [DEFAULT_LANG] + [code for code in catalogs if code != DEFAULT_LANG]
+    logger.info("Loaded locales: %s", ", ".join(order))
+    return {code: catalogs[code] for code in order}
+
+
+def catalogs() -> Dict[str, dict]:
+    global _catalogs
+    if _catalogs is None:
+        _catalogs = load_catalogs()
+    return _catalogs
+
+
+def reload() -> None:
+    """Перечитать файлы (и сбросить собранные клавиатуры)."""
+    global _catalogs
+    _catalogs = None
+    keyboard.cache_clear()
+    language_keyboard.cache_clear()
+    yes_words.cache_clear()
+
+
+def languages() -> List[str]:
+    return list(catalogs())
+
+
+def raw(lang: str, key: str):
+    cats = catalogs()
+    value = cats.get(lang, cats[DEFAULT_LANG]).get(key)
+    if value is None:
+        value = cats[DEFAULT_LANG].get(key)
+        if value is None:
+            raise KeyError(f"no message '{key}' in locale catalogs")
+    return value
+
+
+def t(lang: str, key: str, **kwargs) -> str:
+    """Текст сообщения; без аргументов — готовая строка из каталога."""
+    text = raw(lang, key)
+    return text.format(**kwargs) if kwargs else text
+
+
+@lru_cache(maxsize=None)
+def keyboard(lang: str, name: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(label, callback_data=data) for label, data in row] for row in raw(lang, f"keyboard.{name}")]
+    )
+
+
+@lru_cache(maxsize=None)
+def language_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(cat.get("_name", code), callback_data=f"lang:{code}") for code, cat in catalogs().items()]]
+    )
+
+
+def language_prompt() -> str:
+    return " / ".join(cat["lang.prompt"] for cat in catalogs().values() if "lang.prompt" in cat)
+
+
+def match_language(text: str) -> str:
+    """Код языка по нажатой кнопке, коду (en) или номеру кнопки; иначе язык по умолчанию."""
+    s = text.strip().lower()
+    codes = languages()
+    if s.isdigit() and 1 <= int(s) <= len(codes):
+        return codes[int(s) - 1]
+    for code, cat in catalogs().items():
+        name = cat.get("_name", code).lower()
+        if s == code or s == name or (len(s) >= 3 and name.startswith(s)):
+            return code
+    return DEFAULT_LANG
+
+
+@lru_cache(maxsize=None)
+def yes_words() -> frozenset:
+    """Ответы "да" на всех языках: пользователь может ответить не на языке меню."""
+    return frozenset(w.lower() for cat in catalogs().values() for w in cat.get("answer.yes", ()))
@@ -0,0 +1,260 @@
+# gold_limits_telega.py
+"""
+Защита от злоупотреблений дорогими действиями.
+
+* Частота: у пользователя общий TokenBucket (USER_RATE в секунду, запас
+  USER_BURST) и по бакету на каждое действие из ACTIONS. Вызов списывает
+  стоимость из обоих; не хватило — RateLimitedError со временем ожидания.
+* Модель стоимости: вызов стоит 1 токен плюс units / unit (для рассрочки
+  units — число месяцев: столько строк считает installment_schedule и
+  выводит ответ). Предел ввода выводится из неё же: самый большой ввод,
+  стоимость которого помещается в запас действия (max_units) — больше
+  бакет не выдаст никогда.
+* Тяжёлые действия (CSV, графики, рассрочка, покупка наперёд) занимают
+  один из HEAVY_CONCURRENCY слотов на процесс; свободного слота нет дольше
+  HEAVY_WAIT_SEC — HeavyBusyError, токены возвращаются. Их же возвращает
+  ComputeError из тела (очередь пула полна, таймаут): расчёта не было.
+* clip_lines — длинный список строк укладывается в одно сообщение
+  Telegram (MESSAGE_MAX_CHARS): начало и конец, между ними — пропуск.
+
+Состояние — в памяти процесса: при нескольких воркерах пределы у каждого
+свои. GOLD_RATE_LIMITS=0 выключает частоту и слоты (пределы ввода остаются).
+"""
+import asyncio
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from gold_compute_telega import ComputeError
+from gold_metrics_telega import counter
+from gold_scheduler_telega import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITS = os.getenv("GOLD_RATE_LIMITS", "1") == "1"
+USER_RATE = float(os.getenv("USER_RATE", "1"))
+USER_BURST = float(os.getenv("USER_BURST", "15"))
+HEAVY_CONCURRENCY = int(os.getenv("HEAVY_CONCURRENCY", "8"))
+HEAVY_WAIT_SEC = float(os.getenv("HEAVY_WAIT_SEC", "5"))
+# пользователей, чьи бакеты держим в памяти; вытесненный начинает с полного запаса
+MAX_TRACKED_USERS = 100_000
+# Telegram режет на 4096; эмодзи вне BMP считаются за два символа — берём с запасом
+MESSAGE_MAX_CHARS = 4000
+# прогноз на m месяцев — O(1), но (1 + r) ** m переполняется; дальше 100 лет смысла нет
+MAX_FORECAST_MONTHS = 1200
+
+LIMITED = counter("gold_limited_total", "Actions refused by rate or concurrency limits", ["action", "reason"])
+
+
+@dataclass(frozen=True)
+class ActionLimit:
+    rate: float         # токенов в секунду на пользователя
+    burst: float        # запас токенов: сколько вызовов подряд
+    unit: float = 0.0   # сколько единиц ввода стоят один токен сверх базового
+    heavy: bool = False
+
+    def cost(self, units: int = 0) -> float:
+        return 1.0 + (units / self.unit if self.unit else 0.0)
+
+    def max_units(self) -> int:
+        """Самый большой ввод, для которого cost(units) <= burst."""
+        return int((self.burst - 1.0) * self.unit) if self.unit else 0
+
+
+ACTIONS: Dict[str, ActionLimit] = {
+    "export": ActionLimit(rate=1 / 20, burst=3, heavy=True),
+    "charts": ActionLimit(rate=1 / 20, burst=3, heavy=True),
+    # 120 месяцев — один токен: рассрочка на 50 лет (600 месяцев) съедает весь запас
+    "debt": ActionLimit(rate=1 / 6, burst=6, unit=120, heavy=True),
+    "buy_ahead": ActionLimit(rate=1 / 3, burst=5, heavy=True),
+    "forecast": ActionLimit(rate=1, burst=10),
+}
+
+
+class LimitError(Exception):
+    pass
+
+
+class RateLimitedError(LimitError):
+    def __init__(self, action: str, retry_after: float):
+        super().__init__(f"{action}: retry in {retry_after:.1f}s")
+        self.action = action
+        self.retry_after = retry_after
+
+
+class HeavyBusyError(LimitError):
+    """Все слоты тяжёлых действий заняты."""
+
+
+def max_units(action: str) -> int:
+    return ACTIONS[action].max_units()
+
+
+# ========= ЧАСТОТА =========
+
+class RateLimiter:
+    """Бакеты пользователя: общий и по действиям, LRU по пользователям."""
+
+    def __init__(
+        self,
+        actions: Dict[str, ActionLimit] = ACTIONS,
+        user_rate: float = USER_RATE,
+        user_burst: float = USER_BURST,
+        max_users: int = MAX_TRACKED_USERS,
+    ):
+        self.actions = actions
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_users = max_users
+        self._users: "OrderedDict[int, Dict[Optional[str], TokenBucket]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _buckets(self, user_id: int, action: str) -> Tuple[TokenBucket, TokenBucket]:
+        with self._lock:
+            buckets = self._users.get(user_id)
+            if buckets is None:
+                buckets = self._users[user_id] = {None: TokenBucket(self.user_rate, self.user_burst)}
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+            bucket = buckets.get(action)
+            if bucket is None:
+                limit = self.actions[action]
+                bucket = buckets[action] = TokenBucket(limit.rate, limit.burst)
+            return buckets[None], bucket
+
+    def acquire(self, user_id: int, action: str, units: int = 0) -> float:
+        """Списать стоимость вызова; RateLimitedError, если не хватает токенов."""
+        cost = self.actions[action].cost(units)
+        user, own = self._buckets(user_id, action)
+        if not own.try_acquire(cost):
+            LIMITED.inc(action=action, reason="action")
+            raise RateLimitedError(action, own.delay(cost))
+        if not user.try_acquire(cost):
+            own.refund(cost)
+            LIMITED.inc(action=action, reason="user")
+            raise RateLimitedError(action, user.delay(cost))
+        return cost
+
+    def refund(self, user_id: int, action: str, cost: float) -> None:
+        user, own = self._buckets(user_id, action)
+        own.refund(cost)
+        user.refund(cost)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+# ========= СЛОТЫ ТЯЖЁЛЫХ ДЕЙСТВИЙ =========
+
+class HeavySlots:
+    """Не больше limit тяжёлых действий одновременно в процессе."""
+
+    def __init__(self, limit: int = HEAVY_CONCURRENCY, wait: float = HEAVY_WAIT_SEC):
+        self.limit = limit
+        self.wait = wait
+        self.in_flight = 0
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # семафор привязан к циклу событий; новый цикл (тесты, прогоны) — новый семафор
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._sem, self._loop = asyncio.Semaphore(self.limit), loop
+        return self._sem
+
+    async def acquire(self) -> None:
+        """Занять слот; не дождались за wait секунд — HeavyBusyError."""
+        sem = self._semaphore()
+        if not sem.locked():
+            # свободный слот берётся сразу, без лишней задачи и переключения цикла
+            await sem.acquire()
+            self.in_flight += 1
+            return
+        waiter = asyncio.ensure_future(sem.acquire())
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.wait)
+        except asyncio.TimeoutError:
+            # слот мог достаться в последний момент — тогда вернуть его
+            if not waiter.cancel():
+                sem.release()
+            raise HeavyBusyError(f"{self.limit} heavy actions in flight")
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._sem.release()
+
+
+_limiter = RateLimiter()
+_slots = HeavySlots()
+
+
+def get_rate_limiter() -> RateLimiter:
+    return _limiter
+
+
+def get_heavy_slots() -> HeavySlots:
+    return _slots
+
+
+@asynccontextmanager
+async def guard(user_id: int, action: str, units: int = 0) -> AsyncIterator[None]:
+    """
+    Обёртка дорогого действия: списать токены, для тяжёлого — занять слот.
+    Ошибки пределов — LimitError; если слот не дождались или тело упало
+    с ComputeError, токены возвращаются.
+    """
+    if not RATE_LIMITS:
+        yield
+        return
+    cost = _limiter.acquire(user_id, action, units)
+    heavy = ACTIONS[action].heavy
+    if heavy:
+        try:
+            await _slots.acquire()
+        except HeavyBusyError:
+            _limiter.refund(user_id, action, cost)
+            LIMITED.inc(action=action, reason="busy")
+            raise
+    try:
+        yield
+    except ComputeError:
+        _limiter.refund(user_id, action, cost)
+        raise
+    finally:
+        if heavy:
+            _slots.release()
+
+
+# ========= ДЛИНА ОТВЕТА =========
+
+def clip_lines(lines: List[str], budget: int, omitted: Callable[[int], str]) -> List[str]:
+    """
+    Строки, которые вместе с переводами строк укладываются в budget символов:
+    начало (две трети места) и конец, между ними omitted(сколько пропущено).
+    """
+    if sum(len(s) + 1 for s in lines) <= budget:
+        return lines
+    budget -= len(omitted(len(lines))) + 1
+    head: List[str] = []
+    used = 0
+    for s in lines:
+        if used + len(s) + 1 > budget * 2 // 3:
+            break
+        head.append(s)
+        used += len(s) + 1
+    tail: List[str] = []
+    for s in reversed(lines[len(head):]):
+        if used + len(s) + 1 > budget:
+            break
+        tail.append(s)
+        used += len(s) + 1
+    tail.reverse()
+    return head + [omitted(len(lines) - len(head) - len(tail))] + tail
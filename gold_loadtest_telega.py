@@ -0,0 +1,261 @@
+# gold_loadtest_telega.py
+"""
+Нагрузочный прогон ConversationHandler из gold_telega.py без сети:
+тысячи симулированных пользователей проходят типовой сценарий,
+ответы бота перехватывает FakeBot. В конце — p50/p99 задержки по шагам.
+
+    python gold_loadtest_telega.py --users 2000 --concurrency 200
+    python gold_loadtest_telega.py --buttons     # тот же сценарий через inline-кнопки
+"""
+import argparse
+import asyncio
+import itertools
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from telegram import Update
+from telegram.ext import Application, ExtBot
+
+import gold_core_telega
+from gold_core_telega import PriceSeries
+from gold_market_telega import PriceBook, install_price_book
+from gold_fixtures_telega import synthetic_series
+
+FAKE_TOKEN = "123456:FAKE-TOKEN-FOR-LOAD-TESTS"
+
+# (метка шага, текст сообщения)
+SCENARIO: List[Tuple[str, str]] = [
+    ("start", "/start"),
+    ("choose_lang", "English"),
+    ("main_menu:add", "1"),
+    ("add_child_id", "1"),
+    ("add_child_name", "Kid"),
+    ("add_child_birth", "2012-05-20"),
+    ("add_child_target", "18"),
+    ("add_child_instrument", "XAU"),
+    ("add_child_currency", "EUR"),
+    ("add_child_budget", "255"),
+    ("main_menu:open", "3"),
+    ("child_menu_enter", "1"),
+    ("child_action:years", "1"),
+    ("child_action:forecast", "4"),
+    ("child_action:custom", "36"),
+    ("child_action:status", "2"),
+    ("child_status_have", "40"),
+    ("child_action:debt", "3"),
+    ("child_debt_have", "10"),
+    ("child_debt_split", "12"),
+    ("child_debt_include_base", "yes"),
+    ("child_action:back", "0"),
+    ("main_menu:exit", "0"),
+]
+
+# то же через inline-кнопки: "@данные" — нажатие кнопки с callback_data
+BUTTON_SCENARIO: List[Tuple[str, str]] = [
+    ("start", "/start"),
+    ("choose_lang", "@lang:en"),
+    ("main_menu:add", "@main:1"),
+    ("add_child_id", "1"),
+    ("add_child_name", "Kid"),
+    ("add_child_birth", "2012-05-20"),
+    ("add_child_target", "@target:18"),
+    ("add_child_instrument", "@inst:XAU"),
+    ("add_child_currency", "@cur:EUR"),
+    ("add_child_budget", "255"),
+    ("main_menu:open", "@main:3"),
+    ("child_menu_enter", "@open:1"),
+    ("child_action:years", "@child:1"),
+    ("child_action:forecast", "@child:4"),
+    ("child_action:custom", "36"),
+    ("child_action:status", "@child:2"),
+    ("child_status_have", "40"),
+    ("child_action:debt", "@child:3"),
+    ("child_debt_have", "10"),
+    ("child_debt_split", "12"),
+    ("child_debt_include_base", "@base:yes"),
+    ("child_action:back", "@child:0"),
+    ("main_menu:exit", "@main:0"),
+]
+
+
+class FakeBot(ExtBot):
+    """Отвечает на вызовы Bot API локально, без HTTP; запоминает исходящие."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Bot после __init__ заморожен — заводим только изменяемые контейнеры
+        with self._unfrozen():
+            self.calls: Dict[str, int] = defaultdict(int)
+            self.sent: List[Tuple[int, str]] = []
+            self._message_ids = itertools.count(1)
+
+    async def _do_post(self, endpoint, data, *args, **kwargs):
+        self.calls[endpoint] += 1
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_gold_bot"}
+        chat_id = int(data.get("chat_id", 0) or 0)
+        message_id = next(self._message_ids)
+        result = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if "text" in data:
+            result["text"] = data["text"]
+            self.sent.append((chat_id, data["text"]))
+        if endpoint == "sendDocument":
+            result["document"] = {"file_id": f"doc{message_id}", "file_unique_id": f"u{message_id}"}
+        if endpoint == "sendPhoto":
+            result["photo"] = [
+                {"file_id": f"ph{message_id}", "file_unique_id": f"u{message_id}", "width": 1, "height": 1}
+            ]
+        if endpoint.startswith("edit"):
+            return result if "chat_id" in data else True
+        if endpoint in ("answerCallbackQuery", "deleteMessage", "setMyCommands"):
+            return True
+        return result
+
+
+class UpdateFactory:
+    def __init__(self, bot: FakeBot):
+        self.bot = bot
+        self._update_id = 0
+        self._message_id = 0
+
+    def text(self, user_id: int, text: str) -> Update:
+        self._update_id += 1
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(datetime.now(tz=timezone.utc).timestamp()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return Update.de_json({"update_id": self._update_id, "message": message}, self.bot)
+
+    def button(self, user_id: int, data: str) -> Update:
+        """Нажатие inline-кнопки под последним сообщением бота."""
+        self._update_id += 1
+        query = {
+            "id": str(self._update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": self._message_id,
+                "date": int(datetime.now(tz=timezone.utc).timestamp()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Fake"},
+                "text": "menu",
+            },
+        }
+        return Update.de_json({"update_id": self._update_id, "callback_query": query}, self.bot)
+
+    def update(self, user_id: int, text: str) -> Update:
+        return self.button(user_id, text[1:]) if text.startswith("@") else self.text(user_id, text)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return float("nan")
+    s = sorted(samples)
+    k = min(len(s) - 1, max(0, int(round(q / 100 * (len(s) - 1)))))
+    return s[k]
+
+
+async def build_app() -> Tuple[Application, FakeBot]:
+    import gold_telega  # после подготовки DATA_DIR и цен
+    from telegram.ext import CallbackQueryHandler
+
+    bot = FakeBot(FAKE_TOKEN)
+    app = Application.builder().bot(bot).updater(None).build()
+    app.add_handler(gold_telega.build_conversation())
+    app.add_handler(CallbackQueryHandler(gold_telega.stale_button))
+    await app.initialize()
+    return app, bot
+
+
+async def run_user(
+    app: Application, factory: UpdateFactory, user_id: int, timings: Dict[str, List[float]],
+    scenario: List[Tuple[str, str]] = SCENARIO,
+):
+    for step, text in scenario:
+        update = factory.update(user_id, text)
+        t0 = time.perf_counter()
+        await app.process_update(update)
+        timings[step].append((time.perf_counter() - t0) * 1000)
+
+
+async def run_load(users: int, concurrency: int, scenario: List[Tuple[str, str]] = SCENARIO) -> Dict:
+    app, bot = await build_app()
+    factory = UpdateFactory(bot)
+    timings: Dict[str, List[float]] = defaultdict(list)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(uid: int):
+        async with sem:
+            await run_user(app, factory, uid, timings, scenario)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(100000 + i) for i in range(users)))
+    wall = time.perf_counter() - t0
+    await app.shutdown()
+
+    return {
+        "users": users,
+        "updates": users * len(scenario),
+        "wall_s": wall,
+        "api_calls": dict(bot.calls),
+        "steps": {
+            step: {"p50_ms": percentile(v, 50), "p99_ms": percentile(v, 99), "mean_ms": statistics.fmean(v)}
+            for step, v in timings.items()
+        },
+        "all": {
+            "p50_ms": percentile([x for v in timings.values() for x in v], 50),
+            "p99_ms": percentile([x for v in timings.values() for x in v], 99),
+        },
+    }
+
+
+def prepare_environment(data_dir: Path, years: int = 30) -> None:
+    gold_core_telega.DATA_DIR = data_dir
+    series = PriceSeries.from_points(synthetic_series(years=years))
+    install_price_book(PriceBook(base=None, fx={}, direct={"EUR": series}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Handler load test with a fake Bot")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--years", type=int, default=30, help="длина синтетического ряда цен")
+    parser.add_argument("--buttons", action="store_true", help="сценарий через inline-кнопки")
+    args = parser.parse_args()
+    scenario = BUTTON_SCENARIO if args.buttons else SCENARIO
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_environment(Path(tmp), args.years)
+        report = asyncio.run(run_load(args.users, args.concurrency, scenario))
+
+    print(f"{report['users']} users, {report['updates']} updates in {report['wall_s']:.2f}s "
+          f"({report['updates'] / report['wall_s']:.0f} upd/s)")
+    print(f"{'step':<28}{'p50 ms':>10}{'p99 ms':>10}")
+    for step, _ in scenario:
+        r = report["steps"].get(step)
+        if r:
+            print(f"{step:<28}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}")
+    print(f"{'ALL':<28}{report['all']['p50_ms']:>10.3f}{report['all']['p99_ms']:>10.3f}")
+    print("API calls:", ", ".join(f"{k}={v}" for k, v in sorted(report["api_calls"].items())))
+    calls = sum(v for k, v in report["api_calls"].items() if k != "getMe")
+    print(f"API calls per session: {calls / report['users']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+# gold_market_telega.py
+"""
+Валютный слой и реестр инструментов: базовый ряд металла к USD
+(XAUUSD, XAGUSD, ...) + FX-ряды, кросс-курсы в любой поддерживаемой валюте.
+
+Ряды кэшируются по паре (одна загрузка на пару за обновление),
+выравнивание по датам считается один раз на PriceBook и общее
+для всех планов. Книги инструментов грузятся лениво, при первом обращении.
+"""
+import logging
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+
+from gold_core_telega import (
+    GRAMS_PER_OUNCE,
+    PricePoint,
+    PriceSeries,
+    PriceSourceError,
+    load_price_history,
+)
+from gold_metrics_telega import cache_hit, gauge
+from gold_quality_telega import checked
+from gold_sources_telega import get_source_pool
+
+logger = logging.getLogger(__name__)
+
+BASE_CURRENCY = "USD"
+
+# валюта -> (тикер Stooq, котировка "USD за 1 единицу валюты")
+#   eurusd = USD за 1 EUR  -> XAU/EUR = XAUUSD / EURUSD
+#   usdrub = RUB за 1 USD  -> XAU/RUB = XAUUSD * USDRUB
+FX_PAIRS: Dict[str, Tuple[str, bool]] = {
+    "EUR": ("eurusd", True),
+    "GBP": ("gbpusd", True),
+    "CHF": ("usdchf", False),
+    "RUB": ("usdrub", False),
+}
+SUPPORTED_CURRENCIES = [BASE_CURRENCY] + list(FX_PAIRS)
+
+# сколько секунд скачанный ряд пары считается свежим
+PAIR_MAX_AGE_SEC = 6 * 3600
+
+
+# ========= РЕЕСТР ИНСТРУМЕНТОВ =========
+
+@dataclass(frozen=True)
+class Instrument:
+    code: str               # XAU, XAG, ...
+    name_ru: str
+    name_en: str
+    stooq_symbol: str       # ряд к USD на Stooq
+    legacy_stooq_symbol: str  # прямой ряд к EUR (резерв; при недоступном Stooq — та же пара на Investing)
+    refresh_interval_sec: int = 6 * 3600
+
+
+INSTRUMENTS: Dict[str, Instrument] = {
+    "XAU": Instrument("XAU", "Золото", "Gold", "xauusd", "xaueur"),
+    "XAG": Instrument("XAG", "Серебро", "Silver", "xagusd", "xageur"),
+    "XPT": Instrument(
+        "XPT", "Платина", "Platinum", "xptusd", "xpteur",
+        refresh_interval_sec=12 * 3600,
+    ),
+    "XPD": Instrument(
+        "XPD", "Палладий", "Palladium", "xpdusd", "xpdeur",
+        refresh_interval_sec=12 * 3600,
+    ),
+}
+DEFAULT_INSTRUMENT = "XAU"
+
+
+def get_instrument(code: str) -> Instrument:
+    try:
+        return INSTRUMENTS[code.upper()]
+    except KeyError:
+        raise PriceSourceError(f"Unknown instrument {code}.")
+
+
+# ========= КЭШ РЯДОВ ПО ПАРАМ =========
+
+_pair_cache: Dict[str, Tuple[float, PriceSeries]] = {}
+_pair_lock = threading.Lock()
+
+
+def load_pair(symbol: str, max_age: float = PAIR_MAX_AGE_SEC) -> PriceSeries:
+    """Ряд пары из кэша, если он свежий, иначе гонка источников пула."""
+    now = time.monotonic()
+    with _pair_lock:
+        cached = _pair_cache.get(symbol)
+    if cached is not None and now - cached[0] < max_age:
+        cache_hit("fx_pair", True)
+        return cached[1]
+    cache_hit("fx_pair", False)
+    series = get_source_pool().fetch_first(
+        symbol, validate=lambda data: checked(PriceSeries.of(data), symbol)
+    )
+    with _pair_lock:
+        _pair_cache[symbol] = (now, series)
+    return series
+
+
+# ========= ВЫРАВНИВАНИЕ ПО ДАТАМ =========
+
+def align_cross(base: PriceSeries, fx: PriceSeries, quote_is_usd: bool) -> PriceSeries:
+    """
+    Кросс-курс по датам базового ряда: для каждой даты XAUUSD берём
+    курс FX на ту же дату или последний известный до неё (as-of join).
+    Один проход двумя указателями по отсортированным массивам.
+    Даты раньше первого значения FX отбрасываются.
+    """
+    out_ord = array("l")
+    out_close = array("d")
+    fx_ord = fx.ordinals
+    fx_close = fx.closes
+    n_fx = len(fx_ord)
+    j = -1
+    for o, c in zip(base.ordinals, base.closes):
+        while j + 1 < n_fx and fx_ord[j + 1] <= o:
+            j += 1
+        if j < 0:
+            continue
+        rate = fx_close[j]
+        if rate <= 0:
+            continue
+        out_ord.append(o)
+        out_close.append(c / rate if quote_is_usd else c * rate)
+    return PriceSeries(ordinals=out_ord, closes=out_close)
+
+
+# ========= СНИМОК ЦЕН =========
+
+class PriceBook:
+    """
+    Снимок цен одного обновления. Кросс-ряды считаются лениво
+    и один раз, дальше все планы используют один и тот же объект.
+    """
+
+    def __init__(
+        self,
+        base: Optional[PriceSeries],
+        fx: Dict[str, PriceSeries],
+        direct: Optional[Dict[str, PriceSeries]] = None,
+        instrument: str = DEFAULT_INSTRUMENT,
+        loaded_at: Optional[float] = None,
+        version: Optional[int] = None,
+    ):
+        self.instrument = instrument
+        self.base = base
+        self.fx = fx
+        self.loaded_at = loaded_at if loaded_at is not None else time.time()
+        # меняется с каждой новой книгой; по нему инвалидируются кэши расчётов
+        self.version = version if version is not None else time.time_ns()
+        self._series: Dict[str, PriceSeries] = dict(direct or {})
+        self._points: Dict[str, List[PricePoint]] = {}
+        self._lock = threading.Lock()
+        if base is not None:
+            self._series.setdefault(BASE_CURRENCY, base)
+
+    def currencies(self) -> List[str]:
+        if self.base is None:
+            return [c for c in SUPPORTED_CURRENCIES if c in self._series]
+        return [BASE_CURRENCY] + [c for c in FX_PAIRS if c in self.fx]
+
+    def series(self, currency: str) -> PriceSeries:
+        currency = currency.upper()
+        with self._lock:
+            s = self._series.get(currency)
+            cache_hit("cross_series", s is not None)
+            if s is not None:
+                return s
+            if self.base is None or currency not in self.fx:
+                raise PriceSourceError(f"No price data for currency {currency}.")
+            _, quote_is_usd = FX_PAIRS[currency]
+            s = align_cross(self.base, self.fx[currency], quote_is_usd)
+            self._series[currency] = s
+            return s
+
+    def points(self, currency: str) -> List[PricePoint]:
+        """Ряд в виде PricePoint для register_child (тоже кэшируется)."""
+        currency = currency.upper()
+        with self._lock:
+            pts = self._points.get(currency)
+        if pts is not None:
+            return pts
+        pts = self.series(currency).to_points()
+        if not pts:
+            raise PriceSourceError(f"No price data for currency {currency}.")
+        with self._lock:
+            self._points.setdefault(currency, pts)
+        return pts
+
+    def gram_price(self, currency: str) -> Optional[float]:
+        """Последняя цена грамма в валюте или None, если ряда нет."""
+        try:
+            closes = self.series(currency).closes
+        except PriceSourceError:
+            return None
+        if not closes:
+            return None
+        return closes[-1] / GRAMS_PER_OUNCE
+
+    def rate_to_eur(self, currency: str) -> float:
+        """
+        Сколько EUR стоит единица валюты по последним ценам (для порогов в EUR).
+        Курс не посчитать — PriceSourceError: пороги в EUR к другой валюте
+        без пересчёта не применяются.
+        """
+        currency = currency.upper()
+        if currency == "EUR":
+            return 1.0
+        eur = self.series("EUR").closes
+        cur = self.series(currency).closes
+        if not eur or not cur or cur[-1] <= 0:
+            raise PriceSourceError(f"No {currency}/EUR rate for {self.instrument}.")
+        return eur[-1] / cur[-1]
+
+    def is_stale(self) -> bool:
+        interval = INSTRUMENTS[self.instrument].refresh_interval_sec
+        return time.time() - self.loaded_at >= interval
+
+
+def load_price_book(
+    instrument: str = DEFAULT_INSTRUMENT, currencies: Optional[List[str]] = None
+) -> PriceBook:
+    """
+    Загружает ряд инструмента к USD и нужные FX-ряды. Если базовый ряд
+    недоступен — откатывается к прямому ряду к EUR (Stooq → Investing),
+    тогда в книге будет только EUR.
+    """
+    inst = get_instrument(instrument)
+    if currencies is None:
+        currencies = SUPPORTED_CURRENCIES
+    try:
+        base = load_pair(inst.stooq_symbol, max_age=inst.refresh_interval_sec)
+    except PriceSourceError:
+        legacy = checked(
+            PriceSeries.from_points(load_price_history(inst.legacy_stooq_symbol)),
+            inst.legacy_stooq_symbol,
+        )
+        return PriceBook(base=None, fx={}, direct={"EUR": legacy}, instrument=inst.code)
+
+    fx: Dict[str, PriceSeries] = {}
+    for cur in currencies:
+        cur = cur.upper()
+        if cur not in FX_PAIRS:
+            continue
+        try:
+            fx[cur] = load_pair(FX_PAIRS[cur][0])
+        except PriceSourceError:
+            # валюта просто будет недоступна в этом обновлении
+            continue
+    return PriceBook(base=base, fx=fx, instrument=inst.code)
+
+
+# ========= ТЕКУЩИЕ КНИГИ ПО ИНСТРУМЕНТАМ =========
+
+# ключ появляется только после первого обращения к инструменту
+_books: Dict[str, PriceBook] = {}
+_book_locks: Dict[str, threading.Lock] = {code: threading.Lock() for code in INSTRUMENTS}
+# чем заполнять книгу при обновлении; в многопроцессном режиме подменяется
+# (лидер качает и публикует, остальные читают общий файл)
+_book_loader: Callable[..., PriceBook] = load_price_book
+# кого звать после каждой новой книги (ценовые алерты); вызываются в потоке обновления
+_refresh_listeners: List[Callable[[PriceBook], None]] = []
+
+
+def set_book_loader(loader: Callable[..., PriceBook]) -> None:
+    global _book_loader
+    _book_loader = loader
+
+
+def add_refresh_listener(listener: Callable[[PriceBook], None]) -> None:
+    if listener not in _refresh_listeners:
+        _refresh_listeners.append(listener)
+
+
+def remove_refresh_listener(listener: Callable[[PriceBook], None]) -> None:
+    if listener in _refresh_listeners:
+        _refresh_listeners.remove(listener)
+
+
+def get_price_book(instrument: str = DEFAULT_INSTRUMENT) -> Optional[PriceBook]:
+    """Текущая книга инструмента или None, если он ещё не загружался."""
+    return _books.get(instrument.upper())
+
+
+def refresh_price_book(
+    instrument: str = DEFAULT_INSTRUMENT, currencies: Optional[List[str]] = None
+) -> PriceBook:
+    """Строит новый снимок и атомарно подменяет текущий."""
+    code = get_instrument(instrument).code
+    book = _book_loader(code, currencies)
+    _books[code] = book
+    for listener in list(_refresh_listeners):
+        try:
+            listener(book)
+        except Exception:
+            logger.exception("Price refresh listener failed")
+    return book
+
+
+def ensure_price_book(instrument: str = DEFAULT_INSTRUMENT) -> PriceBook:
+    """
+    Ленивая загрузка: первый вызов грузит ряды инструмента, дальше
+    книга обновляется только по его расписанию (refresh_interval_sec).
+    Если обновление не удалось, остаётся прежняя книга.
+    """
+    code = get_instrument(instrument).code
+    book = _books.get(code)
+    if book is not None and not book.is_stale():
+        return book
+    with _book_locks[code]:
+        book = _books.get(code)
+        if book is not None and not book.is_stale():
+            return book
+        try:
+            return refresh_price_book(code)
+        except PriceSourceError:
+            if book is None:
+                raise
+            return book
+
+
+def _book_ages() -> Dict[Tuple[str, ...], float]:
+    now = time.time()
+    return {(code,): now - book.loaded_at for code, book in _books.items()}
+
+
+def _series_ages() -> Dict[Tuple[str, ...], float]:
+    today = date.today().toordinal()
+    res = {}
+    for code, book in _books.items():
+        for cur in book.currencies():
+            try:
+                ordinals = book.series(cur).ordinals
+            except PriceSourceError:
+                continue
+            if ordinals:
+                res[(code, cur)] = today - ordinals[-1]
+    return res
+
+
+gauge("gold_price_book_age_seconds", "Seconds since the price book was loaded", ["instrument"], _book_ages)
+gauge("gold_price_series_age_days", "Days since the last price point", ["instrument", "currency"], _series_ages)
+
+
+def install_price_book(book: PriceBook) -> None:
+    """Подставить готовую книгу (бенчмарки, нагрузочные прогоны)."""
+    _books[book.instrument] = book
+
+
+def loaded_instruments() -> List[str]:
+    return list(_books)
@@ -0,0 +1,276 @@
+# gold_metrics_telega.py
+"""
+Метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей:
+счётчики, гистограммы, gauge-и с колбэками и HTTP-эндпоинт /metrics.
+
+Включается переменной окружения METRICS_PORT (слушаем 127.0.0.1).
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[str, ...]
+
+
+def _fmt_labels(names: Sequence[str], values: LabelKey, extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(_escape(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Значение задаётся явно (set) или читается колбэком при каждом сборе."""
+    kind = "gauge"
+
+    def __init__(self, name, doc, labels=(), callback: Optional[Callable[[], Dict[LabelKey, float]]] = None):
+        super().__init__(name, doc, labels)
+        self._values: Dict[LabelKey, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def collect(self) -> List[str]:
+        if self.callback is not None:
+            try:
+                items = list(self.callback().items())
+            except Exception:
+                logger.exception("Gauge callback %s failed", self.name)
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # ключ -> [счётчики по бакетам..., +Inf], сумма
+        self._counts: Dict[LabelKey, List[int]] = {}
+        self._sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[idx] += 1
+            self._sums[key] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def collect(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = [(k, list(c), self._sums[k]) for k, c in self._counts.items()]
+        bounds = ['le="%s"' % b for b in self.buckets] + ['le="+Inf"']
+        for key, counts, total in items:
+            acc = 0
+            for bound, c in zip(bounds, counts):
+                acc += c
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.label_names, key, bound)} {acc}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.label_names, key)} {acc}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, hist: Histogram, labels: Dict[str, str]):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+        return False
+
+
+# ========= РЕЕСТР =========
+
+_registry: Dict[str, _Metric] = {}
+
+
+def _register(metric: _Metric) -> _Metric:
+    existing = _registry.get(metric.name)
+    if existing is not None:
+        return existing
+    _registry[metric.name] = metric
+    return metric
+
+
+def counter(name: str, doc: str, labels: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, doc, labels))
+
+
+def gauge(name: str, doc: str, labels: Sequence[str] = (), callback=None) -> Gauge:
+    return _register(Gauge(name, doc, labels, callback))
+
+
+def histogram(name: str, doc: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, doc, labels, buckets))
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# ========= ОБЩИЕ МЕТРИКИ =========
+
+HANDLER_SECONDS = histogram("gold_handler_seconds", "Handler latency", ["handler"])
+HANDLER_ERRORS = counter("gold_handler_errors_total", "Handler exceptions", ["handler"])
+PRICE_FETCH_SECONDS = histogram("gold_price_fetch_seconds", "Outbound price fetch latency", ["source"])
+PRICE_FETCH_TOTAL = counter("gold_price_fetch_total", "Outbound price fetches", ["source", "result"])
+CACHE_REQUESTS = counter("gold_cache_requests_total", "Cache lookups", ["cache", "result"])
+PLAN_IO_SECONDS = histogram(
+    "gold_plan_store_seconds", "Plan store I/O time", ["op"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+# пользователь -> время последнего обновления (monotonic). Брошенный диалог
+# END не возвращает: активным считается тот, кто писал за ACTIVE_WINDOW_SEC
+ACTIVE_WINDOW_SEC = float(os.getenv("ACTIVE_WINDOW_SEC", "900"))
+_active_users: Dict[int, float] = {}
+_active_lock = threading.Lock()
+
+
+def active_users(now: Optional[float] = None) -> int:
+    """Пользователи в диалоге за окно; заодно выбрасывает ушедших."""
+    cutoff = (now if now is not None else time.monotonic()) - ACTIVE_WINDOW_SEC
+    with _active_lock:
+        for uid in [uid for uid, seen in _active_users.items() if seen < cutoff]:
+            del _active_users[uid]
+        return len(_active_users)
+
+
+gauge(
+    "gold_active_conversations", "Users inside a conversation, seen within ACTIVE_WINDOW_SEC",
+    callback=lambda: {(): active_users()},
+)
+
+
+def cache_hit(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def instrument_handler(fn: Callable, end_state: int = -1, active: bool = True) -> Callable:
+    """
+    Обёртка async-обработчика: время, ошибки и учёт активных диалогов
+    (пользователь активен, пока обработчик не вернул end_state, но не
+    дольше ACTIVE_WINDOW_SEC после последнего обновления). active=False —
+    обработчик вне диалога: только время и ошибки.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(update, context):
+        t0 = time.perf_counter()
+        try:
+            state = await fn(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - t0, handler=name)
+        user = getattr(update, "effective_user", None)
+        if active and user is not None:
+            with _active_lock:
+                if state == end_state:
+                    _active_users.pop(user.id, None)
+                else:
+                    _active_users[user.id] = time.monotonic()
+        return state
+
+    return wrapper
+
+
+# ========= HTTP =========
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    # http.server тянет за собой email/mimetypes — импортируем только если эндпоинт нужен
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            logger.debug("metrics: " + fmt, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info("Metrics endpoint on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,123 @@
+# gold_profiling_telega.py
+"""
+Профилирование медленных обновлений по запросу.
+
+Выключено по умолчанию: обёртка тогда стоит одну проверку флага.
+Включается переменной PROFILE_SLOW_MS=<порог> или админ-командой /profile.
+Во включённом режиме обработчик идёт под cProfile, а профиль сохраняется
+в DATA_DIR/profiles только если обработка заняла дольше порога.
+Хранится не больше PROFILE_KEEP последних файлов.
+
+Смотреть профиль: python -m pstats .gold_plans_telega/profiles/<file>.prof
+"""
+import cProfile
+import functools
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import gold_core_telega
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD_MS = 500.0
+DEFAULT_KEEP = 50
+
+
+class ProfilerState:
+    def __init__(self):
+        slow_ms = os.getenv("PROFILE_SLOW_MS")
+        self.enabled = bool(slow_ms)
+        self.threshold_ms = float(slow_ms) if slow_ms else DEFAULT_THRESHOLD_MS
+        self.keep = int(os.getenv("PROFILE_KEEP", DEFAULT_KEEP))
+        self.saved = 0
+        # cProfile один на поток: пока идёт один профиль, остальные обновления
+        # обрабатываются без профилирования
+        self.busy = False
+
+    def enable(self, threshold_ms: Optional[float] = None) -> None:
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+
+state = ProfilerState()
+
+
+def profiles_dir() -> Path:
+    return gold_core_telega.DATA_DIR / "profiles"
+
+
+def list_profiles() -> List[Path]:
+    d = profiles_dir()
+    if not d.exists():
+        return []
+    return sorted(d.glob("*.prof"), key=lambda p: p.stat().st_mtime)
+
+
+def _rotate(keep: int) -> None:
+    files = list_profiles()
+    for old in files[: max(0, len(files) - keep)]:
+        try:
+            old.unlink()
+        except OSError:
+            pass
+
+
+def _save(profiler: cProfile.Profile, name: str, elapsed_ms: float) -> Path:
+    d = profiles_dir()
+    d.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    path = d / f"{stamp}_{name}_{elapsed_ms:.0f}ms.prof"
+    profiler.dump_stats(str(path))
+    state.saved += 1
+    _rotate(state.keep)
+    return path
+
+
+def profiled(fn: Callable) -> Callable:
+    """
+    Обёртка async-обработчика. Учтите: пока обработчик ждёт I/O, в профиль
+    попадают и другие корутины цикла — это как раз видно в отчёте как
+    время Telegram I/O и чужих обновлений.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(update, context):
+        if not state.enabled or state.busy:
+            return await fn(update, context)
+
+        state.busy = True
+        profiler = cProfile.Profile()
+        t0 = time.perf_counter()
+        profiler.enable()
+        try:
+            return await fn(update, context)
+        finally:
+            profiler.disable()
+            state.busy = False
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            if elapsed_ms >= state.threshold_ms:
+                try:
+                    path = _save(profiler, name, elapsed_ms)
+                    logger.warning("Slow update in %s: %.0f ms, profile saved to %s", name, elapsed_ms, path)
+                except OSError:
+                    logger.exception("Failed to save profile for %s", name)
+
+    return wrapper
+
+
+def status_text() -> str:
+    files = list_profiles()
+    return (
+        f"profiling: {'on' if state.enabled else 'off'}, threshold {state.threshold_ms:.0f} ms, "
+        f"saved {state.saved}, on disk {len(files)}/{state.keep}"
+        + (f", latest {files[-1].name}" if files else "")
+    )
@@ -0,0 +1,135 @@
+# gold_quality_telega.py
+"""
+Проверка качества загруженного ряда цен до того, как он заменит рабочий:
+монотонность дат, дубли, нули/отрицательные, выбросы относительно
+скользящей медианы и дыры в датах. Один проход по колонкам ряда.
+"""
+import logging
+from array import array
+from bisect import bisect_left, insort
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import date
+from typing import List, Tuple
+
+from gold_core_telega import PriceSeries, PriceSourceError
+
+logger = logging.getLogger(__name__)
+
+MEDIAN_WINDOW = 21          # ~месяц торговых дней
+MEDIAN_MIN_POINTS = 5       # до стольких точек выбросы не ищем
+MAX_RATIO_TO_MEDIAN = 2.0   # цена в 2+ раза выше/ниже медианы — выброс
+MAX_GAP_DAYS = 10           # длиннее — подозрительная дыра (выходные/праздники короче)
+MAX_BAD_SHARE = 0.05        # больше 5% выкинутых точек — ряд не принимаем
+
+
+class PriceValidationError(PriceSourceError):
+    pass
+
+
+@dataclass
+class ValidationReport:
+    total: int = 0
+    kept: int = 0
+    duplicates: int = 0
+    non_positive: int = 0
+    outliers: int = 0
+    out_of_order: int = 0
+    gaps: List[Tuple[date, date]] = field(default_factory=list)
+    resorted: bool = False
+
+    @property
+    def dropped(self) -> int:
+        return self.duplicates + self.non_positive + self.outliers
+
+    def is_clean(self) -> bool:
+        return not (self.dropped or self.out_of_order)
+
+    def summary(self) -> str:
+        return (
+            f"total={self.total} kept={self.kept} dup={self.duplicates} "
+            f"nonpos={self.non_positive} outliers={self.outliers} "
+            f"unordered={self.out_of_order} gaps={len(self.gaps)}"
+        )
+
+
+def _scan(ordinals, closes, report: ValidationReport, window: int, max_ratio: float, max_gap_days: int):
+    """Один проход: возвращает очищенные колонки и заполняет отчёт."""
+    out_ord = array("l")
+    out_close = array("d")
+    recent = deque()
+    recent_sorted: List[float] = []
+    prev = None
+    for o, c in zip(ordinals, closes):
+        if prev is not None:
+            if o == prev:
+                report.duplicates += 1
+                continue
+            if o < prev:
+                report.out_of_order += 1
+                continue
+        if not c > 0:  # ловит и NaN
+            report.non_positive += 1
+            continue
+        n = len(recent_sorted)
+        if n >= MEDIAN_MIN_POINTS:
+            med = recent_sorted[n // 2]
+            if c > med * max_ratio or c * max_ratio < med:
+                report.outliers += 1
+                continue
+        if prev is not None and o - prev > max_gap_days:
+            report.gaps.append((date.fromordinal(prev), date.fromordinal(o)))
+
+        out_ord.append(o)
+        out_close.append(c)
+        prev = o
+        recent.append(c)
+        insort(recent_sorted, c)
+        if len(recent) > window:
+            old = recent.popleft()
+            del recent_sorted[bisect_left(recent_sorted, old)]
+    return out_ord, out_close
+
+
+def validate_series(
+    series: PriceSeries,
+    repair: bool = True,
+    window: int = MEDIAN_WINDOW,
+    max_ratio: float = MAX_RATIO_TO_MEDIAN,
+    max_gap_days: int = MAX_GAP_DAYS,
+    max_bad_share: float = MAX_BAD_SHARE,
+) -> Tuple[PriceSeries, ValidationReport]:
+    """
+    repair=True: плохие точки выкидываются, неотсортированный ряд сортируется;
+    ряд отклоняется только если выкинуть пришлось слишком много.
+    repair=False: любая проблема (кроме дыр) — PriceValidationError.
+    Дыры в датах только попадают в отчёт.
+    """
+    report = ValidationReport(total=len(series))
+    ordinals, closes = _scan(series.ordinals, series.closes, report, window, max_ratio, max_gap_days)
+
+    if report.out_of_order and repair:
+        pairs = sorted(zip(series.ordinals, series.closes), key=lambda p: p[0])
+        report = ValidationReport(total=len(series), resorted=True)
+        ordinals, closes = _scan(
+            [p[0] for p in pairs], [p[1] for p in pairs], report, window, max_ratio, max_gap_days
+        )
+
+    report.kept = len(ordinals)
+    if not repair and not report.is_clean():
+        raise PriceValidationError(f"Price series rejected: {report.summary()}")
+    if not report.kept:
+        raise PriceValidationError("Price series rejected: no valid points.")
+    if report.total and report.dropped / report.total > max_bad_share:
+        raise PriceValidationError(f"Price series rejected, too many bad points: {report.summary()}")
+    return PriceSeries(ordinals=ordinals, closes=closes), report
+
+
+def checked(series: PriceSeries, name: str) -> PriceSeries:
+    """Проверка с починкой и записью в лог; используется перед подменой ряда."""
+    clean, report = validate_series(series)
+    if not report.is_clean():
+        logger.warning("Price series %s repaired: %s", name, report.summary())
+    elif report.gaps:
+        logger.info("Price series %s has date gaps: %s", name, report.summary())
+    return clean
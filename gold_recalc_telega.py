@@ -0,0 +1,270 @@
+# gold_recalc_telega.py
+"""
+Пересчёт сохранённых планов после обновления цен.
+
+Строки плана хранят цены на момент register_child: план «до сегодня» сам
+новых месяцев не получает, а план до 18 лет застывает на дате последней
+загрузки цен. Задача проходит по всем пользователям и пересобирает строки
+по свежей книге цен:
+
+* сетка месяцев (MonthlyGrid) строится один раз на инструмент и валюту,
+  строки плана по ней — бисекция, а не проход по дневному ряду;
+* пользователи идут по возрастанию id пачками по RECALC_CHUNK: в памяти
+  только массив id и планы одной пачки;
+* пачка пишется одной транзакцией PlanStore.update_many; перезаписываются
+  только пользователи, у которых строки разошлись, версия плана растёт;
+* после каждой пачки — чекпоинт DATA_DIR/recalc.json: штамп цен (последняя
+  дата ряда каждого инструмента) и последний обработанный id. Прерванный
+  прогон с тем же штампом продолжается с этого id, завершённый не
+  повторяется, пока не придут новые цены.
+
+В боте работает у лидера после каждого обновления книги цен (GOLD_RECALC=0 — выключить).
+Вручную:
+    python gold_recalc_telega.py run [--data-dir DIR] [--chunk 200] [--restart]
+"""
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from dataclasses import asdict, dataclass
+from datetime import date
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import gold_core_telega
+from gold_core_telega import ChildPlan, MonthlyGrid, PriceSourceError, plan_target_date
+from gold_admin_telega import iter_user_ids
+from gold_market_telega import PriceBook, add_refresh_listener, get_price_book, loaded_instruments
+from gold_metrics_telega import counter
+from gold_scheduler_telega import write_json_atomic
+from gold_shared_telega import get_plan_store
+
+logger = logging.getLogger(__name__)
+
+RECALC = os.getenv("GOLD_RECALC", "1") == "1"
+RECALC_CHUNK = int(os.getenv("RECALC_CHUNK", "200"))
+
+RECALC_PLANS = counter("gold_recalc_plans_total", "Plans checked by the recalculation job", ["result"])
+
+
+@dataclass
+class RecalcReport:
+    users: int = 0
+    plans: int = 0
+    updated: int = 0
+    skipped: int = 0         # нет цен инструмента/валюты или история короче плана
+    users_written: int = 0
+    resumed_after: Optional[int] = None
+    up_to_date: bool = False
+    seconds: float = 0.0
+
+
+def checkpoint_path() -> Path:
+    return gold_core_telega.ensure_data_dir() / "recalc.json"
+
+
+def _load_checkpoint() -> dict:
+    try:
+        return json.loads(checkpoint_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def price_stamp(books: Dict[str, PriceBook]) -> Dict[str, str]:
+    """Инструмент -> последняя дата цен; новые данные — новый штамп."""
+    stamp = {}
+    for code, book in books.items():
+        series = book.base or book.series(book.currencies()[0])
+        if len(series):
+            stamp[code] = date.fromordinal(series.ordinals[-1]).isoformat()
+    return stamp
+
+
+class GridSet:
+    """Сетки месяцев одного прогона, по (инструмент, валюта)."""
+
+    def __init__(self, books: Dict[str, PriceBook]):
+        self.books = books
+        self._grids: Dict[Tuple[str, str], Optional[MonthlyGrid]] = {}
+
+    def get(self, instrument: str, currency: str) -> Optional[MonthlyGrid]:
+        key = (instrument, currency)
+        if key not in self._grids:
+            book = self.books.get(instrument)
+            grid = None
+            if book is not None:
+                try:
+                    series = book.series(currency)
+                except PriceSourceError:
+                    series = None
+                if series is not None and len(series):
+                    grid = MonthlyGrid(series)
+            self._grids[key] = grid
+        return self._grids[key]
+
+
+def refresh_plan(plan: ChildPlan, grid: MonthlyGrid, today: date) -> Optional[bool]:
+    """
+    Пересобрать строки плана по сетке. True — строки изменились, False — нет,
+    None — история цен начинается позже плана (старые месяцы не теряем).
+    """
+    target = plan_target_date(plan.birth_date, plan.target_age_years, today)
+    rows = grid.plan_rows(plan.birth_date, target, plan.monthly_budget_eur)
+    old = plan.plan_rows
+    if old and (not rows or rows[0].date > old[0].date):
+        return None
+    if rows == old:
+        return False
+    plan.plan_rows = rows
+    plan.version += 1
+    return True
+
+
+def run_recalc(
+    chunk: int = RECALC_CHUNK,
+    today: Optional[date] = None,
+    restart: bool = False,
+    stop: Optional[threading.Event] = None,
+) -> RecalcReport:
+    """Один прогон по всем пользователям DATA_DIR с текущими книгами цен."""
+    t0 = time.perf_counter()
+    today = today or date.today()
+    report = RecalcReport()
+    books: Dict[str, PriceBook] = {}
+    for code in loaded_instruments():
+        book = get_price_book(code)
+        if book is not None:
+            books[code] = book
+    if not books:
+        report.up_to_date = True
+        return report
+
+    stamp = price_stamp(books)
+    cp = _load_checkpoint()
+    after: Optional[int] = None
+    if not restart and cp.get("stamp") == stamp:
+        if cp.get("done"):
+            report.up_to_date = True
+            return report
+        after = cp.get("after_user")
+        report.resumed_after = after
+
+    # только id, по возрастанию: порядок не зависит от каталога, чекпоинт — одно число
+    ids = array("q", sorted(iter_user_ids(gold_core_telega.DATA_DIR)))
+    start = bisect_right(ids, after) if after is not None else 0
+    grids = GridSet(books)
+    store = get_plan_store()
+
+    def update(user_id: int, plans: Dict[str, ChildPlan]) -> bool:
+        changed = False
+        report.users += 1
+        for plan in plans.values():
+            report.plans += 1
+            grid = grids.get(plan.instrument, plan.currency)
+            result = refresh_plan(plan, grid, today) if grid is not None else None
+            if result is None:
+                report.skipped += 1
+                RECALC_PLANS.inc(result="skipped")
+            elif result:
+                report.updated += 1
+                changed = True
+                RECALC_PLANS.inc(result="updated")
+            else:
+                RECALC_PLANS.inc(result="unchanged")
+        return changed
+
+    done = True
+    for lo in range(start, len(ids), max(1, chunk)):
+        if stop is not None and stop.is_set():
+            done = False
+            break
+        batch = ids[lo:lo + chunk]
+        report.users_written += store.update_many(batch, update)
+        write_json_atomic(checkpoint_path(), {"stamp": stamp, "after_user": batch[-1], "done": False})
+    if done:
+        write_json_atomic(checkpoint_path(), {"stamp": stamp, "after_user": None, "done": True})
+
+    report.seconds = time.perf_counter() - t0
+    logger.info(
+        "Plan recalculation %s: %d users, %d plans, %d updated, %d skipped in %.2fs",
+        "finished" if done else "interrupted",
+        report.users, report.plans, report.updated, report.skipped, report.seconds,
+    )
+    return report
+
+
+# ========= ФОНОВЫЙ ЗАПУСК =========
+
+class RecalcJob:
+    """
+    Один поток на процесс: обновление цен только будит его. Несколько
+    обновлений подряд (разные инструменты) сливаются в один следующий прогон.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def on_refresh(self, book: PriceBook) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        add_refresh_listener(self.on_refresh)
+        self._thread = threading.Thread(target=self._loop, name="plan-recalc", daemon=True)
+        self._thread.start()
+        # при старте — догнать прогон, прерванный остановкой процесса
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while True:
+            self._wake.wait()
+            if self._stop.is_set():
+                return
+            self._wake.clear()
+            try:
+                run_recalc(stop=self._stop)
+            except Exception:
+                logger.exception("Plan recalculation failed")
+
+
+_job: Optional[RecalcJob] = None
+
+
+def start_recalc() -> RecalcJob:
+    global _job
+    if _job is None:
+        _job = RecalcJob()
+        _job.start()
+    return _job
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from gold_market_telega import DEFAULT_INSTRUMENT, ensure_price_book
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Recalculate stored plans with current prices")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("run")
+    rp.add_argument("--data-dir", type=Path, default=None)
+    rp.add_argument("--chunk", type=int, default=RECALC_CHUNK)
+    rp.add_argument("--instruments", default=DEFAULT_INSTRUMENT, help="через запятую, например XAU,XAG")
+    rp.add_argument("--restart", action="store_true", help="игнорировать чекпоинт")
+    args = parser.parse_args()
+
+    if args.data_dir is not None:
+        gold_core_telega.DATA_DIR = args.data_dir
+    for code in args.instruments.split(","):
+        ensure_price_book(code.strip())
+    print(asdict(run_recalc(chunk=args.chunk, restart=args.restart)))
@@ -0,0 +1,61 @@
+# gold_run_telega.py
+"""
+Точка входа с быстрым стартом: сначала конфигурация (TELEGRAM_TOKEN),
+и только потом тяжёлые импорты (telegram, httpx). Без токена процесс
+падает за миллисекунды, не загрузив стек бота. В лог пишется разбивка
+времени старта по фазам.
+
+    python gold_run_telega.py
+"""
+import time
+
+_T0 = time.perf_counter()
+
+import logging
+import os
+import sys
+from typing import List, Tuple
+
+_phases: List[Tuple[str, float]] = []
+_last = _T0
+
+
+def _phase(name: str) -> None:
+    global _last
+    now = time.perf_counter()
+    _phases.append((name, now - _last))
+    _last = now
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    token = os.getenv("TELEGRAM_TOKEN")
+    _phase("config")
+    if not token:
+        print("TELEGRAM_TOKEN is not set (env or .env).", file=sys.stderr)
+        raise SystemExit(2)
+
+    import gold_core_telega  # noqa: F401  расчёты и планы, без сети
+    _phase("import core")
+
+    import gold_telega  # стек python-telegram-bot
+    _phase("import telegram")
+
+    if gold_telega.METRICS_PORT:
+        gold_telega.start_metrics_server(int(gold_telega.METRICS_PORT))
+    application = gold_telega.build_application(token)
+    _phase("build application")
+
+    total = time.perf_counter() - _T0
+    logging.getLogger("gold_run_telega").info(
+        "Startup %.0f ms: %s",
+        total * 1000,
+        ", ".join(f"{name} {sec * 1000:.0f} ms" for name, sec in _phases),
+    )
+    gold_telega.run_application(application)
+
+
+if __name__ == "__main__":
+    main()
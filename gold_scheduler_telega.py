@@ -0,0 +1,466 @@
+# gold_scheduler_telega.py
+"""
+Ежемесячные напоминания: каждому пользователю одно сообщение-сводка
+с целью покупки на месяц по каждому ребёнку и текущей ценой за грамм.
+
+* Срок — первый рабочий день из DAY_PRIORITY (20→19→...→16), то есть та
+  же дата, которую выбирает pick_monthly_dates; после него напоминание
+  уходит при ближайшей проверке (раз в REMINDER_CHECK_SEC).
+* Отправка пачками через TokenBucket: ровный поток не выше REMINDER_RATE
+  сообщений в секунду, без всплесков; между пачками цикл свободен для
+  интерактивных обновлений. RetryAfter от Telegram останавливает весь
+  поток на указанное время.
+* Состояние в DATA_DIR/reminders: sent.json + sent.log (кому уже ушло в
+  этом месяце, пишет только планировщик) и user_<id>.json (язык и отписка
+  /reminders off).
+  Отмечается только доставленное и пропущенное намеренно (отписка, нет
+  активных планов); неудачная отправка или недоступные цены — повтор при
+  следующей проверке.
+
+Включается GOLD_REMINDERS=1. Проверка на фейковом Bot API:
+    python gold_scheduler_telega.py simulate --users 5000 --rate 30
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+import gold_core_telega
+from gold_core_telega import DAY_PRIORITY, ChildPlan, PriceSourceError, load_all_plans
+import gold_i18n_telega as i18n
+from gold_market_telega import ensure_price_book, get_price_book
+from gold_metrics_telega import counter
+
+logger = logging.getLogger(__name__)
+
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "20"))  # сообщений/с, лимит Telegram ~30
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", "100"))
+REMINDER_CHECK_SEC = int(os.getenv("REMINDER_CHECK_SEC", "1800"))
+
+REMINDERS_SENT = counter("gold_reminders_total", "Reminder sends", ["result"])
+
+
+# ========= TOKEN BUCKET =========
+
+class TokenBucket:
+    """
+    rate токенов в секунду, не больше capacity про запас. capacity задаёт
+    допустимый всплеск: при capacity=1 отправки идут строго равномерно.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= n:
+                self.tokens -= n
+                return True
+            return False
+
+    def refund(self, n: float = 1.0) -> None:
+        """Вернуть токены, взятые try_acquire, если действие не состоялось."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + n)
+
+    def delay(self, n: float = 1.0) -> float:
+        """Через сколько секунд наберётся n токенов."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (n - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Уйти в минус: следующий токен появится не раньше чем через seconds."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    async def acquire(self, n: float = 1.0) -> None:
+        while not self.try_acquire(n):
+            await asyncio.sleep(self.delay(n))
+
+
+# ========= ОТПРАВКА ПАЧКАМИ =========
+
+@dataclass
+class SendReport:
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    blocked: List[int] = field(default_factory=list)
+    delivered: List[int] = field(default_factory=list)
+    seconds: float = 0.0
+
+    def merge(self, other: "SendReport") -> None:
+        self.sent += other.sent
+        self.failed += other.failed
+        self.retried += other.retried
+        self.blocked.extend(other.blocked)
+        self.delivered.extend(other.delivered)
+        self.seconds += other.seconds
+
+
+class BatchSender:
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, bot, rate: float = REMINDER_RATE, concurrency: int = 8):
+        self.bot = bot
+        self.bucket = TokenBucket(rate, capacity=1.0)
+        self.concurrency = concurrency
+
+    async def send_batch(self, messages: Iterable[Tuple[int, str]]) -> SendReport:
+        report = SendReport()
+        t0 = time.perf_counter()
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def one(chat_id: int, text: str) -> None:
+            async with sem:
+                await self._send_one(chat_id, text, report)
+
+        await asyncio.gather(*(one(chat_id, text) for chat_id, text in messages))
+        report.seconds = time.perf_counter() - t0
+        return report
+
+    async def _send_one(self, chat_id: int, text: str, report: SendReport) -> None:
+        for _ in range(self.MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                logger.warning("Flood control, pausing reminders for %.0fs", retry_after)
+                self.bucket.pause(retry_after)
+                report.retried += 1
+                continue
+            except Forbidden:
+                # пользователь заблокировал бота
+                report.blocked.append(chat_id)
+                REMINDERS_SENT.inc(result="blocked")
+                return
+            except TelegramError as e:
+                logger.warning("Reminder to %s failed: %s", chat_id, e)
+                report.failed += 1
+                REMINDERS_SENT.inc(result="failed")
+                return
+            report.sent += 1
+            report.delivered.append(chat_id)
+            REMINDERS_SENT.inc(result="sent")
+            return
+        report.failed += 1
+        REMINDERS_SENT.inc(result="failed")
+
+
+# ========= СОСТОЯНИЕ =========
+
+def reminders_dir() -> Path:
+    d = gold_core_telega.ensure_data_dir() / "reminders"
+    d.mkdir(exist_ok=True)
+    return d
+
+
+def write_json_atomic(path: Path, obj) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class UserPrefs:
+    """Язык и отписка; файл на пользователя, пишется только при изменении."""
+
+    def __init__(self):
+        self._cache: Dict[int, dict] = {}
+
+    def read(self, user_id: int) -> dict:
+        """С диска: отписку мог записать другой воркер."""
+        path = reminders_dir() / f"user_{user_id}.json"
+        try:
+            prefs = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            prefs = {}
+        return prefs
+
+    def get(self, user_id: int) -> dict:
+        prefs = self._cache.get(user_id)
+        if prefs is None:
+            prefs = self._cache[user_id] = self.read(user_id)
+        return prefs
+
+    def set(self, user_id: int, **values) -> None:
+        prefs = self.get(user_id)
+        if all(prefs.get(k) == v for k, v in values.items()):
+            return
+        prefs = {**prefs, **values}
+        self._cache[user_id] = prefs
+        write_json_atomic(reminders_dir() / f"user_{user_id}.json", prefs)
+
+
+_prefs = UserPrefs()
+
+
+def get_user_prefs() -> UserPrefs:
+    return _prefs
+
+
+class SentLog:
+    """
+    Месяц последнего напоминания по пользователю: снимок sent.json и журнал
+    sent.log (строка JSON {id: месяц} на пачку). Пачка дописывает в журнал
+    только себя, снимок переписывается один раз за проход (compact).
+    Журнал прерванного прохода дочитывается и сворачивается при загрузке.
+    """
+
+    def __init__(self):
+        self.path = reminders_dir() / "sent.json"
+        self.log_path = reminders_dir() / "sent.log"
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            raw = {}
+        self.months: Dict[int, str] = {int(k): v for k, v in raw.items()}
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                self.months.update({int(k): v for k, v in json.loads(line).items()})
+            except ValueError:
+                # строка, недописанная при падении: эти пользователи получат напоминание ещё раз
+                continue
+        self.compact()
+
+    def mark(self, user_ids: List[int], month: str) -> None:
+        if not user_ids:
+            return
+        delta = {uid: month for uid in user_ids}
+        self.months.update(delta)
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({str(k): v for k, v in delta.items()}) + "\n")
+
+    def compact(self) -> None:
+        write_json_atomic(self.path, {str(k): v for k, v in self.months.items()})
+        self.log_path.unlink(missing_ok=True)
+
+
+# ========= СООБЩЕНИЯ =========
+
+def reminder_due_date(year: int, month: int, day_priority: List[int] = DAY_PRIORITY) -> date:
+    """Первый рабочий день из приоритетных — в него по плану и идёт покупка."""
+    for day in day_priority:
+        d = date(year, month, day)
+        if d.weekday() < 5:
+            return d
+    return date(year, month, day_priority[-1])
+
+
+def plan_is_active(plan: ChildPlan, today: date) -> bool:
+    if plan.target_age_years is None:
+        return True
+    b = plan.birth_date
+    return date(b.year + plan.target_age_years, b.month, b.day) >= today
+
+
+def build_reminder(plans: Dict[str, ChildPlan], lang: str, month: str) -> Optional[str]:
+    lines = []
+    today = date.today()
+    for plan in plans.values():
+        if not plan_is_active(plan, today):
+            continue
+        book = get_price_book(plan.instrument)
+        price = book.gram_price(plan.currency) if book is not None else None
+        if price is None:
+            continue
+        lines.append(
+            i18n.t(
+                lang, "reminder.line", name=plan.name, instrument=plan.instrument,
+                grams=plan.monthly_budget_eur / price, budget=plan.monthly_budget_eur,
+                cur=plan.currency, price=price,
+            )
+        )
+    if not lines:
+        return None
+    return "\n".join([i18n.t(lang, "reminder.title", month=month)] + lines + [i18n.t(lang, "reminder.footer")])
+
+
+# ========= ПЛАНИРОВЩИК =========
+
+class ReminderScheduler:
+    def __init__(self, bot, sender: Optional[BatchSender] = None, batch_size: int = REMINDER_BATCH):
+        self.bot = bot
+        self.sender = sender or BatchSender(bot)
+        self.batch_size = batch_size
+        self._running = False
+
+    def _user_ids(self) -> List[int]:
+        from gold_admin_telega import iter_plan_files
+
+        ids = []
+        for path in iter_plan_files(gold_core_telega.DATA_DIR):
+            try:
+                ids.append(int(path.stem.rsplit("_", 1)[1]))
+            except ValueError:
+                continue
+        return ids
+
+    @staticmethod
+    def _book_ready(instrument: str, ready: Dict[str, bool]) -> bool:
+        """Книга цен инструмента загружена (один раз за проход); ready — кэш прохода."""
+        if instrument not in ready:
+            try:
+                ensure_price_book(instrument)
+                ready[instrument] = True
+            except PriceSourceError as e:
+                logger.warning("No prices for %s, reminders postponed: %s", instrument, e)
+                ready[instrument] = False
+        return ready[instrument]
+
+    def _build_batch(
+        self, user_ids: List[int], month: str, ready: Dict[str, bool]
+    ) -> Tuple[List[Tuple[int, str]], List[int]]:
+        """Сообщения пачки и пользователи, которых пропускаем намеренно."""
+        prefs = get_user_prefs()
+        today = date.today()
+        out, skipped = [], []
+        for uid in user_ids:
+            p = prefs.read(uid)
+            if p.get("off"):
+                skipped.append(uid)
+                continue
+            plans = load_all_plans(uid)
+            active = [plan for plan in plans.values() if plan_is_active(plan, today)]
+            if not active:
+                skipped.append(uid)
+                continue
+            # без цен по какому-то плану не шлём неполную сводку — повторим позже
+            if not all(self._book_ready(plan.instrument, ready) for plan in active):
+                continue
+            text = build_reminder(plans, p.get("lang", i18n.DEFAULT_LANG), month)
+            if text is not None:
+                out.append((uid, text))
+        return out, skipped
+
+    @staticmethod
+    def _checkpoint(sent: SentLog, month: str, report: SendReport, skipped: List[int]) -> None:
+        """После пачки: отписать заблокировавших бота и отметить в журнале, кому больше не слать."""
+        prefs = get_user_prefs()
+        for uid in report.blocked:
+            prefs.set(uid, off=True)
+        sent.mark(report.delivered + report.blocked + skipped, month)
+
+    async def run_once(self, today: Optional[date] = None) -> SendReport:
+        today = today or date.today()
+        total = SendReport()
+        if today < reminder_due_date(today.year, today.month) or self._running:
+            return total
+        self._running = True
+        try:
+            month = f"{today.year:04d}-{today.month:02d}"
+            sent = await asyncio.to_thread(SentLog)
+            pending = [uid for uid in await asyncio.to_thread(self._user_ids) if sent.months.get(uid) != month]
+            ready: Dict[str, bool] = {}
+            for i in range(0, len(pending), self.batch_size):
+                # чтение планов, загрузка цен и сборка текстов — в потоке, цикл событий свободен
+                batch, skipped = await asyncio.to_thread(
+                    self._build_batch, pending[i: i + self.batch_size], month, ready
+                )
+                report = await self.sender.send_batch(batch)
+                await asyncio.to_thread(self._checkpoint, sent, month, report, skipped)
+                total.merge(report)
+            if pending:
+                await asyncio.to_thread(sent.compact)
+                logger.info(
+                    "Reminders for %s: %d sent, %d failed, %d blocked", month, total.sent, total.failed,
+                    len(total.blocked),
+                )
+            return total
+        finally:
+            self._running = False
+
+    async def loop(self, interval: float = REMINDER_CHECK_SEC) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Reminder run failed")
+            await asyncio.sleep(interval)
+
+
+# ========= SIMULATE =========
+
+def _simulate(users: int, rate: float, latency_ms: float) -> None:
+    import tempfile
+
+    from gold_loadtest_telega import FAKE_TOKEN, FakeBot, prepare_environment
+    from gold_core_telega import register_child, save_all_plans
+    from gold_market_telega import get_price_book as book_of
+
+    class TimedBot(FakeBot):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            with self._unfrozen():
+                self.sent_at: List[float] = []
+
+        async def _do_post(self, endpoint, data, *args, **kwargs):
+            if endpoint == "sendMessage":
+                await asyncio.sleep(latency_ms / 1000)
+                self.sent_at.append(time.monotonic())
+            return await super()._do_post(endpoint, data, *args, **kwargs)
+
+    async def run() -> None:
+        bot = TimedBot(FAKE_TOKEN)
+        await bot.initialize()
+        scheduler = ReminderScheduler(bot, BatchSender(bot, rate=rate))
+        due = reminder_due_date(date.today().year, date.today().month)
+        report = await scheduler.run_once(today=max(date.today(), due))
+        again = await scheduler.run_once(today=max(date.today(), due))
+        await bot.shutdown()
+
+        per_second: Dict[int, int] = {}
+        t_first = bot.sent_at[0] if bot.sent_at else 0.0
+        for t in bot.sent_at:
+            per_second[int(t - t_first)] = per_second.get(int(t - t_first), 0) + 1
+        print(f"users={users} sent={report.sent} failed={report.failed} in {report.seconds:.1f}s "
+              f"({report.sent / max(report.seconds, 1e-9):.1f} msg/s, limit {rate:.0f})")
+        print(f"max messages in one second: {max(per_second.values(), default=0)}; second run sent {again.sent}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_environment(Path(tmp), years=10)
+        points = book_of("XAU").points("EUR")
+        plan = register_child("1", "Kid", date(2016, 5, 20), 18, 100.0, points)
+        for uid in range(users):
+            save_all_plans({"1": plan}, 200000 + uid)
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Monthly reminders")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sim = sub.add_parser("simulate", help="разослать напоминания фейковому Bot API")
+    sim.add_argument("--users", type=int, default=2000)
+    sim.add_argument("--rate", type=float, default=REMINDER_RATE)
+    sim.add_argument("--latency-ms", type=float, default=30.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    _simulate(args.users, args.rate, args.latency_ms)
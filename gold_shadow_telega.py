@@ -0,0 +1,307 @@
+# gold_shadow_telega.py
+"""
+Теневой прогон: запись реального трафика и его воспроизведение на двух сборках.
+
+* Запись (SHADOW_LOG=<каталог>): обработчик в группе -1 пишет каждое
+  обновление — время, обезличенный id, состояние диалога до обработки и
+  текст (нажатие кнопки — "@callback_data", как в сценариях нагрузочного
+  прогона). id пользователя заменяется HMAC с солью из <каталог>/salt,
+  одинаковой для всех воркеров; имя ребёнка и день рождения вычищаются.
+  Свободный текст в состояниях anon_states (ID ребёнка) и данные кнопок
+  с префиксами anon_callbacks ("open:<ID>") тоже заменяются HMAC — одно
+  и то же значение даёт одну и ту же замену, и воспроизведение сходится.
+  Формат — gzip, JSON-строка на обновление: [мс от t0, id, состояние, текст];
+  первая строка файла — {"v": 1, "t0": мс эпохи}. Файл на процесс.
+* Воспроизведение: ConversationHandler на FakeBot (gold_loadtest_telega)
+  во временном DATA_DIR с синтетическими ценами, без пауз, пользователи
+  параллельно, каждый — в записанном порядке. Результат — ответы бота по
+  пользователям, пропускная способность и расхождения состояний с записью.
+* Сравнение: каждая сборка воспроизводит лог в своём процессе (cwd — каталог
+  сборки, её модули первыми в sys.path), ответы сравниваются построчно.
+
+    python gold_shadow_telega.py replay LOG... [--concurrency 50] [--out replies.json]
+    python gold_shadow_telega.py diff LOG... --a ../build_a --b . [--show 5]
+"""
+import asyncio
+import atexit
+import difflib
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes, ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+FLUSH_EVERY = 100
+
+# (мс от начала, обезличенный id, состояние до обработки, текст)
+Record = Tuple[int, int, Optional[int], str]
+
+
+# ========= ЗАПИСЬ =========
+
+def scrub_name(text: str) -> str:
+    return "Child"
+
+
+def scrub_birth(text: str) -> str:
+    """Год и месяц оставляем — от них зависит план; день и неразборчивый ввод — нет."""
+    try:
+        d = datetime.strptime(text.strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return "bad-date"
+    return date(d.year, d.month, 1).isoformat()
+
+
+def _load_salt(log_dir: Path) -> bytes:
+    path = log_dir / "salt"
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return path.read_bytes()
+    salt = secrets.token_bytes(16)
+    with os.fdopen(fd, "wb") as f:
+        f.write(salt)
+    return salt
+
+
+class Recorder:
+    """Пишет обновления в log_dir/shadow_<pid>_<время>.jsonl.gz."""
+
+    def __init__(
+        self,
+        log_dir: Path,
+        conversation: ConversationHandler,
+        scrub: Optional[Dict[int, Callable[[str], str]]] = None,
+        anon_states: Iterable[int] = (),
+        anon_callbacks: Iterable[str] = (),
+    ):
+        log_dir = Path(log_dir)
+        log_dir.mkdir(parents=True, exist_ok=True)
+        self.conversation = conversation
+        self.scrub = dict(scrub or {})
+        for state in anon_states:
+            self.scrub[state] = self.anon_text
+        self.anon_callbacks = frozenset(anon_callbacks)
+        self._salt = _load_salt(log_dir)
+        self.path = log_dir / f"shadow_{os.getpid()}_{int(time.time())}.jsonl.gz"
+        self._t0 = int(time.time() * 1000)
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        self._file.write(json.dumps({"v": 1, "t0": self._t0}) + "\n")
+        self._pending = 0
+        self._lock = threading.Lock()
+        # без close у gzip нет хвоста; load_records такой файл тоже читает
+        atexit.register(self.close)
+        logger.info("Recording updates to %s", self.path)
+
+    def anon_id(self, user_id: int) -> int:
+        digest = hmac.new(self._salt, str(user_id).encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:6], "big")  # 48 бит: в пределах id Telegram
+
+    def anon_text(self, text: str) -> str:
+        digest = hmac.new(self._salt, b"text:" + text.strip().encode(), hashlib.sha256).hexdigest()
+        return "id" + digest[:10]
+
+    def _scrub_callback(self, data: str) -> str:
+        prefix, sep, payload = data.partition(":")
+        if sep and prefix in self.anon_callbacks:
+            return f"{prefix}:{self.anon_text(payload)}"
+        return data
+
+    def _state(self, user_id: int, chat_id: int) -> Optional[int]:
+        # ключ диалога по умолчанию (per_chat, per_user) — (chat_id, user_id); публичного API чтения нет
+        state = self.conversation._conversations.get((chat_id, user_id))
+        return state if isinstance(state, int) else None
+
+    async def record(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user, chat = update.effective_user, update.effective_chat
+        if user is None or chat is None:
+            return
+        state = self._state(user.id, chat.id)
+        if update.callback_query is not None:
+            text = "@" + self._scrub_callback(update.callback_query.data or "")
+        elif update.message is not None and update.message.text is not None:
+            text = update.message.text
+            scrub = self.scrub.get(state)
+            if scrub is not None and not text.startswith("/"):
+                text = scrub(text)
+        else:
+            return
+        line = json.dumps(
+            [int(time.time() * 1000) - self._t0, self.anon_id(user.id), state, text],
+            ensure_ascii=False, separators=(",", ":"),
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+            self._pending += 1
+            if self._pending >= FLUSH_EVERY:
+                self._file.flush()
+                self._pending = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+# ========= ВОСПРОИЗВЕДЕНИЕ =========
+
+def load_records(paths: Iterable[Path]) -> List[Record]:
+    """Записи всех файлов (или каталогов с ними) по времени."""
+    files: List[Path] = []
+    for p in map(Path, paths):
+        files.extend(sorted(p.glob("shadow_*.jsonl.gz")) if p.is_dir() else [p])
+    records: List[Record] = []
+    for path in files:
+        # обрезанный хвост (процесс убит без close) — читаем, сколько успели записать
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            t0 = 0
+            try:
+                for line in f:
+                    obj = json.loads(line)
+                    if isinstance(obj, dict):
+                        t0 = obj["t0"]
+                        continue
+                    dt, uid, state, text = obj
+                    records.append((t0 + dt, uid, state, text))
+            except (EOFError, ValueError) as e:
+                logger.warning("%s: truncated log (%s)", path, e)
+    records.sort(key=lambda r: r[0])
+    return records
+
+
+async def replay_records(records: List[Record], concurrency: int = 50) -> dict:
+    from gold_loadtest_telega import UpdateFactory, build_app
+
+    app, bot = await build_app()
+    conversation = next(h for h in app.handlers[0] if isinstance(h, ConversationHandler))
+    factory = UpdateFactory(bot)
+    by_user: Dict[int, List[Record]] = {}
+    for r in records:
+        by_user.setdefault(r[1], []).append(r)
+    mismatches = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(uid: int, items: List[Record]) -> None:
+        nonlocal mismatches
+        async with sem:
+            for _, _, state, text in items:
+                if conversation._conversations.get((uid, uid)) != state:
+                    mismatches += 1
+                await app.process_update(factory.update(uid, text))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(uid, items) for uid, items in by_user.items()))
+    wall = time.perf_counter() - t0
+    await app.shutdown()
+
+    replies: Dict[str, List[str]] = {}
+    for chat_id, text in bot.sent:
+        replies.setdefault(str(chat_id), []).append(text)
+    return {
+        "updates": len(records),
+        "users": len(by_user),
+        "seconds": wall,
+        "updates_per_s": len(records) / wall if wall else 0.0,
+        "state_mismatches": mismatches,
+        "replies": replies,
+    }
+
+
+def replay(paths: List[Path], concurrency: int = 50, years: int = 30) -> dict:
+    import tempfile
+
+    # очередь пула не должна отказывать: отказ — это другой ответ, а не другая сборка
+    os.environ.setdefault("COMPUTE_MAX_PENDING", "1000000")
+    # без пауз между обновлениями пределы частоты сработали бы там, где в записи их не было
+    os.environ.setdefault("GOLD_RATE_LIMITS", "0")
+    from gold_loadtest_telega import prepare_environment
+
+    records = load_records(paths)
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_environment(Path(tmp), years)
+        return asyncio.run(replay_records(records, concurrency))
+
+
+# ========= СРАВНЕНИЕ СБОРОК =========
+
+def replay_in_build(build: Path, paths: List[Path], out: Path, concurrency: int) -> dict:
+    """Воспроизведение в отдельном процессе с модулями сборки build."""
+    import subprocess
+    import sys
+
+    env = dict(os.environ)
+    # cwd (сборка) идёт в sys.path первым; отсюда — только этот модуль, если в сборке его нет
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(Path(__file__).resolve().parent), env.get("PYTHONPATH")]))
+    cmd = [
+        sys.executable, "-m", "gold_shadow_telega", "replay",
+        *map(str, (Path(p).resolve() for p in paths)),
+        "--concurrency", str(concurrency), "--out", str(out.resolve()),
+    ]
+    subprocess.run(cmd, cwd=build, env=env, check=True, stdout=subprocess.DEVNULL)
+    return json.loads(out.read_text(encoding="utf-8"))
+
+
+def diff_results(a: dict, b: dict, show: int = 5) -> Tuple[int, List[str]]:
+    """Число пользователей с разными ответами и первые show различий."""
+    users = sorted(set(a["replies"]) | set(b["replies"]), key=int)
+    differing = 0
+    out: List[str] = []
+    for uid in users:
+        ra, rb = a["replies"].get(uid, []), b["replies"].get(uid, [])
+        if ra == rb:
+            continue
+        differing += 1
+        if len(out) < show:
+            out.append("\n".join(difflib.unified_diff(ra, rb, f"a/{uid}", f"b/{uid}", lineterm="", n=1)))
+    return differing, out
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Replay recorded sessions against the bot")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("replay")
+    rp.add_argument("logs", nargs="+", type=Path)
+    rp.add_argument("--concurrency", type=int, default=50)
+    rp.add_argument("--out", type=Path, default=None)
+    df = sub.add_parser("diff")
+    df.add_argument("logs", nargs="+", type=Path)
+    df.add_argument("--a", type=Path, required=True, help="каталог сборки A")
+    df.add_argument("--b", type=Path, default=Path("."), help="каталог сборки B")
+    df.add_argument("--concurrency", type=int, default=50)
+    df.add_argument("--show", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.cmd == "replay":
+        result = replay(args.logs, args.concurrency)
+        if args.out is not None:
+            args.out.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        print(f"{result['updates']} updates, {result['users']} users in {result['seconds']:.2f}s "
+              f"({result['updates_per_s']:.0f} upd/s), state mismatches: {result['state_mismatches']}")
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            ra = replay_in_build(args.a, args.logs, Path(tmp) / "a.json", args.concurrency)
+            rb = replay_in_build(args.b, args.logs, Path(tmp) / "b.json", args.concurrency)
+        for name, r in (("A", ra), ("B", rb)):
+            print(f"{name}: {r['updates']} updates in {r['seconds']:.2f}s ({r['updates_per_s']:.0f} upd/s), "
+                  f"state mismatches: {r['state_mismatches']}")
+        differing, diffs = diff_results(ra, rb, args.show)
+        print(f"users with different replies: {differing} of {len(set(ra['replies']) | set(rb['replies']))}")
+        for d in diffs:
+            print(d)
+        raise SystemExit(1 if differing else 0)
@@ -0,0 +1,417 @@
+# gold_shared_telega.py
+"""
+Режим нескольких воркеров на одной машине (GOLD_MULTI_WORKER=1).
+
+* Цены: один процесс-лидер (держит flock на DATA_DIR/shared/leader.lock)
+  качает ряды и публикует их в файл, остальные отображают этот файл
+  через mmap только на чтение и не ходят в сеть. Последователи раз в
+  LEADER_RETRY_SEC пробуют взять flock: лидер умер — его место занимает
+  первый успевший и запускает задачи лидера (on_leader).
+* Планы: PlanStore с блокировкой на уровне пользователя — байтовый
+  диапазон fcntl.lockf в общем lock-файле (смещение = user_id) плюс
+  threading.Lock внутри процесса. Запись файла атомарная (tmp + replace).
+
+Состояние ConversationHandler по-прежнему живёт в памяти процесса, поэтому
+обновления одного пользователя должны попадать в один и тот же воркер.
+
+Проверка на одной машине:
+    python gold_shared_telega.py selftest --workers 4
+"""
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import gold_core_telega
+from gold_core_telega import ChildPlan, PriceSeries, PriceSourceError, Purchase, load_all_plans, save_all_plans
+import gold_market_telega
+from gold_market_telega import INSTRUMENTS, PriceBook, load_price_book
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"GPC1"
+# magic, generation, written_at, n_series
+_HEADER = struct.Struct("<4sQdI")
+# currency, count, offset
+_ENTRY = struct.Struct("<8sQQ")
+
+LEADER_POLL_SEC = 60
+LEADER_RETRY_SEC = float(os.getenv("LEADER_RETRY_SEC", "10"))
+
+
+def shared_dir() -> Path:
+    d = gold_core_telega.DATA_DIR / "shared"
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+def prices_file(instrument: str) -> Path:
+    return shared_dir() / f"prices_{instrument}.bin"
+
+
+# ========= ОБЩИЙ ФАЙЛ ЦЕН =========
+
+def publish_book(book: PriceBook, generation: Optional[int] = None) -> Path:
+    """
+    Пишет все валюты книги в один файл: заголовок, оглавление, затем для
+    каждой валюты массив дат (int64) и массив цен (float64).
+    Читатели видят либо старый, либо новый файл целиком.
+    """
+    series = {}
+    for cur in book.currencies():
+        s = book.series(cur)
+        if len(s):
+            series[cur] = s
+    if generation is None:
+        generation = time.time_ns()
+
+    offset = _HEADER.size + _ENTRY.size * len(series)
+    entries = []
+    chunks = []
+    for cur, s in series.items():
+        n = len(s)
+        entries.append(_ENTRY.pack(cur.encode("ascii"), n, offset))
+        chunks.append(struct.pack(f"<{n}q", *s.ordinals))
+        chunks.append(struct.pack(f"<{n}d", *s.closes))
+        offset += 16 * n
+
+    path = prices_file(book.instrument)
+    tmp = path.with_suffix(f".tmp{os.getpid()}")
+    with tmp.open("wb") as f:
+        f.write(_HEADER.pack(MAGIC, generation, book.loaded_at, len(series)))
+        for e in entries:
+            f.write(e)
+        for c in chunks:
+            f.write(c)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+class MappedPrices:
+    """Отображение общего файла цен; ряды — memoryview поверх mmap, без копий."""
+
+    def __init__(self, path: Path):
+        with path.open("rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.inode = os.fstat(f.fileno()).st_ino
+        magic, self.generation, self.written_at, n = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise PriceSourceError(f"{path}: not a shared price file.")
+        view = memoryview(self._mm)
+        self.series: Dict[str, PriceSeries] = {}
+        for i in range(n):
+            cur, count, offset = _ENTRY.unpack_from(self._mm, _HEADER.size + i * _ENTRY.size)
+            ords = view[offset: offset + 8 * count].cast("q")
+            closes = view[offset + 8 * count: offset + 16 * count].cast("d")
+            self.series[cur.rstrip(b"\0").decode("ascii")] = PriceSeries(ordinals=ords, closes=closes)
+
+
+class SharedPriceReader:
+    """Держит текущее отображение по инструменту и перечитывает файл, только если он сменился."""
+
+    def __init__(self):
+        self._mapped: Dict[str, MappedPrices] = {}
+        self._lock = threading.Lock()
+
+    def book(self, instrument: str) -> Optional[PriceBook]:
+        path = prices_file(instrument)
+        try:
+            inode = path.stat().st_ino
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            mapped = self._mapped.get(instrument)
+            if mapped is None or mapped.inode != inode:
+                # старое отображение остаётся живым, пока на него ссылаются книги
+                mapped = self._mapped[instrument] = MappedPrices(path)
+        return PriceBook(
+            base=None, fx={}, direct=mapped.series, instrument=instrument, loaded_at=mapped.written_at,
+            version=mapped.generation,
+        )
+
+
+# ========= ЛИДЕР =========
+
+class LeaderLock:
+    """Неблокирующий flock: лидер держит его до выхода, остальные пробуют снова через try_acquire."""
+
+    def __init__(self, path: Path):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.is_leader = False
+        self.try_acquire()
+
+    def try_acquire(self) -> bool:
+        if not self.is_leader:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.is_leader = True
+            except BlockingIOError:
+                pass
+        return self.is_leader
+
+
+def _want_marker(instrument: str) -> Path:
+    return shared_dir() / f"want_{instrument}"
+
+
+class MultiWorkerPrices:
+    """Загрузчик книг для gold_market_telega.set_book_loader."""
+
+    def __init__(self):
+        self.leader = LeaderLock(shared_dir() / "leader.lock")
+        self.reader = SharedPriceReader()
+        self._on_leader: List[Callable[[], None]] = []
+        self._leader_lock = threading.Lock()
+        self._leading = False
+
+    def on_leader(self, fn: Callable[[], None]) -> None:
+        """fn вызывается один раз, когда процесс станет лидером (сразу, если уже)."""
+        with self._leader_lock:
+            if not self._leading:
+                self._on_leader.append(fn)
+                return
+        fn()
+
+    def become_leader(self) -> None:
+        """Запустить задачи лидера: поток обновления цен и всё, что ждёт в on_leader."""
+        with self._leader_lock:
+            if self._leading:
+                return
+            self._leading = True
+            waiting, self._on_leader = self._on_leader, []
+        threading.Thread(
+            target=self.refresher_loop, args=(_stop_refresher,), name="price-leader", daemon=True
+        ).start()
+        for fn in waiting:
+            try:
+                fn()
+            except Exception:
+                logger.exception("Leader task failed to start")
+
+    def follower_loop(self, stop: threading.Event) -> None:
+        """Поток последователя: ждёт, пока освободится flock лидера."""
+        while not stop.wait(LEADER_RETRY_SEC):
+            if self.leader.try_acquire():
+                logger.info("Pid %d took over as leader", os.getpid())
+                self.become_leader()
+                return
+
+    def load(self, instrument: str, currencies: Optional[List[str]] = None) -> PriceBook:
+        if self.leader.is_leader:
+            book = load_price_book(instrument, currencies)
+            publish_book(book)
+            return book
+
+        book = self.reader.book(instrument)
+        if book is not None:
+            return book
+        # инструмент ещё не публиковался: просим лидера и разово качаем сами
+        _want_marker(instrument).touch()
+        logger.info("No shared prices for %s yet, fetching directly", instrument)
+        return load_price_book(instrument, currencies)
+
+    def refresher_loop(self, stop: threading.Event) -> None:
+        """Поток лидера: обновляет по расписанию инструменты, которые кому-то нужны."""
+        while not stop.wait(LEADER_POLL_SEC):
+            for code in INSTRUMENTS:
+                wanted = _want_marker(code).exists() or prices_file(code).exists()
+                if not wanted and gold_market_telega.get_price_book(code) is None:
+                    continue
+                try:
+                    gold_market_telega.ensure_price_book(code)
+                    _want_marker(code).unlink(missing_ok=True)
+                except PriceSourceError as e:
+                    logger.warning("Leader refresh of %s failed: %s", code, e)
+
+
+_stop_refresher = threading.Event()
+
+
+def enable_multi_worker() -> MultiWorkerPrices:
+    prices = MultiWorkerPrices()
+    gold_market_telega.set_book_loader(prices.load)
+    if prices.leader.is_leader:
+        prices.become_leader()
+    else:
+        threading.Thread(
+            target=prices.follower_loop, args=(_stop_refresher,), name="price-follower", daemon=True
+        ).start()
+    logger.info("Multi-worker mode, pid %d is %s", os.getpid(), "leader" if prices.leader.is_leader else "follower")
+    return prices
+
+
+# ========= ХРАНИЛИЩЕ ПЛАНОВ =========
+
+class PlanStore:
+    """
+    Планы пользователя — одна "строка" (файл plans_user_<id>.json).
+    Все изменения идут через read-modify-write под блокировкой строки,
+    поэтому два воркера, добавляющих разных детей одному пользователю,
+    не затирают друг друга.
+    """
+
+    def __init__(self, lock_path: Optional[Path] = None):
+        self._lock_path = lock_path
+        self._fd: Optional[int] = None
+        self._local: Dict[int, threading.Lock] = {}
+        self._local_guard = threading.Lock()
+
+    def _lock_fd(self) -> int:
+        if self._fd is None:
+            path = self._lock_path or (gold_core_telega.ensure_data_dir() / "plans.lock")
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+    @contextmanager
+    def lock(self, user_id: int):
+        with self._local_guard:
+            local = self._local.setdefault(user_id, threading.Lock())
+        with local:
+            fd = self._lock_fd()
+            # блокировка одного байта по смещению user_id, за пределами файла тоже можно
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, user_id)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, user_id)
+
+    def load(self, user_id: int) -> Dict[str, ChildPlan]:
+        return load_all_plans(user_id)
+
+    def update(self, user_id: int, fn: Callable[[Dict[str, ChildPlan]], None]) -> Dict[str, ChildPlan]:
+        """fn меняет словарь планов на месте; возвращается сохранённое состояние."""
+        with self.lock(user_id):
+            plans = load_all_plans(user_id)
+            fn(plans)
+            save_all_plans(plans, user_id)
+            return plans
+
+    def update_many(self, user_ids: Iterable[int], fn: Callable[[int, Dict[str, ChildPlan]], bool]) -> int:
+        """
+        Пакетная запись: строки блокируются все сразу, по возрастанию id
+        (одиночные update держат одну строку — взаимной блокировки нет).
+        fn(user_id, plans) меняет планы на месте и возвращает True, если
+        что-то изменилось; сохраняются только такие. Возвращает их число.
+        """
+        ids = sorted(set(user_ids))
+        changed = 0
+        with ExitStack() as stack:
+            for uid in ids:
+                stack.enter_context(self.lock(uid))
+            for uid in ids:
+                plans = load_all_plans(uid)
+                if fn(uid, plans):
+                    save_all_plans(plans, uid)
+                    changed += 1
+        return changed
+
+    def put_child(self, user_id: int, plan: ChildPlan) -> Dict[str, ChildPlan]:
+        def put(plans: Dict[str, ChildPlan]) -> None:
+            old = plans.get(plan.child_id)
+            plan.version = old.version + 1 if old is not None else 1
+            # пересоздание плана (новый бюджет, срок) не стирает реальные покупки; граммы
+            # и суммы другого металла или в другой валюте к новому плану не относятся
+            if (
+                old is not None and not len(plan.ledger)
+                and old.instrument == plan.instrument and old.currency == plan.currency
+            ):
+                plan.ledger = old.ledger
+            plans[plan.child_id] = plan
+
+        return self.update(user_id, put)
+
+    def add_purchase(self, user_id: int, child_id: str, purchase: Purchase) -> Dict[str, ChildPlan]:
+        def add(plans: Dict[str, ChildPlan]) -> None:
+            plan = plans.get(child_id)
+            if plan is None:
+                raise KeyError(child_id)
+            plan.ledger.add(purchase)
+            plan.version += 1
+
+        return self.update(user_id, add)
+
+    def delete_child(self, user_id: int, child_id: str) -> Dict[str, ChildPlan]:
+        return self.update(user_id, lambda plans: plans.pop(child_id, None))
+
+
+_store: Optional[PlanStore] = None
+
+
+def get_plan_store() -> PlanStore:
+    global _store
+    if _store is None:
+        _store = PlanStore()
+    return _store
+
+
+# ========= SELFTEST =========
+
+def _selftest_worker(data_dir: str, idx: int, children: int, barrier, results) -> None:
+    from datetime import date
+    from gold_core_telega import PlanRow
+
+    gold_core_telega.DATA_DIR = Path(data_dir)
+    leader = LeaderLock(shared_dir() / "leader.lock")
+    barrier.wait()  # все выбрали роль, пока лидер жив
+    if leader.is_leader:
+        from array import array
+        base = PriceSeries(ordinals=array("l", range(738000, 738100)), closes=array("d", [2000.0] * 100))
+        publish_book(PriceBook(base=None, fx={}, direct={"EUR": base}))
+    barrier.wait()  # цены опубликованы
+    book = SharedPriceReader().book("XAU")
+    store = PlanStore()
+    for i in range(children):
+        plan = ChildPlan(
+            child_id=f"w{idx}c{i}", name="t", birth_date=date(2020, 1, 1), target_age_years=None,
+            monthly_budget_eur=100.0, plan_rows=[PlanRow(date(2020, 1, 20), 60.0, 1.0)],
+        )
+        store.put_child(1, plan)
+    results.put((idx, leader.is_leader, len(book.series("EUR")) if book else 0))
+
+
+def _selftest(workers: int, children: int) -> None:
+    import multiprocessing as mp
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = mp.Queue()
+        barrier = mp.Barrier(workers)
+        procs = [
+            mp.Process(target=_selftest_worker, args=(tmp, i, children, barrier, results))
+            for i in range(workers)
+        ]
+        t0 = time.perf_counter()
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - t0
+        rows = sorted(results.get() for _ in procs)
+        gold_core_telega.DATA_DIR = Path(tmp)
+        stored = load_all_plans(1)
+        leaders = sum(1 for _, is_leader, _ in rows if is_leader)
+        print(f"workers={workers} leaders={leaders} series_points={[r[2] for r in rows]}")
+        print(f"children stored {len(stored)}/{workers * children} in {elapsed:.2f}s")
+        if leaders != 1 or len(stored) != workers * children:
+            raise SystemExit("selftest FAILED")
+        print("selftest OK")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Multi-worker shared state")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    st = sub.add_parser("selftest", help="несколько процессов на одной машине")
+    st.add_argument("--workers", type=int, default=4)
+    st.add_argument("--children", type=int, default=25)
+    args = parser.parse_args()
+    _selftest(args.workers, args.children)
@@ -0,0 +1,240 @@
+# gold_sources_telega.py
+"""
+Источники цен как плагины: у каждого своё здоровье (скользящая оценка
+успешности) и предохранитель — источник, который подряд падает,
+временно не опрашивается. Пул источников умеет гонку (первый валидный
+ответ) и слияние рядов.
+
+Источник с короткой историей (full_history = False: страница Investing —
+около месяца строк) в гонке только запасной: его ответ берётся, лишь
+когда все источники с полной историей отказали. Иначе более быстрый
+короткий ответ молча обрезал бы многолетний ряд планов до нескольких недель.
+"""
+import logging
+from abc import ABC, abstractmethod
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from gold_core_telega import (
+    PricePoint,
+    PriceSeries,
+    PriceSourceError,
+    download_investing_series,
+    download_stooq_columns,
+    investing_url,
+)
+from gold_metrics_telega import PRICE_FETCH_SECONDS, PRICE_FETCH_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# предохранитель: после стольких ошибок подряд источник "открывается"
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN_SEC = 10 * 60
+BREAKER_MAX_COOLDOWN_SEC = 6 * 3600
+# вес нового наблюдения в оценке здоровья
+HEALTH_ALPHA = 0.3
+
+
+# ========= ЗДОРОВЬЕ ИСТОЧНИКА =========
+
+class SourceHealth:
+    """Оценка 0..1 (EWMA успехов) и состояние предохранителя."""
+
+    def __init__(self):
+        self.score = 1.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN_SEC
+        self.last_latency: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def available(self, now: Optional[float] = None) -> bool:
+        # после остывания пропускаем пробный запрос (half-open)
+        return (now if now is not None else time.monotonic()) >= self.open_until
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            self.score = (1 - HEALTH_ALPHA) * self.score + HEALTH_ALPHA
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+            self.cooldown = BREAKER_COOLDOWN_SEC
+            self.last_latency = latency
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.score = (1 - HEALTH_ALPHA) * self.score
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= BREAKER_FAILURES:
+                self.open_until = time.monotonic() + self.cooldown
+                self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN_SEC)
+
+
+# ========= ИСТОЧНИКИ =========
+
+class PriceSource(ABC):
+    """
+    Базовый плагин. symbol — тикер пары в стиле Stooq: xauusd, eurusd, xaueur.
+    fetch возвращает отсортированный по дате ряд — список точек или сразу
+    колонки PriceSeries — или бросает PriceSourceError.
+    """
+    name = "base"
+    # отдаёт всю историю пары, а не последние недели
+    full_history = True
+
+    def __init__(self):
+        self.health = SourceHealth()
+
+    @abstractmethod
+    def fetch(self, symbol: str) -> Union[PriceSeries, List[PricePoint]]:
+        ...
+
+
+class StooqSource(PriceSource):
+    name = "stooq"
+
+    def fetch(self, symbol: str) -> PriceSeries:
+        # CSV разбирается сразу в колонки, PricePoint на каждый день не создаётся
+        return download_stooq_columns(symbol)
+
+
+class InvestingSource(PriceSource):
+    name = "investing"
+    full_history = False
+
+    def fetch(self, symbol: str) -> List[PricePoint]:
+        if len(symbol) != 6:
+            raise PriceSourceError(f"Investing: unsupported symbol {symbol}.")
+        return download_investing_series(investing_url(symbol))
+
+
+# ========= ПУЛ =========
+
+class SourcePool:
+    """
+    Опрос нескольких источников параллельно. Источники с открытым
+    предохранителем пропускаются; если закрыты все — пробуем лучший
+    по оценке, чтобы не остаться совсем без данных.
+    """
+
+    def __init__(self, sources: List[PriceSource], max_workers: int = 4):
+        self.sources = sources
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="price-src")
+
+    def _candidates(self) -> List[PriceSource]:
+        now = time.monotonic()
+        ready = [s for s in self.sources if s.health.available(now)]
+        if not ready:
+            ready = [max(self.sources, key=lambda s: s.health.score)]
+        return sorted(ready, key=lambda s: s.health.score, reverse=True)
+
+    def _run(
+        self, source: PriceSource, symbol: str, validate: Optional[Callable[[Union[PriceSeries, List[PricePoint]]], Any]] = None
+    ) -> Any:
+        t0 = time.perf_counter()
+        try:
+            data = source.fetch(symbol)
+            if not len(data):
+                raise PriceSourceError(f"{source.name}: empty dataset ({symbol}).")
+            result = validate(data) if validate is not None else data
+        except Exception:
+            PRICE_FETCH_SECONDS.observe(time.perf_counter() - t0, source=source.name)
+            PRICE_FETCH_TOTAL.inc(source=source.name, result="error")
+            source.health.record_failure()
+            raise
+        elapsed = time.perf_counter() - t0
+        PRICE_FETCH_SECONDS.observe(elapsed, source=source.name)
+        PRICE_FETCH_TOTAL.inc(source=source.name, result="ok")
+        source.health.record_success(elapsed)
+        return result
+
+    def fetch_first(
+        self, symbol: str, validate: Optional[Callable[[Union[PriceSeries, List[PricePoint]]], Any]] = None
+    ) -> Any:
+        """
+        Гонка: первый валидный ответ, остальные дорабатывают в фоне.
+        validate может преобразовать ряд или отклонить его исключением —
+        тогда ждём следующий источник, а отклонённый теряет в здоровье.
+        Ответ источника с короткой историей ждёт, пока не откажут все
+        источники с полной.
+        """
+        pending = {self._executor.submit(self._run, s, symbol, validate): s for s in self._candidates()}
+        errors: List[str] = []
+        fallback: Optional[Tuple[PriceSource, Any]] = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                source = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    logger.warning("Price source %s failed for %s: %s", source.name, symbol, e)
+                    errors.append(f"{source.name}: {e}")
+                    continue
+                if source.full_history:
+                    return result
+                if fallback is None:
+                    fallback = (source, result)
+            if fallback is not None and not any(s.full_history for s in pending.values()):
+                break
+        if fallback is not None:
+            logger.warning(
+                "No full-history source for %s, using %s (recent window only): %s",
+                symbol, fallback[0].name, "; ".join(errors),
+            )
+            return fallback[1]
+        raise PriceSourceError(f"All sources failed for {symbol}: " + "; ".join(errors))
+
+    def fetch_merged(self, symbol: str) -> List[PricePoint]:
+        """
+        Ждёт все источники и объединяет ряды по дате. При конфликте
+        берётся значение источника с лучшей оценкой здоровья.
+        """
+        futures = {self._executor.submit(self._run, s, symbol): s for s in self._candidates()}
+        results = []
+        errors: List[str] = []
+        for fut, source in futures.items():
+            try:
+                results.append((source.health.score, fut.result()))
+            except Exception as e:
+                errors.append(f"{source.name}: {e}")
+        if not results:
+            raise PriceSourceError(f"All sources failed for {symbol}: " + "; ".join(errors))
+
+        merged: Dict = {}
+        # от худшего к лучшему: лучший источник перезаписывает
+        for _, data in sorted(results, key=lambda r: r[0]):
+            points = data.to_points() if isinstance(data, PriceSeries) else data
+            for p in points:
+                merged[p.date] = p
+        return [merged[d] for d in sorted(merged)]
+
+    def health_report(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "source": s.name,
+                "score": round(s.health.score, 3),
+                "failures": s.health.consecutive_failures,
+                "open": not s.health.available(now),
+                "latency": s.health.last_latency,
+            }
+            for s in self.sources
+        ]
+
+
+_default_pool: Optional[SourcePool] = None
+
+
+def get_source_pool() -> SourcePool:
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = SourcePool([StooqSource(), InvestingSource()])
+    return _default_pool
+
+
+def set_source_pool(pool: SourcePool) -> None:
+    """Подмена пула (например, локальные источники для бенчмарков)."""
+    global _default_pool
+    _default_pool = pool
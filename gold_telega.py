@@ -1,50 +1,95 @@
 # gold_telega.py
+import asyncio
 import logging
+import math
 from datetime import date
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 
 from telegram import (
-    ReplyKeyboardMarkup,
-    ReplyKeyboardRemove,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
     Update,
-    InputFile,
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     filters,
     ConversationHandler,
     ContextTypes,
+    TypeHandler,
 )
+from telegram.warnings import PTBUserWarning
 
 
 
 from gold_core_telega import (
-    load_price_history,
-    load_all_plans,
-    save_all_plans,
-    register_child,
-    export_plan_to_csv,
-    calc_year_stats,
+    plan_csv_bytes,
+    covered_months,
+    Purchase,
     average_monthly_return_with_target,
     forecast_price,
-    months_between_exact,
+    installment_schedule,
+    simulate_buy_ahead,
     PriceSourceError,
 )
+from gold_views_telega import ChildView, get_view_cache
+from gold_compute_telega import ComputeError, ComputeTimeoutError, get_compute
+import gold_i18n_telega as i18n
+from gold_metrics_telega import instrument_handler, start_metrics_server
+from gold_shared_telega import enable_multi_worker, get_plan_store
+import gold_admin_telega
+import gold_alerts_telega
+import gold_charts_telega
+from gold_limits_telega import (
+    MAX_FORECAST_MONTHS,
+    MESSAGE_MAX_CHARS,
+    LimitError,
+    RateLimitedError,
+    clip_lines,
+    guard,
+    max_units,
+)
+import gold_recalc_telega
+import gold_shadow_telega
+from gold_scheduler_telega import ReminderScheduler, get_user_prefs
+from gold_uploads_telega import send_cached
+import gold_profiling_telega
+from gold_profiling_telega import profiled
+from gold_market_telega import (
+    INSTRUMENTS,
+    DEFAULT_INSTRUMENT,
+    get_price_book,
+    ensure_price_book,
+)
 import os
+import warnings
 from dotenv import load_dotenv
 # ========= НАСТРОЙКИ =========
 
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_TOKEN")
+METRICS_PORT = os.getenv("METRICS_PORT")
+MULTI_WORKER = os.getenv("GOLD_MULTI_WORKER") == "1"
+# вебхук вместо long polling (нужен для нескольких воркеров за балансировщиком)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# ежемесячные напоминания о покупке (в режиме нескольких воркеров шлёт только лидер)
+REMINDERS = os.getenv("GOLD_REMINDERS") == "1"
+SHADOW_LOG = os.getenv("SHADOW_LOG")  # каталог записи трафика для gold_shadow_telega
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
 MAX_WEIGHT_GRAMS = 10000.0
+# сумма одной покупки: 10 кг золота стоят порядка миллиона EUR, берём с запасом
+MAX_PURCHASE_AMOUNT = 10_000_000.0
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Глобальные данные (как в CLI)
-pricepoints = None
 # Состояния для диалогов
 (
     LANG_CHOOSE,
@@ -61,163 +106,217 @@ pricepoints = None
     CHILD_DEBT_INCLUDE_BASE,
     CHILD_BUY_AHEAD_WEIGHT,
     CHILD_STATUS_HAVE,
-) = range(14)
+    ADD_CURRENCY,
+    ADD_INSTRUMENT,
+    CHILD_PURCHASE,
+) = range(17)
 
 
 # ========= ВСПОМОГАТЕЛЬНОЕ =========
 
 def get_lang(context: ContextTypes.DEFAULT_TYPE) -> str:
-    return context.user_data.get("lang", "ru")
+    return context.user_data.get("lang", i18n.DEFAULT_LANG)
+
+
+def tr(context: ContextTypes.DEFAULT_TYPE, key: str, **kwargs) -> str:
+    return i18n.t(get_lang(context), key, **kwargs)
+
+
+def menu_keyboard(context: ContextTypes.DEFAULT_TYPE, name: str) -> InlineKeyboardMarkup:
+    return i18n.keyboard(get_lang(context), name)
+
+
+@lru_cache(maxsize=None)
+def _instrument_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(c, callback_data=f"inst:{c}") for c in INSTRUMENTS]])
+
+
+@lru_cache(maxsize=32)
+def _currency_keyboard(currencies: tuple) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(c, callback_data=f"cur:{c}") for c in currencies]])
+
+
+@lru_cache(maxsize=1024)
+def _children_keyboard(children: tuple) -> Optional[InlineKeyboardMarkup]:
+    """children: ((child_id, имя), ...). ID длиннее лимита callback_data (64 байта) — только вводом."""
+    buttons = [
+        InlineKeyboardButton(f"{name} ({cid})", callback_data=f"open:{cid}")
+        for cid, name in children
+        if len(f"open:{cid}".encode()) <= 64
+    ]
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup([buttons[i: i + 2] for i in range(0, len(buttons), 2)])
+
+
+def user_input(update: Update) -> str:
+    """Текст сообщения или данные нажатой кнопки без префикса ("child:3" -> "3")."""
+    query = update.callback_query
+    if query is not None:
+        return query.data.partition(":")[2]
+    return update.message.text.strip()
+
+
+async def reply(update: Update, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+    """
+    Ответ на действие. На нажатие кнопки сообщение с кнопками правится на
+    месте (editMessageText вместо нового сообщения, ответ на callback —
+    параллельно); на текст — обычный ответ новым сообщением.
+    """
+    query = update.callback_query
+    if query is None:
+        await update.message.reply_text(text, reply_markup=reply_markup)
+        return
+
+    async def edit() -> None:
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except BadRequest as e:
+            # та же кнопка нажата повторно — править нечего
+            if "not modified" in str(e).lower():
+                return
+            # сообщение слишком старое или удалено — отвечаем новым
+            await query.message.reply_text(text, reply_markup=reply_markup)
+
+    await asyncio.gather(query.answer(), edit())
+
 
+def is_admin(update: Update) -> bool:
+    return update.effective_user is not None and update.effective_user.id in ADMIN_IDS
 
-def label(context: ContextTypes.DEFAULT_TYPE, ru: str, en: str) -> str:
-    return ru if get_lang(context) == "ru" else en
+
+def instrument_name(context: ContextTypes.DEFAULT_TYPE, code: str) -> str:
+    inst = INSTRUMENTS.get(code)
+    if inst is None:
+        return code
+    try:
+        return tr(context, f"instrument.{code}")
+    except KeyError:
+        return inst.name_en
 
 
 def format_main_menu(context: ContextTypes.DEFAULT_TYPE) -> str:
-    return label(
-        context,
-        "============================\n"
-        "Главное меню:\n"
-        "  1) 👶 Добавить/обновить ребёнка\n"
-        "  2) 👨‍👩‍👧 Список детей\n"
-        "  3) 📂 Открыть ребёнка и расчёты\n"
-        "  0) 🚪 Выход / завершить",
-        "============================\n"
-        "Main menu:\n"
-        "  1) 👶 Add/update child\n"
-        "  2) 👨‍👩‍👧 Show children\n"
-        "  3) 📂 Open child & calculations\n"
-        "  0) 🚪 Exit / finish",
-    )
+    return tr(context, "menu.main")
 
 
 def format_child_menu(context: ContextTypes.DEFAULT_TYPE) -> str:
-    return label(
-        context,
-        "----------------------------\n"
-        "Меню ребёнка:\n"
-        "  1) 📅 План по годам\n"
-        "  2) 📊 Статус плана по месяцам ✅/❌\n"
-        "  3) 💳 Долг / рассрочка\n"
-        "  4) 🔮 Прогноз цены\n"
-        "  5) 🛒 Покупка наперёд\n"
-        "  6) 📄 Экспорт плана в CSV\n"
-        "  0) ◀️ Назад в главное меню",
-        "----------------------------\n"
-        "Child menu:\n"
-        "  1) 📅 Plan by years\n"
-        "  2) 📊 Monthly plan status ✅/❌\n"
-        "  3) 💳 Debt / installments\n"
-        "  4) 🔮 Price forecast\n"
-        "  5) 🛒 Buy ahead\n"
-        "  6) 📄 Export plan to CSV\n"
-        "  0) ◀️ Back to main menu",
-    )
+    return tr(context, "menu.child")
+
+
+async def reply_compute_error(update: Update, context: ContextTypes.DEFAULT_TYPE, e: Exception) -> None:
+    logger.warning("Computation rejected for user %s: %s", update.effective_user.id, e)
+    key = "compute.timeout" if isinstance(e, ComputeTimeoutError) else "compute.busy"
+    await reply(update, tr(context, key))
+
+
+async def reply_limited(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, e: LimitError,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+) -> None:
+    logger.info("Action limited for user %s: %s", update.effective_user.id, e)
+    if isinstance(e, RateLimitedError):
+        text = tr(context, "limits.slow_down", seconds=max(1, math.ceil(e.retry_after)))
+    else:
+        text = tr(context, "compute.busy")
+    await reply(update, text, reply_markup)
+
+
+async def load_child_view(update: Update, context: ContextTypes.DEFAULT_TYPE, child) -> Optional[ChildView]:
+    """
+    Вид ребёнка по свежей книге цен его инструмента. После перезапуска книги
+    есть только у инструмента по умолчанию — остальные грузятся здесь, в
+    потоке; не загрузилась — ошибка пользователю, а не пересчёт по курсу 1.0.
+    """
+    book = get_price_book(child.instrument)
+    try:
+        if book is None or book.is_stale():
+            await asyncio.to_thread(ensure_price_book, child.instrument)
+        return get_view_cache().get(context.user_data["user_id"], child)
+    except PriceSourceError as e:
+        await reply(update, tr(context, "error.price_source", error=e), menu_keyboard(context, "child"))
+        return None
+
+
+def omitted_lines(context: ContextTypes.DEFAULT_TYPE):
+    return lambda count: tr(context, "limits.omitted", count=count)
 
 
 # ========= СТАРТ И ВЫБОР ЯЗЫКА =========
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    global pricepoints
     user_id = update.effective_user.id
 
     # Загружаем планы пользователя в контекст
     if 'plans' not in context.user_data:
-        context.user_data['plans'] = load_all_plans(user_id)
+        context.user_data['plans'] = get_plan_store().load(user_id)
     context.user_data['user_id'] = user_id
 
-    await update.message.reply_text(
-        "Choose language / Выберите язык",
-        reply_markup=ReplyKeyboardMarkup(
-            [["Русский", "English"]],
-            one_time_keyboard=True,
-            resize_keyboard=True,
-        ),
-    )
-    if pricepoints is None:
-        await update.message.reply_text("Загружаю данные XAUEUR...")
+    await update.message.reply_text(i18n.language_prompt(), reply_markup=i18n.language_keyboard())
+    if get_price_book(DEFAULT_INSTRUMENT) is None:
+        # язык ещё не выбран — сообщения на языке по умолчанию
+        await update.message.reply_text(tr(context, "start.loading"))
         try:
-            pricepoints = load_price_history()
-            mindate = pricepoints[0].date
-            maxdate = pricepoints[-1].date
-            await update.message.reply_text(f"Данные доступны с {mindate} по {maxdate}.")
+            book = await asyncio.to_thread(ensure_price_book, DEFAULT_INSTRUMENT)
+            currencies = book.currencies()
+            points = book.points("EUR" if "EUR" in currencies else currencies[0])
+            await update.message.reply_text(
+                tr(context, "start.data_range", start=points[0].date, end=points[-1].date,
+                   currencies=", ".join(currencies))
+            )
         except PriceSourceError as e:
-            await update.message.reply_text(f"Ошибка источника данных: {e}")
+            await update.message.reply_text(tr(context, "error.price_source", error=e))
             return ConversationHandler.END
     return LANG_CHOOSE
 
 
 async def choose_lang(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    text = update.message.text.lower()
-    lang = "en" if ("eng" in text or "english" in text or text == "2") else "ru"
-    context.user_data["lang"] = lang
-
-    disclaimer = label(
-        context,
-        "⚠️ Важно: все расчёты являются приблизительной оценкой и НЕ являются инвестиционной рекомендацией.",
-        "⚠️ Important: all calculations are rough estimates and NOT investment advice.",
-    )
-    await update.message.reply_text(disclaimer, reply_markup=ReplyKeyboardRemove())
-    await update.message.reply_text(
-        format_main_menu(context),
-        reply_markup=ReplyKeyboardMarkup(
-            [["1", "2", "3"], ["0"]],
-            resize_keyboard=True,
-            one_time_keyboard=False,
-        ),
+    lang = context.user_data["lang"] = i18n.match_language(user_input(update))
+    # язык нужен планировщику напоминаний, который работает вне диалога
+    await asyncio.to_thread(get_user_prefs().set, update.effective_user.id, lang=lang)
+
+    await reply(
+        update, tr(context, "disclaimer") + "\n\n" + format_main_menu(context), menu_keyboard(context, "main")
     )
     return MAIN_MENU
 
 
-
-# ========= ГЛАВНОЕ МЕНЮ =========
-
 # ========= ГЛАВНОЕ МЕНЮ =========
 
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    cmd = update.message.text.strip()
+    cmd = user_input(update)
     plans = context.user_data.get('plans', {})
 
     if cmd == "0":
-        await update.message.reply_text(
-            label(context, "👋 Пока! Можешь вызвать /start, чтобы начать снова.", "👋 Bye! Use /start to begin again.")
-        )
+        await reply(update, tr(context, "bye"))
         return ConversationHandler.END
     elif cmd == "1":
-        await update.message.reply_text(
-            label(context, "🆔 Введи ID ребёнка (например 1):", "🆔 Enter child ID (e.g. 1):"),
-            reply_markup=ReplyKeyboardRemove(),
-        )
+        await reply(update, tr(context, "add.ask_id"))
         return ADD_ID
     elif cmd == "2":
         if not plans:
-            await update.message.reply_text(
-                label(context, "Пока нет детей.", "No children yet."),
-            )
+            await reply(update, tr(context, "children.none"), menu_keyboard(context, "main"))
         else:
             lines = []
             for cid, p in plans.items():
                 if p.target_age_years is not None:
-                    target = label(context, f"до {p.target_age_years} лет", "until age {age}").format(
-                        age=p.target_age_years
-                    )
+                    target = tr(context, "children.target_age", age=p.target_age_years)
                 else:
-                    target = label(context, "до сегодня", "until today")
-                lines.append(f"{cid}: {p.name}, {target}, {p.monthly_budget_eur:.0f} EUR/мес")
-            await update.message.reply_text("\n".join(lines))
-        await update.message.reply_text(format_main_menu(context))
+                    target = tr(context, "children.target_today")
+                lines.append(
+                    tr(
+                        context, "children.line", cid=cid, name=p.name,
+                        instrument=instrument_name(context, p.instrument), target=target,
+                        budget=p.monthly_budget_eur, cur=p.currency,
+                    )
+                )
+            await reply(update, "\n".join(lines), menu_keyboard(context, "main"))
         return MAIN_MENU
     elif cmd == "3":
-        await update.message.reply_text(
-            label(context, "🆔 Введи ID ребёнка:", "🆔 Enter child ID:"),
-            reply_markup=ReplyKeyboardRemove(),
-        )
+        children = tuple((cid, p.name) for cid, p in plans.items())
+        await reply(update, tr(context, "child.ask_id"), _children_keyboard(children))
         return CHILD_MENU
     else:
-        await update.message.reply_text(
-            label(context, "Не понял команду. Нажми кнопку.", "Unknown command. Use the buttons."),
-        )
+        await reply(update, tr(context, "menu.unknown"), menu_keyboard(context, "main"))
         return MAIN_MENU
 
 
@@ -225,15 +324,13 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def add_child_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["add_child_id"] = update.message.text.strip()
-    await update.message.reply_text(label(context, "Имя ребёнка:", "Child name:"))
+    await update.message.reply_text(tr(context, "add.ask_name"))
     return ADD_NAME
 
 
 async def add_child_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["add_name"] = update.message.text.strip()
-    await update.message.reply_text(
-        label(context, "Дата рождения (YYYY-MM-DD):", "Birth date (YYYY-MM-DD):")
-    )
+    await update.message.reply_text(tr(context, "add.ask_birth"))
     return ADD_BIRTH
 
 
@@ -242,57 +339,83 @@ async def add_child_birth(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         d = date.fromisoformat(s)
     except ValueError:
-        await update.message.reply_text(
-            label(context, "❌ Формат неверный. Введи YYYY-MM-DD:", "❌ Invalid format. Use YYYY-MM-DD:")
-        )
+        await update.message.reply_text(tr(context, "add.bad_birth"))
         return ADD_BIRTH
     context.user_data["add_birth"] = d
 
-    kb = [["16", "18", "21", "0"]]
-    await update.message.reply_text(
-        label(
-            context,
-            "До какого возраста покупать золото? 16/18/21, или 0 – до сегодня.",
-            "Until what age to buy gold? 16/18/21, or 0 – until today.",
-        ),
-        reply_markup=ReplyKeyboardMarkup(kb, one_time_keyboard=True, resize_keyboard=True),
-    )
+    await reply(update, tr(context, "add.ask_target"), menu_keyboard(context, "target"))
     return ADD_TARGET
 
 
 async def add_child_target(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    s = update.message.text.strip()
+    s = user_input(update)
     if s == "0":
         target = None
     else:
         try:
             target = int(s)
         except ValueError:
-            await update.message.reply_text(
-                label(context, "Введи 16, 18, 21 или 0:", "Enter 16, 18, 21 or 0:")
-            )
+            await reply(update, tr(context, "add.bad_target"), menu_keyboard(context, "target"))
             return ADD_TARGET
     context.user_data["add_target_age"] = target
-    await update.message.reply_text(
-        label(
-            context,
-            "Месячный бюджет в EUR (например 255):",
-            "Monthly budget in EUR (e.g. 255):",
-        ),
-        reply_markup=ReplyKeyboardRemove(),
+    await reply(
+        update,
+        tr(context, "add.ask_instrument",
+           options=", ".join(f"{c} – {instrument_name(context, c)}" for c in INSTRUMENTS)),
+        _instrument_keyboard(),
     )
+    return ADD_INSTRUMENT
+
+
+async def add_child_instrument(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    code = user_input(update).upper()
+    if code not in INSTRUMENTS:
+        await reply(update, tr(context, "add.bad_instrument", options=", ".join(INSTRUMENTS)), _instrument_keyboard())
+        return ADD_INSTRUMENT
+    context.user_data["add_instrument"] = code
+
+    # ряды металла грузятся только при первом плане на него
+    book = get_price_book(code)
+    try:
+        if book is None or book.is_stale():
+            book = await asyncio.to_thread(ensure_price_book, code)
+    except PriceSourceError as e:
+        await reply(update, tr(context, "error.price_source", error=e), _instrument_keyboard())
+        return ADD_INSTRUMENT
+    currencies = book.currencies()
+    await reply(
+        update,
+        tr(context, "add.ask_currency", currencies=", ".join(currencies)),
+        _currency_keyboard(tuple(currencies)),
+    )
+    return ADD_CURRENCY
+
+
+async def add_child_currency(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    cur = user_input(update).upper()
+    book = get_price_book(context.user_data.get("add_instrument", DEFAULT_INSTRUMENT))
+    currencies = book.currencies() if book is not None else ["EUR"]
+    if cur not in currencies:
+        await reply(
+            update, tr(context, "add.bad_currency", currencies=", ".join(currencies)),
+            _currency_keyboard(tuple(currencies)),
+        )
+        return ADD_CURRENCY
+    context.user_data["add_currency"] = cur
+    await reply(update, tr(context, "add.ask_budget", cur=cur))
     return ADD_BUDGET
 
 
 async def add_child_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    global price_points
     s = update.message.text.strip()
+    cur = context.user_data.get("add_currency", "EUR")
     try:
         budget = float(s)
     except ValueError:
-        await update.message.reply_text(
-            label(context, "❌ Неверное число. Введи сумму в EUR:", "❌ Invalid number. Enter EUR amount:")
-        )
+        budget = math.nan
+    # nan и inf float() принимает; в плане они ломают расчёты и файл планов
+    if not math.isfinite(budget):
+        await update.message.reply_text(tr(context, "add.bad_budget", cur=cur))
         return ADD_BUDGET
 
     cid = context.user_data["add_child_id"]
@@ -300,201 +423,189 @@ async def add_child_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     birth = context.user_data["add_birth"]
     target_age = context.user_data["add_target_age"]
     user_id = context.user_data['user_id']
+    instrument = context.user_data.get("add_instrument", DEFAULT_INSTRUMENT)
 
-    plan = register_child(
-        child_id=cid,
-        name=name,
-        birth_date=birth,
-        target_age_years=target_age,
-        monthly_budget_eur=budget,
-        price_points=price_points,
-    )
-
-    # Сохраняем в контекст пользователя
-    context.user_data['plans'][cid] = plan
-    save_all_plans(context.user_data['plans'], user_id)
+    book = get_price_book(instrument)
+    try:
+        if book is None:
+            raise PriceSourceError("prices are not loaded")
+        series = book.series(cur)
+    except PriceSourceError as e:
+        await reply(update, tr(context, "error.price_source", error=e), menu_keyboard(context, "main"))
+        return MAIN_MENU
 
-    await update.message.reply_text(
-        label(
-            context,
-            f"✅ План для '{name}' сохранён. Месяцев в плане: {len(plan.plan_rows)}.",
-            f"✅ Plan for '{name}' saved. Months in plan: {len(plan.plan_rows)}.",
+    try:
+        plan = await get_compute().register_child(
+            series,
+            child_id=cid,
+            name=name,
+            birth_date=birth,
+            target_age_years=target_age,
+            monthly_budget_eur=budget,
+            currency=cur,
+            instrument=instrument,
         )
-    )
-    await update.message.reply_text(
-        format_main_menu(context),
-        reply_markup=ReplyKeyboardMarkup(
-            [["1", "2", "3"], ["0"]],
-            resize_keyboard=True,
-        ),
-    )
+    except ComputeError as e:
+        await reply_compute_error(update, context, e)
+        return ADD_BUDGET
+
+    # Сохраняем под блокировкой пользователя и берём то, что реально записано
+    # (другой воркер мог добавить ребёнка параллельно)
+    context.user_data['plans'] = get_plan_store().put_child(user_id, plan)
+
+    await reply(update, tr(context, "add.saved", name=name, months=len(plan.plan_rows)), menu_keyboard(context, "main"))
     return MAIN_MENU
 
 
 # ========= МЕНЮ РЕБЁНКА =========
 
 async def child_menu_enter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    cid = update.message.text.strip()
+    cid = user_input(update)
     plans = context.user_data.get('plans', {})
 
     if cid not in plans:
-        await update.message.reply_text(
-            label(context, "❌ Нет такого ID. Вернись в главное меню и добавь ребёнка.",
-                  "❌ No such ID. Go back to main menu and add a child."),
-        )
-        await update.message.reply_text(format_main_menu(context))
+        await reply(update, tr(context, "child.not_found"), menu_keyboard(context, "main"))
         return MAIN_MENU
 
     context.user_data["child_id"] = cid
     child = plans[cid]
-    await update.message.reply_text(
-        label(context, f"📂 Открыт ребёнок '{child.name}'.", f"📂 Child '{child.name}' opened.")
-    )
-    await update.message.reply_text(
-        format_child_menu(context),
-        reply_markup=ReplyKeyboardMarkup(
-            [["1", "2"], ["3", "4"], ["5", "6"], ["0"]],
-            resize_keyboard=True,
-        ),
+    await reply(
+        update, tr(context, "child.opened", name=child.name) + "\n" + format_child_menu(context),
+        menu_keyboard(context, "child"),
     )
     return CHILD_ACTION
 
 
 async def child_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    cmd = update.message.text.strip()
+    cmd = user_input(update)
     cid = context.user_data.get("child_id")
     plans = context.user_data.get('plans', {})
+    menu = menu_keyboard(context, "child")
 
     if not cid or cid not in plans:
-        await update.message.reply_text(
-            label(context, "❌ Сначала выбери ребёнка через главное меню.", "❌ Choose a child first from main menu."),
-        )
+        await reply(update, tr(context, "child.choose_first"), menu_keyboard(context, "main"))
         return MAIN_MENU
 
     child = plans[cid]
     plan_rows = child.plan_rows
     if not plan_rows:
-        await update.message.reply_text(label(context, "План пуст.", "Plan is empty."))
+        await reply(update, tr(context, "child.plan_empty"), menu)
         return CHILD_ACTION
 
-    last_row = plan_rows[-1]
-    last_price_per_gram = last_row.price_per_gram_eur
-
-    if child.target_age_years is not None:
-        target_date = date(
-            child.birth_date.year + child.target_age_years,
-            child.birth_date.month,
-            child.birth_date.day,
-        )
-    else:
-        target_date = date.today()
-
-    months_total_to_target = months_between_exact(child.birth_date, target_date)
-    months_fact = len(plan_rows)
-    months_from_birth_to_last = months_between_exact(child.birth_date, plan_rows[-1].date)
-    months_from_birth_to_last = max(months_from_birth_to_last, months_fact)
-    remaining_months = max(0, months_total_to_target - months_from_birth_to_last)
+    # целевая дата, оценка доходности и тексты таблиц считаются один раз на версию плана и цен
+    view = await load_child_view(update, context, child)
+    if view is None:
+        return CHILD_ACTION
+    last_price_per_gram = view.last_price
+    cur = view.currency
+    eur_rate = view.eur_rate
+    months_fact = view.months_fact
 
     if cmd == "0":
-        await update.message.reply_text(format_main_menu(context))
+        await reply(update, format_main_menu(context), menu_keyboard(context, "main"))
         return MAIN_MENU
 
     if cmd == "1":
-        year_stats = calc_year_stats(plan_rows)
-        lines = [label(context, "📅 План по годам (граммы):", "📅 Plan by years (grams):")]
-        for y in sorted(year_stats):
-            lines.append(f"{y}: {year_stats[y]:.4f} g")
-        await update.message.reply_text("\n".join(lines))
+        await reply(update, view.years_text(get_lang(context)), menu)
         return CHILD_ACTION
 
     if cmd == "2":
-        await update.message.reply_text(
-            label(
-                context,
-                "💰 Сколько грамм золота уже есть (всего по этому ребёнку)?",
-                "💰 How many grams of gold do you already have for this child?",
+        # есть журнал покупок — граммы берём из него, не спрашиваем
+        if len(child.ledger):
+            await reply(
+                update,
+                status_text(context, child, view, child.ledger.total_grams, ledger_summary(context, child)),
+                menu,
             )
-        )
+            return CHILD_ACTION
+        await reply(update, tr(context, "status.ask_have"))
         return CHILD_STATUS_HAVE
 
     if cmd == "3":
-        avg_ret = average_monthly_return_with_target(plan_rows, remaining_months)
+        avg_ret = view.avg_ret
+        context.user_data["currency"] = cur
+        context.user_data["eur_rate"] = eur_rate
         context.user_data["avg_ret"] = avg_ret
         context.user_data["last_price"] = last_price_per_gram
         context.user_data["months_fact"] = months_fact
         context.user_data["plan_rows"] = plan_rows
+        context.user_data["plan_total"] = view.plan_total
 
-        await update.message.reply_text(
-            label(
-                context,
-                "💰 Сколько грамм золота у тебя сейчас по этому ребёнку?",
-                "💰 How many grams do you currently have for this child?",
-            )
-        )
+        if len(child.ledger):
+            return await reply_debt(update, context, child.ledger.total_grams, ledger_summary(context, child))
+        await reply(update, tr(context, "debt.ask_have"))
         return CHILD_DEBT_HAVE
 
     if cmd == "4":
         if len(plan_rows) < 2:
-            await update.message.reply_text(
-                label(context, "Недостаточно точек для прогноза.", "Not enough points for forecast.")
-            )
+            await reply(update, tr(context, "forecast.not_enough"), menu)
             return CHILD_ACTION
 
-        avg_ret = average_monthly_return_with_target(plan_rows, remaining_months)
-        msg_lines = [
-            label(
-                context,
-                f"📈 Средний рост цены: {avg_ret * 100:.2f}%/мес (очень грубая оценка).",
-                f"📈 Avg monthly price change: {avg_ret * 100:.2f}% (very rough).",
-            )
-        ]
-        for m in [1, 3, 6, 12, 24]:
-            fp = forecast_price(last_price_per_gram, avg_ret, m)
-            msg_lines.append(
-                label(
-                    context,
-                    f"  Через {m} мес: {fp:.2f} EUR/г",
-                    f"  In {m} months: {fp:.2f} EUR/g",
-                )
-            )
-        await update.message.reply_text("\n".join(msg_lines))
-        await update.message.reply_text(
-            label(
-                context,
-                "⏱ Введи кол-во месяцев для произвольного прогноза (или 0, чтобы пропустить):",
-                "⏱ Enter number of months for custom forecast (or 0 to skip):",
-            )
-        )
+        avg_ret = view.avg_ret
+        await reply(update, view.forecast_text(get_lang(context)) + "\n" + tr(context, "forecast.ask_custom"), menu)
         context.user_data["forecast_mode"] = True
         context.user_data["forecast_last_price"] = last_price_per_gram
         context.user_data["forecast_avg_ret"] = avg_ret
+        context.user_data["currency"] = cur
+        context.user_data["eur_rate"] = eur_rate
         return CHILD_ACTION
 
     if cmd == "5":
         context.user_data["plan_rows"] = plan_rows
         context.user_data["last_price"] = last_price_per_gram
-        await update.message.reply_text(
-            label(
-                context,
-                "⚖️ Сколько грамм хочешь купить сейчас по текущему курсу?",
-                "⚖️ How many grams do you want to buy now at current price?",
-            )
-        )
+        context.user_data["currency"] = cur
+        context.user_data["eur_rate"] = eur_rate
+        await reply(update, tr(context, "buy_ahead.ask_weight"))
         return CHILD_BUY_AHEAD_WEIGHT
 
     if cmd == "6":
-        child = plans[cid]
-        path = Path(f"{child.child_id}_plan.csv")
-        export_plan_to_csv(child, path)
-        with path.open("rb") as f:
-            await update.message.reply_document(
-                document=InputFile(f, filename=path.name),
-                caption=label(
-                    context,
-                    "📄 План экспортирован в CSV.",
-                    "📄 Plan exported to CSV.",
-                ),
-            )
+        try:
+            async with guard(context.user_data["user_id"], "export"):
+                if update.callback_query is not None:
+                    # меню остаётся в сообщении с кнопками, файл — отдельным сообщением
+                    await update.callback_query.answer()
+                # тот же план и те же цены — те же байты: повторно уходит только file_id
+                await send_cached(
+                    update.effective_chat,
+                    "document",
+                    plan_csv_bytes(child),
+                    f"{child.child_id}_plan.csv",
+                    caption=tr(context, "export.caption"),
+                )
+        except LimitError as e:
+            await reply_limited(update, context, e, menu)
+        return CHILD_ACTION
+
+    if cmd == "7":
+        await reply(update, tr(context, "purchase.ask", cur=cur))
+        return CHILD_PURCHASE
+
+    if cmd == "8":
+        user_id = context.user_data["user_id"]
+        lang = get_lang(context)
+        if not gold_charts_telega.charts_available():
+            await reply(update, tr(context, "chart.unavailable"), menu)
+            return CHILD_ACTION
+        try:
+            async with guard(user_id, "charts"):
+                charts = [
+                    (kind, await gold_charts_telega.get_chart(user_id, child, view, kind, lang))
+                    for kind in gold_charts_telega.KINDS
+                ]
+                if update.callback_query is not None:
+                    await update.callback_query.answer()
+                for kind, png in charts:
+                    await send_cached(
+                        update.effective_chat,
+                        "photo",
+                        png,
+                        f"{child.child_id}_{kind}.png",
+                        caption=tr(context, f"chart.{kind}_caption"),
+                    )
+        except ComputeError as e:
+            await reply_compute_error(update, context, e)
+        except LimitError as e:
+            await reply_limited(update, context, e, menu)
         return CHILD_ACTION
 
     if context.user_data.get("forecast_mode"):
@@ -502,29 +613,28 @@ async def child_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         try:
             m = int(s)
         except ValueError:
-            await update.message.reply_text(
-                label(context, "Введи число месяцев или 0:", "Enter integer months or 0:")
-            )
+            await reply(update, tr(context, "forecast.bad_months"), menu)
+            return CHILD_ACTION
+        if m > MAX_FORECAST_MONTHS:
+            await reply(update, tr(context, "forecast.too_many_months", limit=MAX_FORECAST_MONTHS), menu)
             return CHILD_ACTION
         if m > 0:
-            fp = forecast_price(
-                context.user_data["forecast_last_price"],
-                context.user_data["forecast_avg_ret"],
-                m,
-            )
-            await update.message.reply_text(
-                label(
-                    context,
-                    f"🔮 Прогноз через {m} мес.: {fp:.2f} EUR/г",
-                    f"🔮 Forecast in {m} months: {fp:.2f} EUR/g",
-                )
-            )
+            try:
+                async with guard(context.user_data["user_id"], "forecast"):
+                    fp = forecast_price(
+                        context.user_data["forecast_last_price"],
+                        context.user_data["forecast_avg_ret"],
+                        m,
+                        eur_rate,
+                    )
+                    await reply(update, tr(context, "forecast.custom", months=m, price=fp, cur=cur), menu)
+            except LimitError as e:
+                await reply_limited(update, context, e, menu)
+                return CHILD_ACTION
         context.user_data["forecast_mode"] = False
         return CHILD_ACTION
 
-    await update.message.reply_text(
-        label(context, "Не понял команду. Выбери пункт меню.", "Unknown command. Choose menu item."),
-    )
+    await reply(update, tr(context, "child.unknown"), menu)
     return CHILD_ACTION
 
 
@@ -535,38 +645,93 @@ async def child_status_have(update: Update, context: ContextTypes.DEFAULT_TYPE)
     try:
         have_grams = float(s)
     except ValueError:
-        await update.message.reply_text(
-            label(context, "❌ Неверное число. Введи граммы:", "❌ Invalid number. Enter grams:")
-        )
+        await update.message.reply_text(tr(context, "input.bad_grams"))
         return CHILD_STATUS_HAVE
 
     cid = context.user_data["child_id"]
     plans = context.user_data.get('plans', {})
     child = plans[cid]
-    plan_rows = child.plan_rows
+    view = await load_child_view(update, context, child)
+    if view is None:
+        return CHILD_ACTION
 
-    grams_left = have_grams
-    lines = [
-        label(
-            context,
-            "📊 План по месяцам (дата, цена, граммы, статус):",
-            "📊 Monthly plan (date, price, grams, status):",
-        )
-    ]
-    for r in plan_rows:
-        if grams_left >= r.grams_for_budget:
-            status = "✅"
-            grams_left -= r.grams_for_budget
-        elif grams_left > 0:
-            status = "✅❌"
-            grams_left = 0.0
-        else:
-            status = "❌"
-        lines.append(
-            f"{r.date.isoformat()}, {r.price_per_gram_eur:.2f} EUR/g, {r.grams_for_budget:.4f} g, {status}"
+    await reply(update, status_text(context, child, view, have_grams), menu_keyboard(context, "child"))
+    return CHILD_ACTION
+
+
+def status_text(context: ContextTypes.DEFAULT_TYPE, child, view, have_grams: float, header: str = "") -> str:
+    # сколько месяцев закрыто — бисекция по накопленным граммам плана
+    full, partial = covered_months(view.plan_prefix, have_grams)
+    head = [header] if header else []
+    head.append(tr(context, "status.title"))
+    rows = []
+    for i, r in enumerate(child.plan_rows):
+        status = "✅" if i < full else ("✅❌" if i == full and partial else "❌")
+        rows.append(
+            f"{r.date.isoformat()}, {r.price_per_gram_eur:.2f} {child.currency}/g, {r.grams_for_budget:.4f} g, {status}"
         )
-    await update.message.reply_text("\n".join(lines))
-    await update.message.reply_text(format_child_menu(context))
+    # план на 18 лет — больше 200 строк: в одно сообщение Telegram не влезает
+    budget = MESSAGE_MAX_CHARS - sum(len(s) + 1 for s in head)
+    return "\n".join(head + clip_lines(rows, budget, omitted_lines(context)))
+
+
+def ledger_summary(context: ContextTypes.DEFAULT_TYPE, child) -> str:
+    ledger = child.ledger
+    return tr(
+        context, "ledger.summary", count=len(ledger), grams=ledger.total_grams,
+        amount=ledger.total_amount, cur=child.currency,
+    )
+
+
+# ========= ЖУРНАЛ ПОКУПОК =========
+
+def parse_purchase(text: str) -> Optional[Purchase]:
+    """"[ГГГГ-ММ-ДД] граммы сумма"; без даты — сегодня."""
+    parts = text.replace(",", ".").split()
+    if len(parts) == 3:
+        try:
+            d = date.fromisoformat(parts[0])
+        except ValueError:
+            return None
+        parts = parts[1:]
+    elif len(parts) == 2:
+        d = date.today()
+    else:
+        return None
+    try:
+        grams, amount = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    # nan и inf float() принимает, а в суммах покупок они портят всё, что после них
+    if not (math.isfinite(grams) and math.isfinite(amount)):
+        return None
+    if not (0 < grams <= MAX_WEIGHT_GRAMS) or not (0 <= amount <= MAX_PURCHASE_AMOUNT) or d > date.today():
+        return None
+    return Purchase(date=d, grams=grams, amount=amount)
+
+
+async def child_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    purchase = parse_purchase(update.message.text.strip())
+    cid = context.user_data["child_id"]
+    child = context.user_data.get('plans', {})[cid]
+    if purchase is None:
+        await update.message.reply_text(tr(context, "purchase.bad", cur=child.currency))
+        return CHILD_PURCHASE
+
+    user_id = context.user_data["user_id"]
+    plans = context.user_data['plans'] = get_plan_store().add_purchase(user_id, cid, purchase)
+    child = plans[cid]
+    view = await load_child_view(update, context, child)
+    if view is None:
+        return CHILD_ACTION
+    await reply(
+        update,
+        tr(
+            context, "purchase.saved", grams=purchase.grams, amount=purchase.amount, cur=child.currency,
+            total=child.ledger.total_grams, planned=view.plan_total,
+        ),
+        menu_keyboard(context, "child"),
+    )
     return CHILD_ACTION
 
 
@@ -577,48 +742,34 @@ async def child_debt_have(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         have_grams = float(s)
     except ValueError:
-        await update.message.reply_text(
-            label(context, "❌ Неверное число. Введи граммы:", "❌ Invalid number. Enter grams:")
-        )
+        await update.message.reply_text(tr(context, "input.bad_grams"))
         return CHILD_DEBT_HAVE
+    return await reply_debt(update, context, have_grams)
 
-    plan_rows = context.user_data["plan_rows"]
+
+async def reply_debt(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, have_grams: float, header: Optional[str] = None
+) -> int:
     last_price_per_gram = context.user_data["last_price"]
-    months_fact = context.user_data["months_fact"]
-    avg_ret = context.user_data["avg_ret"]
+    cur = context.user_data.get("currency", "EUR")
+    lines = [header] if header else []
 
-    total_grams_plan = sum(r.grams_for_budget for r in plan_rows)
+    total_grams_plan = context.user_data["plan_total"]
 
     if have_grams >= total_grams_plan:
         extra = have_grams - total_grams_plan
         extra_eur = extra * last_price_per_gram
-        await update.message.reply_text(
-            label(
-                context,
-                f"✅ План перекрыт. Избыток: {extra:.4f} г (~{extra_eur:.2f} EUR по текущей цене).",
-                f"✅ Plan exceeded. Surplus: {extra:.4f} g (~{extra_eur:.2f} EUR at current price).",
-            )
-        )
+        lines.append(tr(context, "debt.surplus", grams=extra, value=extra_eur, cur=cur))
+        await reply(update, "\n".join(lines), menu_keyboard(context, "child"))
         return CHILD_ACTION
 
     debt_grams = total_grams_plan - have_grams
     debt_eur_now = debt_grams * last_price_per_gram
     context.user_data["debt_grams"] = debt_grams
 
-    await update.message.reply_text(
-        label(
-            context,
-            f"📉 Не хватает {debt_grams:.4f} г (~{debt_eur_now:.2f} EUR по текущей цене).",
-            f"📉 You miss {debt_grams:.4f} g (~{debt_eur_now:.2f} EUR at current price).",
-        )
-    )
-    await update.message.reply_text(
-        label(
-            context,
-            "📆 На сколько месяцев разделить долг? (например 3 или 6):",
-            "📆 Over how many months to split the debt? (e.g. 3 or 6):",
-        )
-    )
+    lines.append(tr(context, "debt.missing", grams=debt_grams, value=debt_eur_now, cur=cur))
+    lines.append(tr(context, "debt.ask_split"))
+    await reply(update, "\n".join(lines))
     return CHILD_DEBT_SPLIT
 
 
@@ -629,25 +780,20 @@ async def child_debt_split(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         if n_months <= 0:
             raise ValueError
     except ValueError:
-        await update.message.reply_text(
-            label(context, "❌ Некорректное число месяцев.", "❌ Invalid number of months.")
-        )
+        await update.message.reply_text(tr(context, "debt.bad_split"))
+        return CHILD_DEBT_SPLIT
+    if n_months > max_units("debt"):
+        await update.message.reply_text(tr(context, "debt.too_many_months", limit=max_units("debt")))
         return CHILD_DEBT_SPLIT
 
     context.user_data["debt_n_months"] = n_months
-    await update.message.reply_text(
-        label(
-            context,
-            "➕ Учитывать базовый план (ежемесячный вес) в рассрочке? (да/нет):",
-            "➕ Include base monthly weight in installments? (yes/no):",
-        )
-    )
+    await reply(update, tr(context, "debt.ask_include_base"), menu_keyboard(context, "yes_no"))
     return CHILD_DEBT_INCLUDE_BASE
 
 
 async def child_debt_include_base(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    s = update.message.text.strip().lower()
-    include_base_plan = s in ("да", "yes", "y")
+    s = user_input(update).lower()
+    include_base_plan = s in i18n.yes_words()
     context.user_data["debt_include_base"] = include_base_plan
 
     plan_rows = context.user_data["plan_rows"]
@@ -656,95 +802,58 @@ async def child_debt_include_base(update: Update, context: ContextTypes.DEFAULT_
     avg_ret = context.user_data["avg_ret"]
     debt_grams = context.user_data["debt_grams"]
     n_months = context.user_data["debt_n_months"]
+    cur = context.user_data.get("currency", "EUR")
+    eur_rate = context.user_data.get("eur_rate", 1.0)
 
     months_fact = len(plan_rows)
-    total_grams_plan = sum(r.grams_for_budget for r in plan_rows)
+    total_grams_plan = context.user_data["plan_total"]
+    base_grams = total_grams_plan / months_fact if include_base_plan else 0.0
+
+    try:
+        async with guard(context.user_data["user_id"], "debt", n_months):
+            schedule, total_cost_installments = await get_compute().run(
+                installment_schedule, last_price_per_gram, avg_ret, debt_grams, n_months, base_grams, eur_rate,
+                size=n_months,
+            )
+    except ComputeError as e:
+        await reply_compute_error(update, context, e)
+        return CHILD_DEBT_INCLUDE_BASE
+    except LimitError as e:
+        await reply_limited(update, context, e)
+        return CHILD_DEBT_INCLUDE_BASE
 
     part_grams = debt_grams / n_months
 
-    lines = []
-    lines.append(
-        label(
-            context,
-            f"📉 Общий долг: {debt_grams:.4f} г, делим на {n_months} месяцев ≈ {part_grams:.4f} г долга в месяц.",
-            f"📉 Total debt: {debt_grams:.4f} g, split into {n_months} months ≈ {part_grams:.4f} g per month.",
-        )
-    )
-    lines.append(
-        label(
-            context,
-            "📈 Предполагаем рост цены по средней месячной доходности.\n",
-            "📈 Assuming price growth according to average monthly return.\n",
+    head = [
+        tr(context, "debt.summary", grams=debt_grams, months=n_months, part=part_grams),
+        tr(context, "debt.assumption"),
+    ]
+    # шаблон строки берём один раз, а не на каждый месяц
+    month_line = i18n.raw(get_lang(context), "debt.month_line_base" if include_base_plan else "debt.month_line")
+    months = [
+        month_line.format(
+            month=i, price=price_i, cur=cur, part=part_grams, base=base_grams,
+            grams=grams_this_month, cost=cost_i,
         )
-    )
-
-    total_cost_installments = 0.0
-    for i in range(1, n_months + 1):
-        price_i = forecast_price(last_price_per_gram, avg_ret, i)
-        grams_this_month = part_grams
-        base_grams = 0.0
-        if include_base_plan:
-            avg_base_grams = total_grams_plan / months_fact
-            grams_this_month += avg_base_grams
-            base_grams = avg_base_grams
-
-        cost_i = grams_this_month * price_i
-        total_cost_installments += cost_i
-
-        if get_lang(context) == "ru":
-            line = (
-                    f"Месяц {i}: цена ~{price_i:.2f} EUR/г, "
-                    f"долг {part_grams:.4f} г"
-                    + (f", базовый план {base_grams:.4f} г" if include_base_plan else "")
-                    + f" → покупка {grams_this_month:.4f} г ≈ {cost_i:.2f} EUR"
-            )
-        else:
-            line = (
-                    f"Month {i}: price ~{price_i:.2f} EUR/g, "
-                    f"debt {part_grams:.4f} g"
-                    + (f", base plan {base_grams:.4f} g" if include_base_plan else "")
-                    + f" → buy {grams_this_month:.4f} g ≈ {cost_i:.2f} EUR"
-            )
-        lines.append(line)
+        for i, price_i, grams_this_month, cost_i in schedule
+    ]
 
     cost_now_all_debt = debt_grams * last_price_per_gram
     diff = total_cost_installments - cost_now_all_debt
 
-    lines.append(
-        label(
-            context,
-            f"\n💸 Если закрыть весь долг ({debt_grams:.4f} г) СЕЙЧАС по {last_price_per_gram:.2f} EUR/г: "
-            f"≈ {cost_now_all_debt:.2f} EUR.",
-            f"\n💸 If you close the full debt ({debt_grams:.4f} g) NOW at {last_price_per_gram:.2f} EUR/g: "
-            f"≈ {cost_now_all_debt:.2f} EUR.",
-        )
-    )
-    lines.append(
-        label(
-            context,
-            f"💳 Если тянуть рассрочку {n_months} мес (с учётом роста): ≈ {total_cost_installments:.2f} EUR.",
-            f"💳 If you use installments for {n_months} months (with growth): ≈ {total_cost_installments:.2f} EUR.",
-        )
-    )
+    tail = [
+        tr(context, "debt.now", grams=debt_grams, price=last_price_per_gram, cost=cost_now_all_debt, cur=cur),
+        tr(context, "debt.installments", months=n_months, cost=total_cost_installments, cur=cur),
+    ]
     if diff > 0:
-        lines.append(
-            label(
-                context,
-                f"⚠️ Рассрочка обойдётся дороже примерно на {diff:.2f} EUR из-за роста цены.",
-                f"⚠️ Installments will cost about {diff:.2f} EUR more due to price growth.",
-            )
-        )
+        tail.append(tr(context, "debt.costlier", diff=diff, cur=cur))
     else:
-        lines.append(
-            label(
-                context,
-                f"✅ При выбранных параметрах рассрочка выглядит выгоднее на {abs(diff):.2f} EUR (проверь допущения).",
-                f"✅ With these assumptions, installments look cheaper by {abs(diff):.2f} EUR (check assumptions).",
-            )
-        )
+        tail.append(tr(context, "debt.cheaper", diff=abs(diff), cur=cur))
 
-    await update.message.reply_text("\n".join(lines))
-    await update.message.reply_text(format_child_menu(context))
+    # итоги важнее середины графика: месяцы урезаются, чтобы ответ влез в одно сообщение
+    budget = MESSAGE_MAX_CHARS - sum(len(s) + 1 for s in head + tail)
+    lines = head + clip_lines(months, budget, omitted_lines(context)) + tail
+    await reply(update, "\n".join(lines), menu_keyboard(context, "child"))
     return CHILD_ACTION
 
 
@@ -755,121 +864,256 @@ async def child_buy_ahead_weight(update: Update, context: ContextTypes.DEFAULT_T
     try:
         weight_now = float(s)
     except ValueError:
-        await update.message.reply_text(
-            label(context, "❌ Неверное число. Введи граммы:", "❌ Invalid number. Enter grams:")
-        )
+        await update.message.reply_text(tr(context, "input.bad_grams"))
         return CHILD_BUY_AHEAD_WEIGHT
 
     plan_rows = context.user_data["plan_rows"]
     last_price_per_gram = context.user_data["last_price"]
     months_fact = len(plan_rows)
+    cur = context.user_data.get("currency", "EUR")
+    eur_rate = context.user_data.get("eur_rate", 1.0)
 
     price_now = last_price_per_gram
     cost_now = price_now * weight_now
 
     if not plan_rows:
-        await update.message.reply_text(
-            label(context, "⚠️ Нет плана для сравнения.", "⚠️ No plan to compare."),
-        )
+        await reply(update, tr(context, "buy_ahead.no_plan"), menu_keyboard(context, "child"))
         return CHILD_ACTION
 
-    total_plan_grams = [r.grams_for_budget for r in plan_rows]
-    grams_left = weight_now
-    months_covered = 0
-    for g in total_plan_grams:
-        if grams_left >= g:
-            grams_left -= g
-            months_covered += 1
-        else:
-            break
+    avg_ret = average_monthly_return_with_target(plan_rows, months_fact, eur_rate)
+    try:
+        async with guard(context.user_data["user_id"], "buy_ahead"):
+            months_covered, cost_if_monthly = await get_compute().run(
+                simulate_buy_ahead, [r.grams_for_budget for r in plan_rows], price_now, avg_ret, weight_now, eur_rate,
+                size=len(plan_rows),
+            )
+    except ComputeError as e:
+        await reply_compute_error(update, context, e)
+        return CHILD_BUY_AHEAD_WEIGHT
+    except LimitError as e:
+        await reply_limited(update, context, e)
+        return CHILD_BUY_AHEAD_WEIGHT
 
-    avg_ret = average_monthly_return_with_target(plan_rows, months_fact)
-    grams_to_simulate = weight_now
-    month_index = 1
-    cost_if_monthly = 0.0
+    diff = cost_if_monthly - cost_now
 
-    while grams_to_simulate > 1e-6 and month_index <= months_fact * 5:
-        p_m = forecast_price(price_now, avg_ret, month_index)
-        plan_g = plan_rows[min(month_index - 1, months_fact - 1)].grams_for_budget
-        g_buy = min(plan_g, grams_to_simulate)
-        cost_if_monthly += g_buy * p_m
-        grams_to_simulate -= g_buy
-        month_index += 1
+    lines = [
+        tr(context, "buy_ahead.cost_now", grams=weight_now, price=price_now, cost=cost_now, cur=cur),
+        tr(context, "buy_ahead.covers", months=months_covered),
+        tr(context, "buy_ahead.monthly", cost=cost_if_monthly, cur=cur),
+    ]
+    if diff > 0:
+        lines.append(tr(context, "buy_ahead.saves", diff=diff, cur=cur))
+    else:
+        lines.append(tr(context, "buy_ahead.costlier", diff=abs(diff), cur=cur))
 
-    diff = cost_if_monthly - cost_now
+    await reply(update, "\n".join(lines), menu_keyboard(context, "child"))
+    return CHILD_ACTION
 
-    lines = []
-    lines.append(
-        label(
-            context,
-            f"🛒 Покупка {weight_now:.4f} г по текущей цене {price_now:.2f} EUR/г обойдётся ≈ {cost_now:.2f} EUR.",
-            f"🛒 Buying {weight_now:.4f} g at current price {price_now:.2f} EUR/g will cost ≈ {cost_now:.2f} EUR.",
-        )
-    )
-    lines.append(
-        label(
-            context,
-            f"📦 При расходовании по плану это покрывает примерно {months_covered} месяцев.",
-            f"📦 At planned pace this covers around {months_covered} months.",
+
+# ========= АДМИН-КОМАНДЫ =========
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/profile on [порог_мс] | off | status"""
+    if not is_admin(update):
+        return
+    args = context.args or []
+    state = gold_profiling_telega.state
+    if args and args[0] == "on":
+        try:
+            threshold = float(args[1]) if len(args) > 1 else None
+        except ValueError:
+            await update.message.reply_text("Usage: /profile on [threshold_ms] | off | status")
+            return
+        state.enable(threshold)
+    elif args and args[0] == "off":
+        state.disable()
+    await update.message.reply_text(gold_profiling_telega.status_text())
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/stats [refresh] — сводка по всем планам (кэшируется на STATS_TTL_SEC)."""
+    if not is_admin(update):
+        return
+    refresh = bool(context.args) and context.args[0] == "refresh"
+    stats = await asyncio.to_thread(gold_admin_telega.get_stats, refresh)
+    await update.message.reply_text(gold_admin_telega.render_stats(stats))
+
+
+async def reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/reminders on | off — ежемесячные напоминания о покупке."""
+    off = bool(context.args) and context.args[0].lower() == "off"
+    await asyncio.to_thread(get_user_prefs().set, update.effective_user.id, off=off)
+    await update.message.reply_text(tr(context, "reminders.off" if off else "reminders.on"))
+
+
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/alert below|above <цена> [валюта] [инструмент] | list | off <номер>|all"""
+    user_id = update.effective_user.id
+    args = context.args or []
+    action = args[0].lower() if args else ""
+
+    if action == "list":
+        alerts = await asyncio.to_thread(gold_alerts_telega.load_user_alerts, user_id)
+        if not alerts:
+            await update.message.reply_text(tr(context, "alert.none"))
+            return
+        line = i18n.raw(get_lang(context), "alert.line")
+        await update.message.reply_text("\n".join(
+            line.format(
+                n=a.alert_id, instrument=instrument_name(context, a.instrument),
+                direction=tr(context, f"alert.{a.direction}"), threshold=a.threshold, cur=a.currency,
+            )
+            for a in alerts
+        ))
+        return
+
+    if action == "off":
+        ids = None
+        if len(args) > 1 and args[1].lower() != "all":
+            try:
+                ids = [int(x.lstrip("#")) for x in args[1:]]
+            except ValueError:
+                await update.message.reply_text(tr(context, "alert.usage"))
+                return
+        count = await asyncio.to_thread(gold_alerts_telega.remove_alerts, user_id, ids)
+        await update.message.reply_text(tr(context, "alert.removed", count=count))
+        return
+
+    parsed = gold_alerts_telega.parse_alert_args(args)
+    if parsed is None:
+        await update.message.reply_text(tr(context, "alert.usage"))
+        return
+    direction, threshold, currency, instrument = parsed
+    try:
+        book = await asyncio.to_thread(ensure_price_book, instrument)
+    except PriceSourceError as e:
+        await update.message.reply_text(tr(context, "error.price_source", error=e))
+        return
+    price = book.gram_price(currency)
+    if price is None:
+        await update.message.reply_text(
+            tr(context, "alert.no_price", instrument=instrument_name(context, instrument), cur=currency)
         )
-    )
-    lines.append(
-        label(
-            context,
-            f"⏱ Если покупать те же граммы постепенно по прогнозным ценам, стоимость была бы ≈ {cost_if_monthly:.2f} EUR.",
-            f"⏱ If you bought the same grams gradually at forecast prices, cost would be ≈ {cost_if_monthly:.2f} EUR.",
+        return
+    try:
+        alert = await asyncio.to_thread(
+            gold_alerts_telega.add_alert, user_id, instrument, currency, direction, threshold
         )
-    )
-    if diff > 0:
-        lines.append(
-            label(
-                context,
-                f"✅ Покупка сейчас экономит примерно {diff:.2f} EUR по сравнению с покупкой помесячно.",
-                f"✅ Buying now saves about {diff:.2f} EUR vs monthly purchases.",
-            )
+    except ValueError:
+        await update.message.reply_text(
+            tr(context, "alert.too_many", limit=gold_alerts_telega.MAX_ALERTS_PER_USER)
         )
-    else:
-        lines.append(
-            label(
-                context,
-                f"⚠️ Покупка сейчас обойдётся примерно на {abs(diff):.2f} EUR дороже, чем покупка помесячно.",
-                f"⚠️ Buying now will cost about {abs(diff):.2f} EUR more than monthly purchases.",
-            )
+        return
+    await update.message.reply_text(tr(
+        context, "alert.added", n=alert.alert_id, instrument=instrument_name(context, instrument),
+        direction=tr(context, f"alert.{direction}"), threshold=threshold, cur=currency, price=price,
+    ))
+
+
+# ========= ОСНОВНОЙ LAUNCHER =========
+
+def _wrap(handler, conversation: bool = True):
+    """Метрики и профилировщик; conversation=False — команда вне диалога, в активных не учитывается."""
+    return instrument_handler(profiled(handler), ConversationHandler.END, active=conversation)
+
+
+def _text(handler) -> MessageHandler:
+    return MessageHandler(filters.TEXT & ~filters.COMMAND, _wrap(handler))
+
+
+def _button(handler, prefix: str) -> CallbackQueryHandler:
+    return CallbackQueryHandler(_wrap(handler), pattern=f"^{prefix}:")
+
+
+async def stale_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка из старого сообщения, не подходящая к текущему шагу диалога."""
+    await update.callback_query.answer(tr(context, "menu.unknown"))
+
+
+def build_conversation() -> ConversationHandler:
+    # те же шаги принимают и текст (цифры меню), и нажатия inline-кнопок
+    with warnings.catch_warnings():
+        # диалог ведётся по чату, а не по сообщению с кнопками — так и задумано
+        warnings.filterwarnings("ignore", message=".*per_message.*", category=PTBUserWarning)
+        return ConversationHandler(
+            entry_points=[CommandHandler("start", _wrap(start))],
+            states={
+                LANG_CHOOSE: [_text(choose_lang), _button(choose_lang, "lang")],
+                MAIN_MENU: [_text(main_menu), _button(main_menu, "main")],
+                ADD_ID: [_text(add_child_id)],
+                ADD_NAME: [_text(add_child_name)],
+                ADD_BIRTH: [_text(add_child_birth)],
+                ADD_TARGET: [_text(add_child_target), _button(add_child_target, "target")],
+                ADD_INSTRUMENT: [_text(add_child_instrument), _button(add_child_instrument, "inst")],
+                ADD_CURRENCY: [_text(add_child_currency), _button(add_child_currency, "cur")],
+                ADD_BUDGET: [_text(add_child_budget)],
+                CHILD_MENU: [_text(child_menu_enter), _button(child_menu_enter, "open")],
+                CHILD_ACTION: [_text(child_action), _button(child_action, "child")],
+                CHILD_STATUS_HAVE: [_text(child_status_have)],
+                CHILD_DEBT_HAVE: [_text(child_debt_have)],
+                CHILD_DEBT_SPLIT: [_text(child_debt_split)],
+                CHILD_DEBT_INCLUDE_BASE: [_text(child_debt_include_base), _button(child_debt_include_base, "base")],
+                CHILD_BUY_AHEAD_WEIGHT: [_text(child_buy_ahead_weight)],
+                CHILD_PURCHASE: [_text(child_purchase)],
+            },
+            fallbacks=[CommandHandler("start", _wrap(start))],
         )
 
-    await update.message.reply_text("\n".join(lines))
-    await update.message.reply_text(format_child_menu(context))
-    return CHILD_ACTION
 
+def build_application(token: str) -> Application:
+    prices = enable_multi_worker() if MULTI_WORKER else None
+    get_compute().start()
+
+    def start_leader_tasks(application: Application) -> None:
+        application.create_task(gold_alerts_telega.start_alerts(application.bot).loop())
+        if REMINDERS:
+            application.create_task(ReminderScheduler(application.bot).loop())
+        if gold_recalc_telega.RECALC:
+            gold_recalc_telega.start_recalc()
+
+    async def post_init(application: Application) -> None:
+        if prices is None:
+            start_leader_tasks(application)
+            return
+        # последователь может стать лидером позже — из потока, поэтому через цикл событий
+        loop = asyncio.get_running_loop()
+        prices.on_leader(lambda: loop.call_soon_threadsafe(start_leader_tasks, application))
+
+    application = Application.builder().token(token).post_init(post_init).build()
+    conversation = build_conversation()
+    if SHADOW_LOG:
+        # группа -1: запись до обработки, состояние диалога — ещё прежнее
+        recorder = gold_shadow_telega.Recorder(
+            Path(SHADOW_LOG),
+            conversation,
+            {ADD_NAME: gold_shadow_telega.scrub_name, ADD_BIRTH: gold_shadow_telega.scrub_birth},
+            anon_states=(ADD_ID, CHILD_MENU),
+            anon_callbacks=("open",),
+        )
+        application.add_handler(TypeHandler(Update, recorder.record), group=-1)
+    application.add_handler(conversation)
+    application.add_handler(CallbackQueryHandler(_wrap(stale_button, conversation=False)))
+    application.add_handler(CommandHandler("profile", _wrap(profile_command, conversation=False)))
+    application.add_handler(CommandHandler("stats", _wrap(stats_command, conversation=False)))
+    application.add_handler(CommandHandler("reminders", _wrap(reminders_command, conversation=False)))
+    application.add_handler(CommandHandler("alert", _wrap(alert_command, conversation=False)))
+    return application
 
-# ========= ОСНОВНОЙ LAUNCHER =========
 
 def main() -> None:
-    application = Application.builder().token(TOKEN).build()
-
-    conv = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
-        states={
-            LANG_CHOOSE: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_lang)],
-            MAIN_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu)],
-            ADD_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_child_id)],
-            ADD_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_child_name)],
-            ADD_BIRTH: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_child_birth)],
-            ADD_TARGET: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_child_target)],
-            ADD_BUDGET: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_child_budget)],
-            CHILD_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, child_menu_enter)],
-            CHILD_ACTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, child_action)],
-            CHILD_STATUS_HAVE: [MessageHandler(filters.TEXT & ~filters.COMMAND, child_status_have)],
-            CHILD_DEBT_HAVE: [MessageHandler(filters.TEXT & ~filters.COMMAND, child_debt_have)],
-            CHILD_DEBT_SPLIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, child_debt_split)],
-            CHILD_DEBT_INCLUDE_BASE: [MessageHandler(filters.TEXT & ~filters.COMMAND, child_debt_include_base)],
-            CHILD_BUY_AHEAD_WEIGHT: [MessageHandler(filters.TEXT & ~filters.COMMAND, child_buy_ahead_weight)],
-        },
-        fallbacks=[CommandHandler("start", start)],
-    )
+    if not TOKEN:
+        raise SystemExit("TELEGRAM_TOKEN is not set (env or .env).")
+    if METRICS_PORT:
+        start_metrics_server(int(METRICS_PORT))
+    run_application(build_application(TOKEN))
+
 
-    application.add_handler(conv)
-    application.run_polling()
+def run_application(application: Application) -> None:
+    if WEBHOOK_URL:
+        # pip install "python-telegram-bot[webhooks]"
+        application.run_webhook(listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, webhook_url=WEBHOOK_URL)
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+# gold_uploads_telega.py
+"""
+Кэш file_id для файлов, которые бот отправляет в Telegram (CSV, графики).
+
+Ключ — sha256 от вида вложения, имени файла и содержимого. Если такие
+же байты уже уходили, повторно отправляется только file_id, без загрузки.
+Сам Telegram file_id не устаревает, но может не подойти (другой токен бота) —
+тогда запись удаляется и файл грузится заново.
+
+Записи лежат в LRU на UPLOAD_CACHE_SIZE элементов и сохраняются в
+DATA_DIR/uploads.json после каждой новой загрузки (атомарная запись в
+потоке), так что после перезапуска байты снова не грузятся.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from telegram import Chat, InputFile, Message
+from telegram.error import BadRequest
+
+import gold_core_telega
+from gold_metrics_telega import cache_hit, counter
+from gold_scheduler_telega import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CACHE_SIZE = int(os.getenv("UPLOAD_CACHE_SIZE", "10000"))
+KINDS = ("document", "photo")
+
+UPLOADED_BYTES = counter("gold_uploaded_bytes_total", "File bytes uploaded to Telegram", ["kind"])
+
+
+def content_key(kind: str, filename: str, data: bytes) -> str:
+    h = hashlib.sha256()
+    h.update(f"{kind}\0{filename}\0".encode("utf-8"))
+    h.update(data)
+    return h.hexdigest()
+
+
+class UploadCache:
+    """LRU content_key -> file_id с сохранением на диск."""
+
+    def __init__(self, max_entries: int = UPLOAD_CACHE_SIZE, path: Optional[Path] = None):
+        self.max_entries = max_entries
+        self._path = path
+        self._entries: "Optional[OrderedDict[str, str]]" = None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self._path or gold_core_telega.ensure_data_dir() / "uploads.json"
+
+    def _load(self) -> "OrderedDict[str, str]":
+        # вызывается под self._lock
+        if self._entries is None:
+            try:
+                raw = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                raw = {}
+            # в файле — от старых к новым, как в LRU
+            self._entries = OrderedDict(list(raw.items())[-self.max_entries:])
+        return self._entries
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entries = self._load()
+            file_id = entries.get(key)
+            if file_id is not None:
+                entries.move_to_end(key)
+        cache_hit("upload", file_id is not None)
+        return file_id
+
+    def put(self, key: str, file_id: str) -> None:
+        with self._lock:
+            entries = self._load()
+            entries[key] = file_id
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            self._load().pop(key, None)
+
+    def save(self) -> None:
+        with self._lock:
+            snapshot = dict(self._load())
+        with self._save_lock:
+            write_json_atomic(self.path, snapshot)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+
+
+_cache = UploadCache()
+
+
+def get_upload_cache() -> UploadCache:
+    return _cache
+
+
+def _file_id(message: Message, kind: str) -> Optional[str]:
+    if kind == "photo":
+        return message.photo[-1].file_id if message.photo else None
+    return message.document.file_id if message.document else None
+
+
+async def send_cached(
+    chat: Chat, kind: str, data: bytes, filename: str, caption: Optional[str] = None
+) -> Message:
+    """
+    Отправить документ или фото: по file_id, если такие байты уже уходили,
+    иначе загрузить и запомнить file_id.
+    """
+    send = chat.send_photo if kind == "photo" else chat.send_document
+    key = content_key(kind, filename, data)
+    file_id = _cache.get(key)
+    if file_id is not None:
+        try:
+            return await send(file_id, caption=caption)
+        except BadRequest as e:
+            logger.warning("Cached %s file_id rejected, uploading again: %s", kind, e)
+            _cache.forget(key)
+
+    message = await send(InputFile(data, filename=filename), caption=caption)
+    UPLOADED_BYTES.inc(len(data), kind=kind)
+    file_id = _file_id(message, kind)
+    if file_id is not None:
+        _cache.put(key, file_id)
+        await asyncio.to_thread(_cache.save)
+    return message
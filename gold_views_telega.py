@@ -0,0 +1,135 @@
+# gold_views_telega.py
+"""
+Кэш расчётов по ребёнку для меню child_action.
+
+Запись хранит всё, что зависит только от плана и цен: целевую дату,
+оставшиеся месяцы, оценку средней доходности, таблицу по годам,
+накопленные граммы плана и прогноз на 1/3/6/12/24 месяца (тексты — по языкам, лениво).
+Ключ проверки — версия плана (ChildPlan.version), версия книги цен
+(PriceBook.version) и сегодняшняя дата: от неё зависит цель "до сегодня"
+и число оставшихся месяцев.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from gold_core_telega import (
+    ChildPlan,
+    PriceSourceError,
+    average_monthly_return_with_target,
+    calc_year_stats,
+    forecast_price,
+    months_between_exact,
+    plan_prefix_grams,
+)
+import gold_i18n_telega as i18n
+from gold_market_telega import get_price_book
+from gold_metrics_telega import cache_hit
+
+FORECAST_MONTHS = (1, 3, 6, 12, 24)
+MAX_ENTRIES = 4096
+
+
+class ChildView:
+    def __init__(self, plan: ChildPlan, eur_rate: float, today: date):
+        rows = plan.plan_rows
+        self.currency = plan.currency
+        self.eur_rate = eur_rate
+        self.months_fact = len(rows)
+        self.last_price = rows[-1].price_per_gram_eur
+
+        if plan.target_age_years is not None:
+            b = plan.birth_date
+            self.target_date = date(b.year + plan.target_age_years, b.month, b.day)
+        else:
+            self.target_date = today
+        months_total = months_between_exact(plan.birth_date, self.target_date)
+        months_to_last = max(months_between_exact(plan.birth_date, rows[-1].date), self.months_fact)
+        self.remaining_months = max(0, months_total - months_to_last)
+
+        self.avg_ret = average_monthly_return_with_target(rows, self.remaining_months, eur_rate)
+        self.year_stats = calc_year_stats(rows)
+        # накопленные граммы плана: статус и долг — бисекция, а не проход по месяцам
+        self.plan_prefix = plan_prefix_grams(rows)
+        self.plan_total = self.plan_prefix[-1]
+        self.forecast = [
+            (m, forecast_price(self.last_price, self.avg_ret, m, eur_rate)) for m in FORECAST_MONTHS
+        ]
+        self._texts: Dict[Tuple[str, str], str] = {}
+
+    def years_text(self, lang: str) -> str:
+        key = (lang, "years")
+        text = self._texts.get(key)
+        if text is None:
+            lines = [i18n.t(lang, "years.title")]
+            lines.extend(f"{y}: {self.year_stats[y]:.4f} g" for y in sorted(self.year_stats))
+            text = self._texts[key] = "\n".join(lines)
+        return text
+
+    def forecast_text(self, lang: str) -> str:
+        key = (lang, "forecast")
+        text = self._texts.get(key)
+        if text is None:
+            lines = [i18n.t(lang, "forecast.avg", pct=self.avg_ret * 100)]
+            line = i18n.raw(lang, "forecast.line")
+            lines.extend(line.format(months=m, price=p, cur=self.currency) for m, p in self.forecast)
+            text = self._texts[key] = "\n".join(lines)
+        return text
+
+
+class ViewCache:
+    """LRU по (user_id, child_id); запись годна, пока совпадает штамп версий."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[tuple, ChildView]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, plan: ChildPlan, today: Optional[date] = None) -> ChildView:
+        """
+        Вид по текущей книге цен инструмента. Для плана не в EUR без книги
+        (или без курса к EUR) — PriceSourceError, а не курс 1.0.
+        """
+        today = today or date.today()
+        book = get_price_book(plan.instrument)
+        stamp = (plan.version, book.version if book is not None else None, today)
+        key = (user_id, plan.child_id)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None and hit[0] == stamp:
+                self._entries.move_to_end(key)
+                cache_hit("child_view", True)
+                return hit[1]
+        cache_hit("child_view", False)
+        if book is not None:
+            eur_rate = book.rate_to_eur(plan.currency)
+        elif plan.currency.upper() == "EUR":
+            eur_rate = 1.0
+        else:
+            raise PriceSourceError(f"Prices for {plan.instrument} are not loaded.")
+        view = ChildView(plan, eur_rate, today)
+        with self._lock:
+            self._entries[key] = (stamp, view)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return view
+
+    def invalidate(self, user_id: int, child_id: Optional[str] = None) -> None:
+        with self._lock:
+            if child_id is not None:
+                self._entries.pop((user_id, child_id), None)
+                return
+            for key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_views = ViewCache()
+
+
+def get_view_cache() -> ViewCache:
+    return _views
@@ -0,0 +1,83 @@
+"""Файл планов: round-trip схем 1 и 2, нечисловые значения, битые записи."""
+import math
+from datetime import date
+
+import pytest
+
+import gold_core_telega
+from gold_core_telega import (
+    ChildPlan,
+    PlanRow,
+    Purchase,
+    PurchaseLedger,
+    decode_plans,
+    encode_plans,
+    get_user_plans_file,
+    json_dumps_compact,
+    load_all_plans,
+    save_all_plans,
+)
+
+USER = 42
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(gold_core_telega, "DATA_DIR", tmp_path)
+    return tmp_path
+
+
+@pytest.fixture(params=["orjson", "json"])
+def json_lib(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(gold_core_telega, "_orjson", lambda: None)
+    return request.param
+
+
+def make_plan(child_id="1", budget=100.0, purchases=()):
+    return ChildPlan(
+        child_id=child_id,
+        name="Kid",
+        birth_date=date(2015, 3, 7),
+        target_age_years=18,
+        monthly_budget_eur=budget,
+        plan_rows=[PlanRow(date(2015, 3, 20), 35.5, 2.8), PlanRow(date(2015, 4, 20), 36.0, 2.7)],
+        ledger=PurchaseLedger(list(purchases)),
+    )
+
+
+def same_float(a: float, b: float) -> bool:
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+@pytest.mark.parametrize("schema", [1, 2])
+def test_round_trip(json_lib, schema):
+    plan = make_plan(purchases=[Purchase(date(2020, 1, 1), 1.5, 90.0)])
+    loaded = decode_plans(encode_plans({"1": plan}, schema=schema))
+    assert loaded["1"].plan_rows == plan.plan_rows
+    assert loaded["1"].ledger.purchases == plan.ledger.purchases
+
+
+@pytest.mark.parametrize("budget, amount", [(100.0, math.nan), (math.inf, 90.0), (100.0, -math.inf)])
+def test_non_finite_values_survive_save(json_lib, budget, amount):
+    plan = make_plan(budget=budget, purchases=[Purchase(date(2020, 1, 1), 1.0, amount)])
+    save_all_plans({"1": plan, "2": make_plan("2")}, USER)
+    loaded = load_all_plans(USER)
+    assert set(loaded) == {"1", "2"}
+    assert same_float(loaded["1"].monthly_budget_eur, budget)
+    assert same_float(loaded["1"].ledger.purchases[0].amount, amount)
+
+
+def test_unreadable_plan_is_logged_and_kept(data_dir, caplog):
+    good = make_plan("1").to_compact()
+    bad = make_plan("2").to_compact()
+    bad["monthly_budget_eur"] = None  # так orjson записал inf до исправления
+    get_user_plans_file(USER).write_bytes(json_dumps_compact({"schema": 2, "plans": {"1": good, "2": bad}}))
+
+    assert set(load_all_plans(USER)) == {"1"}
+    assert "Unreadable plan '2'" in caplog.text
+    kept = list(data_dir.glob(f"plans_user_{USER}.json.bad-*"))
+    assert len(kept) == 1
+    assert b'"2"' in kept[0].read_bytes()
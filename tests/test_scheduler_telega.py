@@ -0,0 +1,91 @@
+"""Напоминания: кого отмечать после пачки и журнал отправленных."""
+import asyncio
+from datetime import date
+
+import pytest
+
+import gold_core_telega
+import gold_scheduler_telega
+from gold_core_telega import register_child, save_all_plans
+from gold_loadtest_telega import prepare_environment
+from gold_market_telega import get_price_book
+from gold_scheduler_telega import ReminderScheduler, SendReport, SentLog, get_user_prefs, reminder_due_date
+
+DELIVERED, FAILED, BLOCKED, OFF = 101, 102, 103, 104
+MONTH_DAY = max(date.today(), reminder_due_date(date.today().year, date.today().month))
+MONTH = f"{MONTH_DAY.year:04d}-{MONTH_DAY.month:02d}"
+
+
+class FakeSender:
+    """Отвечает за Telegram: failing — кому отправка не удалась, blocked — кто заблокировал бота."""
+
+    def __init__(self, failing=(), blocked=()):
+        self.failing = set(failing)
+        self.blocked = set(blocked)
+        self.calls = []
+
+    async def send_batch(self, messages):
+        report = SendReport()
+        for chat_id, _ in messages:
+            self.calls.append(chat_id)
+            if chat_id in self.failing:
+                report.failed += 1
+            elif chat_id in self.blocked:
+                report.blocked.append(chat_id)
+            else:
+                report.sent += 1
+                report.delivered.append(chat_id)
+        return report
+
+
+@pytest.fixture(autouse=True)
+def environment(tmp_path, monkeypatch):
+    # prepare_environment подменяет DATA_DIR; monkeypatch вернёт прежний после теста
+    monkeypatch.setattr(gold_core_telega, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(gold_scheduler_telega, "_prefs", gold_scheduler_telega.UserPrefs())
+    prepare_environment(tmp_path, years=10)
+    plan = register_child("1", "Kid", date(2016, 5, 20), 18, 100.0, get_price_book("XAU").points("EUR"))
+    for uid in (DELIVERED, FAILED, BLOCKED, OFF):
+        save_all_plans({"1": plan}, uid)
+    get_user_prefs().set(OFF, off=True)
+
+
+def run(scheduler: ReminderScheduler) -> SendReport:
+    return asyncio.run(scheduler.run_once(today=MONTH_DAY))
+
+
+def test_only_delivered_blocked_and_skipped_users_are_marked():
+    sender = FakeSender(failing={FAILED}, blocked={BLOCKED})
+    run(ReminderScheduler(bot=None, sender=sender, batch_size=2))
+
+    assert sorted(sender.calls) == [DELIVERED, FAILED, BLOCKED]
+    marked = SentLog().months
+    assert marked == {DELIVERED: MONTH, BLOCKED: MONTH, OFF: MONTH}
+    assert get_user_prefs().read(BLOCKED).get("off") is True
+
+
+def test_failed_users_are_retried_on_next_run():
+    sender = FakeSender(failing={FAILED})
+    scheduler = ReminderScheduler(bot=None, sender=sender)
+    run(scheduler)
+    sender.failing.clear()
+    sender.calls.clear()
+
+    run(scheduler)
+
+    assert sender.calls == [FAILED]
+    assert SentLog().months[FAILED] == MONTH
+
+
+def test_sent_log_replays_journal_of_interrupted_run():
+    log = SentLog()
+    log.mark([1, 2], "2026-01")
+    log.mark([3], "2026-01")
+    with open(log.log_path, "a", encoding="utf-8") as f:
+        f.write('{"4": "2026')  # запись оборвалась на середине
+
+    reloaded = SentLog()
+
+    assert reloaded.months == {1: "2026-01", 2: "2026-01", 3: "2026-01"}
+    assert not reloaded.log_path.exists()
+    assert SentLog().months == reloaded.months
@@ -0,0 +1,92 @@
+"""Теневой прогон: что пишет Recorder и сходится ли воспроизведение записи."""
+import asyncio
+import gzip
+import json
+
+import pytest
+from telegram import Update
+from telegram.ext import ConversationHandler, TypeHandler
+
+import gold_core_telega
+import gold_shadow_telega
+from gold_loadtest_telega import BUTTON_SCENARIO, SCENARIO, UpdateFactory, build_app, prepare_environment
+
+CHILD_ID = "Secret-7"
+
+
+@pytest.fixture
+def log_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(gold_core_telega, "DATA_DIR", tmp_path)
+    prepare_environment(tmp_path, years=10)
+    return tmp_path / "shadow"
+
+
+def with_child_id(scenario):
+    """Сценарий нагрузочного прогона, где ID ребёнка — CHILD_ID, а не "1"."""
+    out = []
+    for step, text in scenario:
+        if step in ("add_child_id", "child_menu_enter"):
+            text = "@open:" + CHILD_ID if text.startswith("@") else CHILD_ID
+        out.append(text)
+    return out
+
+
+async def record(log_dir, sessions):
+    import gold_telega
+
+    app, bot = await build_app()
+    conversation = next(h for h in app.handlers[0] if isinstance(h, ConversationHandler))
+    recorder = gold_shadow_telega.Recorder(
+        log_dir,
+        conversation,
+        {gold_telega.ADD_NAME: gold_shadow_telega.scrub_name, gold_telega.ADD_BIRTH: gold_shadow_telega.scrub_birth},
+        anon_states=(gold_telega.ADD_ID, gold_telega.CHILD_MENU),
+        anon_callbacks=("open",),
+    )
+    app.add_handler(TypeHandler(Update, recorder.record), group=-1)
+    factory = UpdateFactory(bot)
+    for user_id, texts in sessions.items():
+        for text in texts:
+            await app.process_update(factory.update(user_id, text))
+    await app.shutdown()
+    recorder.close()
+    return recorder
+
+
+def logged_texts(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [obj[3] for obj in map(json.loads, f) if isinstance(obj, list)]
+
+
+def test_child_ids_are_scrubbed_consistently(log_dir):
+    recorder = asyncio.run(record(log_dir, {11: with_child_id(SCENARIO), 12: with_child_id(BUTTON_SCENARIO)}))
+    texts = logged_texts(recorder.path)
+    raw = recorder.path.read_bytes()
+
+    token = recorder.anon_text(CHILD_ID)
+    assert CHILD_ID not in "".join(texts)
+    assert CHILD_ID.encode() not in gzip.decompress(raw)
+    # набранный ID и ID в кнопке open: заменяются одинаково
+    assert texts.count(token) == 3
+    assert "@open:" + token in texts
+    # имя и день рождения вычищаются, как и раньше
+    assert "Kid" not in texts
+    assert "2012-05-01" in texts and "2012-05-20" not in texts
+
+
+def test_other_callbacks_are_kept(log_dir):
+    recorder = asyncio.run(record(log_dir, {12: with_child_id(BUTTON_SCENARIO)}))
+    texts = logged_texts(recorder.path)
+    assert "@lang:en" in texts
+    assert any(t.startswith("@child:") for t in texts)
+
+
+def test_replay_of_scrubbed_log_follows_recorded_states(log_dir):
+    asyncio.run(record(log_dir, {11: with_child_id(SCENARIO), 12: with_child_id(BUTTON_SCENARIO)}))
+    records = gold_shadow_telega.load_records([log_dir])
+
+    result = asyncio.run(gold_shadow_telega.replay_records(records))
+
+    assert result["updates"] == len(SCENARIO) + len(BUTTON_SCENARIO)
+    assert result["users"] == 2
+    assert result["state_mismatches"] == 0
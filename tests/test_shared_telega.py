@@ -0,0 +1,158 @@
+"""Режим нескольких воркеров: общий файл цен, хранилище планов, лидерство."""
+import os
+import threading
+from array import array
+from datetime import date
+
+import pytest
+
+import gold_core_telega
+import gold_shared_telega
+from gold_core_telega import ChildPlan, PlanRow, PriceSeries, PriceSourceError, Purchase
+from gold_market_telega import PriceBook
+from gold_shared_telega import (
+    LeaderLock,
+    MappedPrices,
+    MultiWorkerPrices,
+    PlanStore,
+    SharedPriceReader,
+    prices_file,
+    publish_book,
+    shared_dir,
+)
+
+USER = 7
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(gold_core_telega, "DATA_DIR", tmp_path)
+    return tmp_path
+
+
+def series(n: int, start: float) -> PriceSeries:
+    first = date(2020, 1, 1).toordinal()
+    return PriceSeries(array("l", range(first, first + n)), array("d", (start + i for i in range(n))))
+
+
+def book(eur: PriceSeries, usd: PriceSeries) -> PriceBook:
+    return PriceBook(base=None, fx={}, direct={"EUR": eur, "USD": usd}, instrument="XAU", loaded_at=1000.0)
+
+
+def make_plan(child_id="1", currency="EUR", instrument="XAU", budget=100.0) -> ChildPlan:
+    return ChildPlan(
+        child_id=child_id,
+        name="Kid",
+        birth_date=date(2015, 3, 7),
+        target_age_years=18,
+        monthly_budget_eur=budget,
+        plan_rows=[PlanRow(date(2015, 3, 20), 35.5, 2.8)],
+        currency=currency,
+        instrument=instrument,
+    )
+
+
+# ========= ОБЩИЙ ФАЙЛ ЦЕН =========
+
+def test_published_book_reads_back_through_mmap():
+    eur, usd = series(500, 1000.0), series(300, 1200.0)
+    publish_book(book(eur, usd), generation=5)
+
+    mapped = SharedPriceReader().book("XAU")
+
+    assert mapped.version == 5
+    assert mapped.loaded_at == 1000.0
+    for cur, expected in (("EUR", eur), ("USD", usd)):
+        got = mapped.series(cur)
+        assert list(got.ordinals) == list(expected.ordinals)
+        assert list(got.closes) == list(expected.closes)
+
+
+def test_reader_picks_up_republished_file_and_keeps_old_mapping():
+    reader = SharedPriceReader()
+    publish_book(book(series(10, 1.0), series(10, 2.0)), generation=1)
+    old = reader.book("XAU")
+    assert reader.book("XAU").version == 1
+
+    publish_book(book(series(20, 3.0), series(20, 4.0)), generation=2)
+    new = reader.book("XAU")
+
+    assert new.version == 2
+    assert len(new.series("EUR")) == 20
+    # книга, выданная до замены файла, читается по-прежнему
+    assert list(old.series("EUR").closes)[:2] == [1.0, 2.0]
+
+
+def test_reader_without_published_file_returns_none():
+    assert SharedPriceReader().book("XAU") is None
+
+
+def test_mapped_prices_rejects_foreign_file():
+    path = prices_file("XAU")
+    path.write_bytes(b"NOPE" + bytes(64))
+    with pytest.raises(PriceSourceError):
+        MappedPrices(path)
+
+
+# ========= ЛИДЕР =========
+
+def test_follower_takes_over_when_leader_exits(monkeypatch):
+    monkeypatch.setattr(gold_shared_telega, "LEADER_RETRY_SEC", 0.01)
+    monkeypatch.setattr(gold_shared_telega, "LEADER_POLL_SEC", 3600)
+    monkeypatch.setattr(gold_shared_telega, "_stop_refresher", threading.Event())
+    leader = LeaderLock(shared_dir() / "leader.lock")
+    follower = MultiWorkerPrices()
+    assert leader.is_leader and not follower.leader.is_leader
+
+    became = threading.Event()
+    follower.on_leader(became.set)
+    stop = threading.Event()
+    thread = threading.Thread(target=follower.follower_loop, args=(stop,), daemon=True)
+    thread.start()
+    assert not became.wait(0.1)
+
+    os.close(leader._fd)  # лидер завершился — flock освобождён
+    try:
+        assert became.wait(2)
+        assert follower.leader.is_leader
+    finally:
+        stop.set()
+        gold_shared_telega._stop_refresher.set()  # поток обновления цен нового лидера
+        thread.join(2)
+        os.close(follower.leader._fd)
+
+
+# ========= ХРАНИЛИЩЕ ПЛАНОВ =========
+
+def test_put_child_bumps_version_and_keeps_ledger_for_same_series():
+    store = PlanStore()
+    store.put_child(USER, make_plan())
+    store.add_purchase(USER, "1", Purchase(date(2020, 1, 1), 1.0, 50.0))
+
+    plans = store.put_child(USER, make_plan(budget=200.0))
+
+    assert plans["1"].monthly_budget_eur == 200.0
+    assert len(plans["1"].ledger) == 1
+    assert store.load(USER)["1"].version == plans["1"].version
+
+
+@pytest.mark.parametrize("change", [{"currency": "USD"}, {"instrument": "XAG"}])
+def test_put_child_starts_empty_ledger_for_other_series(change):
+    store = PlanStore()
+    store.put_child(USER, make_plan())
+    store.add_purchase(USER, "1", Purchase(date(2020, 1, 1), 1.0, 50.0))
+
+    plans = store.put_child(USER, make_plan(**change))
+
+    assert len(plans["1"].ledger) == 0
+
+
+def test_parallel_put_child_keeps_every_child():
+    store = PlanStore()
+    threads = [threading.Thread(target=store.put_child, args=(USER, make_plan(str(i)))) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(store.load(USER), key=int) == [str(i) for i in range(20)]
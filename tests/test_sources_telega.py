@@ -0,0 +1,152 @@
+"""Гонка источников, предохранитель и запасной источник на локальном FixtureServer."""
+import time
+
+import pytest
+
+from gold_core_telega import PriceSeries, PriceSourceError
+from gold_fixtures_telega import INVESTING_WINDOW_ROWS, FixtureServer, fixture_series
+from gold_sources_telega import BREAKER_FAILURES, InvestingSource, PriceSource, SourcePool, StooqSource
+
+SYMBOL = "xaueur"
+YEARS = 10
+
+
+class SlowStooq(StooqSource):
+    name = "slow-stooq"
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def fetch(self, symbol):
+        time.sleep(self.delay)
+        return super().fetch(symbol)
+
+
+@pytest.fixture
+def fixtures():
+    with FixtureServer(years=YEARS) as server:
+        yield server
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(*sources):
+        pool = SourcePool(list(sources))
+        pools.append(pool)
+        return pool
+
+    yield make
+    # фоновые запросы доигрывают до остановки сервера
+    for pool in pools:
+        pool._executor.shutdown(wait=True)
+
+
+def full_length() -> int:
+    return len(fixture_series(SYMBOL, YEARS))
+
+
+def test_price_source_is_abstract():
+    with pytest.raises(TypeError):
+        PriceSource()
+
+
+def test_race_returns_first_full_history_answer(fixtures, make_pool):
+    pool = make_pool(SlowStooq(delay=2.0), StooqSource())
+    t0 = time.perf_counter()
+    series = PriceSeries.of(pool.fetch_first(SYMBOL))
+    assert time.perf_counter() - t0 < 1.5
+    assert len(series) == full_length()
+
+
+def test_short_window_source_does_not_win_the_race(fixtures, make_pool):
+    # Investing отвечает первым, но у него только последние недели
+    pool = make_pool(SlowStooq(delay=0.5), InvestingSource())
+    series = PriceSeries.of(pool.fetch_first(SYMBOL))
+    assert len(series) == full_length()
+
+
+def test_falls_back_to_investing_when_stooq_fails(fixtures, make_pool):
+    fixtures.fail.add("stooq")
+    pool = make_pool(StooqSource(), InvestingSource())
+    series = PriceSeries.of(pool.fetch_first(SYMBOL))
+    assert len(series) == INVESTING_WINDOW_ROWS
+    assert series.ordinals[-1] == fixture_series(SYMBOL, YEARS)[-1].date.toordinal()
+    assert fixtures.requests == {"stooq": 1, "investing": 1}
+
+
+def test_rejected_answer_counts_as_failure(fixtures, make_pool):
+    fixtures.fail.add("stooq")
+    stooq, investing = StooqSource(), InvestingSource()
+    pool = make_pool(stooq, investing)
+
+    def at_least_a_year(data):
+        series = PriceSeries.of(data)
+        if len(series) < 250:
+            raise PriceSourceError("too short")
+        return series
+
+    with pytest.raises(PriceSourceError, match="too short"):
+        pool.fetch_first(SYMBOL, validate=at_least_a_year)
+    assert investing.health.consecutive_failures == 1
+
+
+def test_unknown_symbol_fails_everywhere(fixtures, make_pool):
+    pool = make_pool(StooqSource(), InvestingSource())
+    with pytest.raises(PriceSourceError, match="All sources failed"):
+        pool.fetch_first("xyzabc")
+
+
+def test_breaker_opens_and_skips_failing_source(fixtures, make_pool):
+    fixtures.fail.add("stooq")
+    stooq, investing = StooqSource(), InvestingSource()
+    pool = make_pool(stooq, investing)
+
+    for _ in range(BREAKER_FAILURES):
+        pool.fetch_first(SYMBOL)
+    assert not stooq.health.available()
+    assert stooq.health.score < investing.health.score
+
+    pool.fetch_first(SYMBOL)
+    assert fixtures.requests["stooq"] == BREAKER_FAILURES
+    assert fixtures.requests["investing"] == BREAKER_FAILURES + 1
+    report = {r["source"]: r for r in pool.health_report()}
+    assert report["stooq"]["open"] and not report["investing"]["open"]
+
+
+def test_breaker_half_open_probe_closes_on_success(fixtures, make_pool):
+    fixtures.fail.add("stooq")
+    stooq = StooqSource()
+    pool = make_pool(stooq, InvestingSource())
+    for _ in range(BREAKER_FAILURES):
+        pool.fetch_first(SYMBOL)
+    assert not stooq.health.available()
+
+    # остывание прошло: пробный запрос, источник снова здоров
+    stooq.health.open_until = 0.0
+    fixtures.fail.clear()
+    series = PriceSeries.of(pool.fetch_first(SYMBOL))
+    assert len(series) == full_length()
+    assert stooq.health.consecutive_failures == 0
+    assert stooq.health.available()
+
+
+def test_all_breakers_open_still_tries_best_source(fixtures, make_pool):
+    fixtures.fail.add("stooq")
+    stooq = StooqSource()
+    pool = make_pool(stooq)
+    for _ in range(BREAKER_FAILURES):
+        with pytest.raises(PriceSourceError):
+            pool.fetch_first(SYMBOL)
+    fixtures.fail.clear()
+    assert len(PriceSeries.of(pool.fetch_first(SYMBOL))) == full_length()
+
+
+def test_fetch_merged_joins_sources_by_date(fixtures, make_pool):
+    pool = make_pool(StooqSource(), InvestingSource())
+    merged = pool.fetch_merged(SYMBOL)
+    dates = [p.date for p in merged]
+    assert dates == sorted(set(dates))
+    assert len(merged) == full_length()